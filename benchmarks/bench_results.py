@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the results and of their reduce.
+"""
+
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import Perms, CV, Methods, Result, ResultSet
+from epac import ClassificationReport, PvalPerms
+
+
+class TimeResultSet(object):
+    """ResultSet of n results"""
+    params = [10, 100, 1000]
+
+    def setup(self, n):
+        random_state = np.random.RandomState(0)
+        self.results = [Result(key="SVC(C=%i)" % i,
+                               **{"y/test/pred": random_state.randint(
+                                   2, size=20),
+                                  "y/test/true": random_state.randint(
+                                      2, size=20)})
+                        for i in xrange(n)]
+
+    def time_construction(self, n):
+        ResultSet(*self.results)
+
+
+class TimeTreeReduce(object):
+    """Reduce of n permutations of a 5 folds CV of two methods"""
+    params = [10, 50]
+
+    def setup(self, n):
+        X, y = datasets.make_classification(n_samples=30, n_features=5,
+                                            n_informative=2,
+                                            random_state=1)
+        self.tree = Perms(CV(Methods(SVC(C=1), SVC(C=10)), n_folds=5),
+                          n_perms=n, random_state=0)
+        self.tree.run(X=X, y=y)
+
+    def time_reduce(self, n):
+        self.tree.reduce()
+
+    def time_reduce_iter(self, n):
+        for result in self.tree.reduce_iter():
+            pass
+
+
+class TimeClassificationReport(object):
+    """Reduce of the predictions of 10 folds of n samples in all"""
+    params = [100, 10000, 1000000]
+
+    def setup(self, n):
+        random_state = np.random.RandomState(0)
+        folds = np.array_split(np.arange(n), 10)
+        self.result = Result.stack(*[
+            Result(key="SVC", **{"y/test/pred": random_state.randint(
+                2, size=len(fold)),
+                "y/test/true": random_state.randint(2, size=len(fold))})
+            for fold in folds])
+        self.reducer = ClassificationReport()
+
+    def time_reduce(self, n):
+        self.reducer.reduce(self.result)
+
+
+class TimePvalPerms(object):
+    """P-values of 5 scores over n permutations"""
+    params = [100, 1000, 10000]
+
+    def setup(self, n):
+        random_state = np.random.RandomState(0)
+        self.result = Result.stack(*[
+            Result(key="SVC", **dict([("y/test/score_%i" % i,
+                                       random_state.rand(2))
+                                      for i in xrange(5)]))
+            for perm in xrange(n)])
+        self.reducer = PvalPerms()
+
+    def time_reduce(self, n):
+        self.reducer.reduce(self.result)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the save and the load of results by the stores.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from epac import StoreFs, Result, ResultSet
+from epac.stores import epac_joblib
+
+
+def make_results(n):
+    """ResultSet of two results of n float64 each"""
+    random_state = np.random.RandomState(0)
+    return ResultSet(*[Result(key="SVC(C=%i)" % c,
+                              **{"y/test/pred": random_state.rand(n),
+                                 "y/test/score_accuracy": 0.5})
+                       for c in (1, 10)])
+
+
+class TimeStoreFs(object):
+    params = [1000, 100000, 1000000]
+
+    def setup(self, n):
+        self.dirpath = tempfile.mkdtemp()
+        self.store = StoreFs(self.dirpath)
+        self.results = make_results(n)
+        self.store.save("CV/result_set", self.results)
+
+    def teardown(self, n):
+        shutil.rmtree(self.dirpath)
+
+    def time_save(self, n):
+        self.store.save("Methods/result_set", self.results)
+
+    def time_load(self, n):
+        self.store.load("CV/result_set")
+
+
+class TimeEpacJoblib(object):
+    params = [1000, 100000, 1000000]
+
+    def setup(self, n):
+        self.dirpath = tempfile.mkdtemp()
+        self.results = make_results(n)
+        self.filename = os.path.join(self.dirpath, "loaded")
+        epac_joblib.dump(self.results, self.filename)
+
+    def teardown(self, n):
+        shutil.rmtree(self.dirpath)
+
+    def time_dump(self, n):
+        epac_joblib.dump(self.results, os.path.join(self.dirpath, "dumped"))
+
+    def time_load(self, n):
+        epac_joblib.load(self.filename)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the construction and the navigation of the trees.
+"""
+
+import numpy as np
+from sklearn.svm import SVC
+from epac import Methods, Perms, CV
+from epac.workflow.splitters import CRSlicer
+from epac.configuration import conf
+
+
+class TimeTreeConstruction(object):
+    params = [10, 100, 1000]
+
+    def time_methods(self, n):
+        Methods(*[SVC(C=c) for c in xrange(1, n + 1)])
+
+    def time_perms(self, n):
+        Perms(CV(Methods(SVC(C=1), SVC(C=10)), n_folds=5), n_perms=n)
+
+    def time_cv(self, n):
+        CV(Methods(SVC(C=1), SVC(C=10)), n_folds=n)
+
+
+class TimeTreeNavigation(object):
+    """Trees of n permutations of a 5 folds CV of two methods"""
+    params = [10, 100]
+
+    def setup(self, n):
+        self.tree = Perms(CV(Methods(SVC(C=1), SVC(C=10)), n_folds=5),
+                          n_perms=n)
+        self.leaf = self.tree.get_node(
+            "Perms/Perm(nb=%i)/CV/CV(nb=4)/Methods/SVC(C=10)" % (n - 1))
+        self.leaf_key = self.leaf.get_key()
+
+    def time_walk_leaves(self, n):
+        for leaf in self.tree.walk_leaves():
+            pass
+
+    def time_get_node(self, n):
+        self.tree.get_node(self.leaf_key)
+
+    def time_get_key(self, n):
+        self.leaf.get_key()
+
+
+class TimeCRSlicer(object):
+    """Train / test row slicing of a dataset of 100 samples and n
+    features"""
+    params = [100, 10000, 100000]
+
+    def setup(self, n):
+        random_state = np.random.RandomState(0)
+        self.X = random_state.randn(100, n)
+        self.y = random_state.randint(2, size=100)
+        self.slicer = CRSlicer(signature_name="CV", nb=0, apply_on=None,
+                               col_or_row=False)
+        self.slicer.set_sclices({conf.TRAIN: range(0, 80),
+                                 conf.TEST: range(80, 100)})
+
+    def time_transform(self, n):
+        self.slicer.transform(X=self.X, y=self.y)
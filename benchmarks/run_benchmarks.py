@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run the benchmarks of EPAC primitives, write their timings as JSON and
+compare two runs (e.g. of two commits).
+
+The benchmarks follow the conventions of asv (airspeed velocity), which can
+run them as well: the modules "bench_*.py" of this directory define classes
+whose methods "time_*" are timed, for each value of the class attribute
+"params" (given to "setup" and to the methods) if any.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --filter Store --quick
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+
+The JSON file holds the environment of the run (commit, versions) and, for
+each benchmark "module.Class.time_method" and parameter, the best and the
+median time of a call in seconds over the repeats.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import glob
+import timeit
+import platform
+import optparse
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Regression reported by --compare beyond this ratio of the best times
+REGRESSION_RATIO = 1.2
+
+
+def discover(filter_regexp=None):
+    """Return the list of (name, class, method name) of the benchmarks"""
+    import re
+    sys.path.insert(0, BENCHMARKS_DIR)
+    benchmarks = list()
+    for filepath in sorted(glob.glob(os.path.join(BENCHMARKS_DIR,
+                                                  "bench_*.py"))):
+        module_name = os.path.splitext(os.path.basename(filepath))[0]
+        module = __import__(module_name)
+        for class_name in sorted(dir(module)):
+            cls = getattr(module, class_name)
+            if not isinstance(cls, type) or cls.__module__ != module_name:
+                continue
+            for method_name in sorted(dir(cls)):
+                if not method_name.startswith("time_"):
+                    continue
+                name = ".".join([module_name, class_name, method_name])
+                if filter_regexp and not re.search(filter_regexp, name):
+                    continue
+                benchmarks.append((name, cls, method_name))
+    return benchmarks
+
+
+def time_benchmark(cls, method_name, param, repeat, min_time):
+    """Return the times of a call of cls().method_name(param), one per
+    repeat. The number of calls per repeat is raised until they take
+    min_time seconds."""
+    bench = cls()
+    args = () if param is None else (param,)
+    if hasattr(bench, "setup"):
+        bench.setup(*args)
+    try:
+        method = getattr(bench, method_name)
+        timer = timeit.Timer(lambda: method(*args))
+        number = 1
+        while True:
+            elapsed = timer.timeit(number)
+            if elapsed >= min_time or number >= 1e6:
+                break
+            number *= 10
+        times = [elapsed / number]
+        gc.collect()
+        times += [t / number for t in timer.repeat(repeat - 1, number)]
+    finally:
+        if hasattr(bench, "teardown"):
+            bench.teardown(*args)
+    return times, number
+
+
+def git_commit():
+    try:
+        process = subprocess.Popen(["git", "rev-parse", "HEAD"],
+                                   cwd=BENCHMARKS_DIR,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, _ = process.communicate()
+        return out.strip() or None
+    except OSError:
+        return None
+
+
+def run(filter_regexp=None, repeat=5, min_time=0.1, verbose=True):
+    import numpy
+    import epac
+    results = dict()
+    for name, cls, method_name in discover(filter_regexp):
+        params = getattr(cls, "params", [None])
+        results[name] = dict()
+        for param in params:
+            times, number = time_benchmark(cls, method_name, param, repeat,
+                                           min_time)
+            times.sort()
+            results[name][repr(param)] = dict(
+                best=times[0], median=times[len(times) // 2],
+                repeat=len(times), number=number)
+            if verbose:
+                print "%-60s %-10s %12.3g s" % (name, repr(param), times[0])
+    return dict(commit=git_commit(),
+                date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                python=platform.python_version(),
+                numpy=numpy.__version__,
+                epac=epac.__version__,
+                machine=platform.node(),
+                results=results)
+
+
+def compare(filepath_before, filepath_after, ratio=REGRESSION_RATIO):
+    """Print the ratio after / before of the best times, return the list
+    of (name, param, ratio) of the regressions"""
+    runs = list()
+    for filepath in (filepath_before, filepath_after):
+        f = open(filepath)
+        runs.append(json.load(f))
+        f.close()
+    before, after = runs[0]["results"], runs[1]["results"]
+    regressions = list()
+    print "%-60s %-10s %10s %10s %7s" % ("benchmark", "param", "before",
+                                         "after", "ratio")
+    for name in sorted(set(before) & set(after)):
+        for param in sorted(set(before[name]) & set(after[name])):
+            t_before = before[name][param]["best"]
+            t_after = after[name][param]["best"]
+            r = t_after / t_before if t_before else float("inf")
+            flag = ""
+            if r > ratio:
+                flag = " !"
+                regressions.append((name, param, r))
+            print "%-60s %-10s %10.3g %10.3g %7.2f%s" % (
+                name, param, t_before, t_after, r, flag)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('-o', '--output',
+                      help='JSON file where the results are written')
+    parser.add_option('-f', '--filter',
+                      help='regular expression on the names of the ' + \
+                      'benchmarks to run')
+    parser.add_option('-r', '--repeat', type="int", default=5,
+                      help='number of timings of each benchmark')
+    parser.add_option('-q', '--quick', action="store_true", default=False,
+                      help='time each benchmark once, for a smoke test')
+    parser.add_option('-c', '--compare', nargs=2,
+                      help='compare two JSON files of results, exit ' + \
+                      'with 1 if a benchmark is slower by more than ' + \
+                      '%.0f%%' % ((REGRESSION_RATIO - 1) * 100))
+    options, args = parser.parse_args(sys.argv)
+    if options.compare:
+        regressions = compare(*options.compare)
+        sys.exit(1 if regressions else 0)
+    if options.quick:
+        run_results = run(options.filter, repeat=1, min_time=0)
+    else:
+        run_results = run(options.filter, repeat=options.repeat)
+    if options.output:
+        f = open(options.output, "w")
+        json.dump(run_results, f, indent=1, sort_keys=True)
+        f.close()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory regression harness: run representative workflows through
+LocalEngine, with or without the memory mapping of the dataset, sample the memory
+of the engine process and of each of its map processes, and check their
+peaks against the thresholds of memory_thresholds.json.
+
+It replaces the scripts of doc/memory_benchmark, whose output was copied by
+hand into a spreadsheet.
+
+The memory counted is the anonymous resident memory of each process
+(RssAnon of /proc/<pid>/status): the pages of the memory mapped files, with
+which the processes share X, are not counted, a copy of X made by a map
+process is. The margin of the thresholds is half of X, so that such a copy
+fails the check.
+
+The thresholds of a scenario bound the peak private memory of the engine
+process ("parent") and of the largest map process ("worker"), above the
+memory of the engine process once epac is imported, as
+base_mb + x_factor * size of X in MB.
+
+Usage::
+
+    python benchmarks/run_memory.py
+    python benchmarks/run_memory.py --scenario perms_memmap -o memory.json
+    python benchmarks/run_memory.py --update  # write the measured peaks
+
+Exits with 1 if a peak is beyond its threshold. Linux only (/proc).
+"""
+
+import os
+import sys
+import json
+import threading
+import optparse
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCHMARKS_DIR)
+THRESHOLDS_PATH = os.path.join(BENCHMARKS_DIR, "memory_thresholds.json")
+# Margin, in sizes of X, of the thresholds written by --update over the
+# measured peaks: a copy of X is beyond it
+UPDATE_MARGIN = 0.5
+
+# Workflow of each scenario, and whether X is memory mapped
+SCENARIOS = {
+    # The map processes only read X
+    "perms": ("perms", False),
+    "perms_memmap": ("perms", True),
+    # The map processes slice X into train and test sets: one more X
+    "cv": ("cv", False),
+    "cv_memmap": ("cv", True),
+}
+
+
+def read_rss_anon_kb(pid):
+    """Return RssAnon of the process in kB, None if it is gone"""
+    try:
+        f = open("/proc/%i/status" % pid)
+        try:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1])
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+
+
+def descendants(pid):
+    """Return the pids of the processes below pid"""
+    children = dict()
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            f = open("/proc/%s/stat" % name)
+            stat = f.read()
+            f.close()
+        except (IOError, OSError):
+            continue
+        # The name of the command, in parentheses, may hold spaces
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, list()).append(int(name))
+    pids = list()
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        pids.append(child)
+        stack += children.get(child, [])
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """Sample the memory of this process and of its descendants every
+    interval seconds, keep the peak of each process"""
+
+    def __init__(self, interval=0.005):
+        super(MemorySampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.pid = os.getpid()
+        self.peaks = dict()  # pid: RssAnon in kB
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        for pid in [self.pid] + descendants(self.pid):
+            memory = read_rss_anon_kb(pid)
+            if memory is not None:
+                self.peaks[pid] = max(self.peaks.get(pid, 0), memory)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def package_env():
+    """Environment of the subprocesses: epac is imported from PACKAGE_DIR"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [PACKAGE_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+
+def build_workflow(workflow):
+    from sklearn.svm import LinearSVC
+    from epac import Perms, CV, Methods
+    methods = Methods(LinearSVC(C=1.), LinearSVC(C=10.))
+    if workflow == "perms":
+        return Perms(methods, n_perms=4, permute="y", random_state=0)
+    return CV(methods, n_folds=4)
+
+
+def run_scenario(name, n_samples, n_features, num_processes):
+    """Run a scenario in this process, return the peaks in MB"""
+    import numpy as np
+    from epac import LocalEngine, conf
+    workflow, memmap = SCENARIOS[name]
+    base = read_rss_anon_kb(os.getpid())
+    random_state = np.random.RandomState(0)
+    X = random_state.randn(n_samples, n_features)
+    y = random_state.randint(2, size=n_samples)
+    # LocalEngine memory maps the arrays larger than conf.MEMM_THRESHOLD
+    # (see epac.map_reduce.engine.mmap_big_arrays)
+    conf.MEMM_THRESHOLD = X.nbytes - 1 if memmap else X.nbytes + 1
+    sampler = MemorySampler()
+    sampler.start()
+    try:
+        tree = LocalEngine(build_workflow(workflow),
+                           num_processes=num_processes).run(X=X, y=y)
+        tree.reduce()
+    finally:
+        sampler.stop()
+    parent = sampler.peaks.pop(os.getpid())
+    return dict(x_mb=X.nbytes / 1048576.,
+                base_mb=base / 1024.,
+                parent_mb=(parent - base) / 1024.,
+                worker_mb=max(sampler.peaks.values() or [0]) / 1024.,
+                n_workers=len(sampler.peaks))
+
+
+def check(name, measure, thresholds):
+    """Return the list of the messages of the peaks beyond the thresholds
+    of the scenario"""
+    failures = list()
+    for role in ("parent", "worker"):
+        limit = thresholds[role + "_base_mb"] + \
+            thresholds[role + "_x_factor"] * measure["x_mb"]
+        if measure[role + "_mb"] > limit:
+            failures.append("%s: %s peak %.1fMB > %.1fMB (%.1fMB + %.2f X)" %
+                            (name, role, measure[role + "_mb"], limit,
+                             thresholds[role + "_base_mb"],
+                             thresholds[role + "_x_factor"]))
+    return failures
+
+
+def update_thresholds(thresholds, name, measure):
+    """Set the thresholds of the scenario from its measure: the base of the
+    scenario is kept, its factor of X is the measured one plus the
+    margin"""
+    scenario = thresholds.setdefault(name, dict(parent_base_mb=50.,
+                                                worker_base_mb=50.))
+    for role in ("parent", "worker"):
+        peak = max(measure[role + "_mb"] - scenario[role + "_base_mb"], 0)
+        scenario[role + "_x_factor"] = round(
+            peak / measure["x_mb"] + UPDATE_MARGIN, 1)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('-s', '--scenario', action="append",
+                      help='scenario to run among %s (default all)' %
+                      ", ".join(sorted(SCENARIOS)))
+    parser.add_option('-n', '--n_samples', type="int", default=200)
+    parser.add_option('-p', '--n_features', type="int", default=50000,
+                      help='(default 50000: X of 76MB)')
+    parser.add_option('-c', '--num_processes', type="int", default=2)
+    parser.add_option('-t', '--thresholds', default=THRESHOLDS_PATH,
+                      help='JSON file of the thresholds')
+    parser.add_option('-u', '--update', action="store_true", default=False,
+                      help='write the thresholds from the measured peaks')
+    parser.add_option('-o', '--output',
+                      help='JSON file where the measures are written')
+    parser.add_option('--run_one', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(sys.argv)
+    if options.run_one:
+        print json.dumps(run_scenario(*json.loads(options.run_one)))
+        sys.exit(0)
+    names = options.scenario or sorted(SCENARIOS)
+    for name in names:
+        if not name in SCENARIOS:
+            parser.error("Unknown scenario %s" % name)
+    f = open(options.thresholds)
+    thresholds = json.load(f)
+    f.close()
+    measures = dict()
+    failures = list()
+    print "%-14s %7s %9s %9s %9s %8s" % ("scenario", "X(MB)", "parent",
+                                         "worker", "workers", "status")
+    for name in names:
+        # A process of its own for each scenario: its peaks are not those
+        # of the previous scenarios
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--run_one",
+             json.dumps([name, options.n_samples, options.n_features,
+                         options.num_processes])],
+            stdout=subprocess.PIPE, env=package_env())
+        out, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError("Scenario %s failed" % name)
+        measure = json.loads(out.strip().splitlines()[-1])
+        measures[name] = measure
+        if options.update:
+            update_thresholds(thresholds, name, measure)
+        scenario_failures = check(name, measure, thresholds[name])
+        failures += scenario_failures
+        print "%-14s %7.1f %7.1fMB %7.1fMB %9i %8s" % (
+            name, measure["x_mb"], measure["parent_mb"],
+            measure["worker_mb"], measure["n_workers"],
+            "FAILED" if scenario_failures else "ok")
+    if options.update:
+        f = open(options.thresholds, "w")
+        json.dump(thresholds, f, indent=1, sort_keys=True)
+        f.write("\n")
+        f.close()
+    if options.output:
+        f = open(options.output, "w")
+        json.dump(measures, f, indent=1, sort_keys=True)
+        f.close()
+    for failure in failures:
+        print failure
+    sys.exit(1 if failures else 0)
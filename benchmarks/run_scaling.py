@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scaling harness: run synthetic Perms(CV(Methods(...))) workloads through
+LocalEngine and through the BashWorkflowDescriptor path (epac_mapper jobs
+run locally in parallel, then epac_reducer) at a sweep of process counts.
+
+It reports the time split between map, merge and reduce, the peak RSS, and
+the scaling efficiency: strong scaling (same workload for all the process
+counts) T(1) / (p * T(p)), or weak scaling (--weak, n_perms grows with the
+process count) T(1) / T(p), T being the time to results (map + merge +
+reduce).
+
+The workloads are those of examples/run_multi_processes.py, the dataset can
+be memory mapped as in examples/run_a_big_matrix.py (--memmap).
+
+Usage::
+
+    python benchmarks/run_scaling.py --processes 1,2,4 -o scaling.json
+    python benchmarks/run_scaling.py --weak --n_features 10000 --memmap
+
+Each run is done in a process of its own, so that its peak RSS is not the
+one of the previous runs.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import optparse
+import subprocess
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENGINES = ("local", "bash")
+
+
+def build_workload(n_samples, n_features, n_perms, n_folds, n_methods,
+                   memmap_dir=None):
+    """Return the dataset and the tree of a workload"""
+    import numpy as np
+    from sklearn import datasets
+    from sklearn.svm import LinearSVC
+    from epac import Perms, CV, Methods
+    X, y = datasets.make_classification(n_samples=n_samples,
+                                        n_features=n_features,
+                                        n_informative=2,
+                                        random_state=1)
+    if memmap_dir:
+        # as examples/run_a_big_matrix.py
+        X_memmap = np.memmap(os.path.join(memmap_dir, "X.dat"),
+                             dtype="float32", mode="w+", shape=X.shape)
+        X_memmap[:] = X[:]
+        X = X_memmap
+    tree = Perms(CV(Methods(*[LinearSVC(C=10. ** (i - n_methods // 2))
+                              for i in xrange(n_methods)]),
+                    n_folds=n_folds),
+                 n_perms=n_perms, permute="y", random_state=0)
+    return dict(X=X, y=y), tree
+
+
+def trace_spans(trace_path):
+    """Return the total duration in seconds of the trace spans by name"""
+    f = open(trace_path)
+    events = json.load(f)["traceEvents"]
+    f.close()
+    spans = dict()
+    for event in events:
+        if event.get("ph") == "X":
+            spans[event["name"]] = spans.get(event["name"], 0) + \
+                event["dur"] / 1e6
+    return spans
+
+
+def run_local(Xy, tree, num_processes, work_dir):
+    """Run the workload through LocalEngine, the map / merge split is read
+    from its trace (see epac.hooks.Tracer)"""
+    from epac import LocalEngine
+    trace_path = os.path.join(work_dir, "trace.json")
+    engine = LocalEngine(tree, num_processes=num_processes,
+                         trace=trace_path)
+    start = time.time()
+    tree = engine.run(**Xy)
+    run_time = time.time() - start
+    spans = trace_spans(trace_path)
+    if "map processes" in spans:
+        map_time = spans["map processes"]
+        merge_time = spans.get("deserialize results", 0) + \
+            spans.get("merge_tree_store", 0) + spans.get("flush store", 0)
+    else:  # A single process
+        map_time, merge_time = run_time, 0.
+    start = time.time()
+    tree.reduce()
+    return dict(map=map_time, merge=merge_time,
+                reduce=time.time() - start)
+
+
+def local_command(cmd):
+    """Command of bash_jobs.sh run with this python interpreter"""
+    cmd = cmd.split()
+    return [sys.executable, os.path.join(PACKAGE_DIR, "bin", cmd[0])] + \
+        cmd[1:]
+
+
+def run_bash(Xy, tree, num_processes, work_dir):
+    """Export the workload with BashWorkflowDescriptor, run the mapper
+    commands in parallel then the reducer command. The reducer loads the
+    results of the jobs: there is no merge step."""
+    from epac.utils import save_dataset
+    from epac.stores import save_tree
+    from epac.map_reduce.wfdescriptors import BashWorkflowDescriptor
+    dataset_dir = os.path.join(work_dir, "dataset")
+    tree_dir = os.path.join(work_dir, "tree")
+    workflow_dir = os.path.join(work_dir, "workflow")
+    save_dataset(dataset_dir, **Xy)
+    save_tree(tree, tree_dir)
+    BashWorkflowDescriptor(dataset_dir, tree_dir,
+                           os.path.join(work_dir, "outdir")).export(
+        workflow_dir=workflow_dir, num_processes=num_processes)
+    f = open(os.path.join(workflow_dir, "bash_jobs.sh"))
+    commands = [local_command(line) for line in f.readlines()
+                if line.strip()]
+    f.close()
+    env = package_env()
+    map_commands = [c for c in commands if c[1].endswith("epac_mapper")]
+    reduce_commands = [c for c in commands if c[1].endswith("epac_reducer")]
+    devnull = open(os.devnull, "w")
+    try:
+        start = time.time()
+        processes = [subprocess.Popen(c, cwd=work_dir, env=env,
+                                      stdout=devnull, stderr=devnull)
+                     for c in map_commands]
+        if any([p.wait() for p in processes]):
+            raise RuntimeError("epac_mapper failed")
+        map_time = time.time() - start
+        start = time.time()
+        for c in reduce_commands:
+            if subprocess.call(c, cwd=work_dir, env=env, stdout=devnull,
+                               stderr=devnull):
+                raise RuntimeError("epac_reducer failed")
+        reduce_time = time.time() - start
+    finally:
+        devnull.close()
+    return dict(map=map_time, merge=0., reduce=reduce_time)
+
+
+def package_env():
+    """Environment of the subprocesses: epac is imported from PACKAGE_DIR"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [PACKAGE_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest child, in MB"""
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss / 1024.  # kB on Linux
+
+
+def run_one(engine, num_processes, workload):
+    """Run a workload, return its timings and peak RSS"""
+    work_dir = tempfile.mkdtemp(prefix="epac_scaling_")
+    try:
+        memmap_dir = work_dir if workload.pop("memmap") else None
+        Xy, tree = build_workload(memmap_dir=memmap_dir, **workload)
+        if engine == "local":
+            timings = run_local(Xy, tree, num_processes, work_dir)
+        else:
+            timings = run_bash(Xy, tree, num_processes, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    timings["total"] = timings["map"] + timings["merge"] + timings["reduce"]
+    timings["peak_rss_mb"] = peak_rss_mb()
+    return timings
+
+
+def run_sweep(engines, processes, workload, weak=False):
+    """Run each engine at each process count, each run in a process of its
+    own. Return the list of the runs with their scaling efficiency."""
+    runs = list()
+    for engine in engines:
+        engine_runs = list()
+        for num_processes in processes:
+            run_workload = dict(workload)
+            if weak:
+                run_workload["n_perms"] = workload["n_perms"] * num_processes
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--run_one",
+                 json.dumps([engine, num_processes, run_workload])],
+                stdout=subprocess.PIPE, env=package_env())
+            out, _ = process.communicate()
+            if process.returncode:
+                raise RuntimeError("%s engine failed with %i processes" %
+                                   (engine, num_processes))
+            run = json.loads(out.strip().splitlines()[-1])
+            run.update(engine=engine, num_processes=num_processes,
+                       n_perms=run_workload["n_perms"])
+            engine_runs.append(run)
+        # Efficiency relative to the smallest process count
+        base = min(engine_runs, key=lambda run: run["num_processes"])
+        for run in engine_runs:
+            ratio = float(run["num_processes"]) / base["num_processes"]
+            if weak:
+                run["efficiency"] = base["total"] / run["total"]
+            else:
+                run["efficiency"] = base["total"] / (ratio * run["total"])
+        runs += engine_runs
+    return runs
+
+
+def print_runs(runs, weak=False):
+    print "%-6s %5s %7s %9s %9s %9s %9s %6s %9s" % (
+        "engine", "procs", "n_perms", "map", "merge", "reduce", "total",
+        "weak" if weak else "strong", "rss(MB)")
+    for run in runs:
+        print "%-6s %5i %7i %8.2fs %8.2fs %8.2fs %8.2fs %5.0f%% %9.1f" % (
+            run["engine"], run["num_processes"], run["n_perms"], run["map"],
+            run["merge"], run["reduce"], run["total"],
+            run["efficiency"] * 100, run["peak_rss_mb"])
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('-n', '--n_samples', type="int", default=100)
+    parser.add_option('-p', '--n_features', type="int", default=1000)
+    parser.add_option('-m', '--n_perms', type="int", default=10,
+                      help='permutations, per process with --weak')
+    parser.add_option('-f', '--n_folds', type="int", default=5)
+    parser.add_option('-k', '--n_methods', type="int", default=2)
+    parser.add_option('-c', '--processes', default="1,2,4",
+                      help='process counts of the sweep (default 1,2,4)')
+    parser.add_option('-e', '--engines', default=",".join(ENGINES),
+                      help='engines to run among %s' % ", ".join(ENGINES))
+    parser.add_option('-w', '--weak', action="store_true", default=False,
+                      help='weak scaling: the permutations grow with ' + \
+                      'the process count')
+    parser.add_option('--memmap', action="store_true", default=False,
+                      help='memory map the dataset')
+    parser.add_option('-o', '--output',
+                      help='JSON file where the runs are written')
+    parser.add_option('--run_one', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args(sys.argv)
+    if options.run_one:
+        engine, num_processes, workload = json.loads(options.run_one)
+        print json.dumps(run_one(engine, num_processes, workload))
+        sys.exit(0)
+    engines = [e for e in options.engines.split(",") if e]
+    for engine in engines:
+        if not engine in ENGINES:
+            parser.error("Unknown engine %s" % engine)
+    workload = dict(n_samples=options.n_samples,
+                    n_features=options.n_features,
+                    n_perms=options.n_perms,
+                    n_folds=options.n_folds,
+                    n_methods=options.n_methods,
+                    memmap=options.memmap)
+    processes = [int(p) for p in options.processes.split(",")]
+    runs = run_sweep(engines, processes, workload, weak=options.weak)
+    print_runs(runs, weak=options.weak)
+    if options.output:
+        f = open(options.output, "w")
+        json.dump(dict(workload=workload, weak=options.weak, runs=runs), f,
+                  indent=1, sort_keys=True)
+        f.close()
@@ -7,8 +7,9 @@ Created on Fri Sep 20 11:45:56 2013
 
 import imp
 import sys
-from distutils.version import LooseVersion as V
 
+# Only look for the modules, importing them is slow. The version of joblib
+# is checked on first use (see epac.stores)
 modules = ['numpy', 'sklearn', 'joblib']
 
 for module in modules:
@@ -19,13 +20,6 @@ for module in modules:
                          'please check that you installed it properly \n' %
                          module)
         raise
-    else:
-        if module == 'joblib':
-            import joblib
-            if V(joblib.__version__) < V("0.7.1"):
-                raise ValueError("joblib version is too old to use, "
-                                 "please use version on "
-                                 "https://github.com/joblib/joblib")
 
 try:
     imp.find_module("soma_workflow")
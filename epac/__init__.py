@@ -13,13 +13,17 @@ from epac.workflow.splitters import CVBestSearchRefitParallel
 from epac.workflow.splitters import ColumnSplitter, RowSplitter, CRSplitter
 from epac.workflow.base import BaseNode, key_pop, key_split
 from epac.configuration import conf, debug
-from epac.map_reduce.results import ResultSet, Result
+from epac.map_reduce.results import ResultSet, Result, RetentionPolicy
+from epac.map_reduce.results import ReduceCache
+from epac.hooks import NodeProfiler
 from epac.utils import train_test_merge, train_test_split, dict_diff
 from epac.utils import range_log2, export_csv, export_resultset_csv, \
     export_leaves_csv
-from epac.stores import StoreFs, StoreMem
+from epac.stores import StoreFs, StoreMem, StoreHybrid, StorePack
+from epac.stores import StoreSQLite, StoreShards
 from epac.map_reduce.mappers import MapperSubtrees
 from epac.map_reduce.engine import SomaWorkflowEngine, LocalEngine
+from epac.map_reduce.planner import ExecutionPlanner
 from epac.map_reduce.reducers import ClassificationReport, PvalPerms
 
 __version__ = '0.10-git'
@@ -39,6 +43,9 @@ __all__ = ['BaseNode',
            'ClassificationReport', 'PvalPerms',
            'Result',
            'ResultSet',
+           'RetentionPolicy',
+           'ReduceCache',
+           'NodeProfiler',
            'sklearn_plugins',
            'conf',
            'debug',
@@ -52,8 +59,13 @@ __all__ = ['BaseNode',
            'export_leaves_csv',
            'StoreFs',
            'StoreMem',
+           'StoreHybrid',
+           'StorePack',
+           'StoreSQLite',
+           'StoreShards',
            'range_log2',
            'MapperSubtrees',
            'SomaWorkflowEngine',
-           'LocalEngine'
+           'LocalEngine',
+           'ExecutionPlanner'
            ]
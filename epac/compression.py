@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed storage of numpy arrays.
+
+An array is cut along its first axis into chunks of about chunk_nbytes
+bytes, each chunk is compressed with zlib (or kept raw if it does not
+shrink). A record is written as: the chunks, then a header::
+
+    MAGIC, header length (uint32), JSON header
+
+The JSON header gives the dtype, the shape, the rows per chunk and the
+(offset, length, compressed) of each chunk, so that reading a few rows only
+inflates the chunks that hold them. A standalone file (save_compressed) is
+one record followed by the offset of its header (uint64).
+"""
+
+import os
+import json
+import struct
+import zlib
+import numpy as np
+
+MAGIC = "EPZ1"
+COMPRESSED_ARRAY_SUFFIX = ".cnpy"
+_HEADER_LEN = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q")
+
+
+def is_compressible(arr, sample_nbytes=65536, min_ratio=0.9, level=1):
+    """Guess if compressing arr is worth it: compress samples from the
+    beginning and from the middle of its data.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac.compression import is_compressible
+    >>> is_compressible(np.zeros(100000))
+    True
+    >>> is_compressible(np.random.random(100000))
+    False
+    """
+    if not isinstance(arr, np.ndarray) or arr.dtype.hasobject or \
+            arr.dtype.names or arr.size == 0:
+        return False
+    data = np.ascontiguousarray(arr).ravel().view(np.uint8)
+    if data.size > sample_nbytes:
+        half = sample_nbytes // 2
+        middle = data.size // 2
+        data = np.concatenate((data[:half], data[middle:middle + half]))
+    sample = data.tostring()
+    return len(zlib.compress(sample, level)) < min_ratio * len(sample)
+
+
+def write_compressed(outfile, arr, chunk_nbytes=1048576, level=1,
+                     min_ratio=0.9):
+    """Write arr at the end of the file object outfile, return the offset
+    of the record header, to be given to read_compressed."""
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject or arr.dtype.names:
+        raise ValueError("Cannot compress array of dtype %s" % arr.dtype)
+    shape = arr.shape
+    flat = arr.reshape((1,)) if arr.ndim == 0 else arr
+    row_nbytes = max(1, flat[0:1].nbytes)
+    rows_per_chunk = max(1, chunk_nbytes // row_nbytes)
+    compress = is_compressible(flat, min_ratio=min_ratio, level=level)
+    outfile.seek(0, os.SEEK_END)
+    chunks = list()
+    for start in xrange(0, max(flat.shape[0], 1), rows_per_chunk):
+        raw = np.ascontiguousarray(flat[start:start + rows_per_chunk])
+        raw = raw.tostring()
+        data = zlib.compress(raw, level) if compress else raw
+        is_compressed = compress and len(data) < min_ratio * len(raw)
+        if not is_compressed:
+            data = raw
+        chunks.append((outfile.tell(), len(data), is_compressed))
+        outfile.write(data)
+    header = json.dumps(dict(dtype=arr.dtype.str, shape=list(shape),
+                             rows_per_chunk=rows_per_chunk, chunks=chunks))
+    offset = outfile.tell()
+    outfile.write(MAGIC + _HEADER_LEN.pack(len(header)) + header)
+    return offset
+
+
+def read_compressed(infile, offset, start=None, stop=None):
+    """Read the rows start:stop (first axis) of the array whose record
+    header is at offset in the file object infile."""
+    infile.seek(offset)
+    if infile.read(len(MAGIC)) != MAGIC:
+        raise IOError("No compressed array at offset %i" % offset)
+    header_len, = _HEADER_LEN.unpack(infile.read(_HEADER_LEN.size))
+    header = json.loads(infile.read(header_len))
+    dtype = np.dtype(str(header["dtype"]))
+    shape = tuple(header["shape"])
+    if not shape:
+        start, stop = 0, 1
+    n_rows = shape[0] if shape else 1
+    start, stop, _ = slice(start, stop).indices(n_rows)
+    stop = max(start, stop)
+    rows_per_chunk = header["rows_per_chunk"]
+    parts = list()
+    for i in xrange(start // rows_per_chunk,
+                    (stop + rows_per_chunk - 1) // rows_per_chunk):
+        chunk_offset, length, is_compressed = header["chunks"][i]
+        infile.seek(chunk_offset)
+        data = infile.read(length)
+        if is_compressed:
+            data = zlib.decompress(data)
+        chunk = np.frombuffer(data, dtype=dtype)
+        chunk = chunk.reshape((-1,) + shape[1:])
+        first = i * rows_per_chunk
+        parts.append(chunk[max(start - first, 0):stop - first])
+    if parts:
+        arr = np.concatenate(parts)
+    else:
+        arr = np.empty((0,) + shape[1:], dtype=dtype)
+    if not shape:
+        return arr.reshape(())
+    return arr
+
+
+def save_compressed(filepath, arr, chunk_nbytes=1048576, level=1):
+    """Save arr in a file of its own.
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> import numpy as np
+    >>> from epac.compression import save_compressed, load_compressed
+    >>> filepath = os.path.join(tempfile.mkdtemp(), "X.cnpy")
+    >>> X = np.zeros((1000, 100))
+    >>> X[:, 0] = np.arange(1000)
+    >>> save_compressed(filepath, X, chunk_nbytes=80000)
+    >>> os.path.getsize(filepath) < X.nbytes / 10
+    True
+    >>> load_compressed(filepath, 500, 503)[:, 0].tolist()
+    [500.0, 501.0, 502.0]
+    """
+    outfile = open(filepath, "wb")
+    offset = write_compressed(outfile, arr, chunk_nbytes=chunk_nbytes,
+                              level=level)
+    outfile.write(_TRAILER.pack(offset))
+    outfile.close()
+
+
+def load_compressed(filepath, start=None, stop=None):
+    """Load the rows start:stop (default all) of an array saved with
+    save_compressed."""
+    infile = open(filepath, "rb")
+    infile.seek(-_TRAILER.size, os.SEEK_END)
+    offset, = _TRAILER.unpack(infile.read(_TRAILER.size))
+    arr = read_compressed(infile, offset, start, stop)
+    infile.close()
+    return arr
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
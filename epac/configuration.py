@@ -17,6 +17,10 @@ class conf:
     STORE_FS_PICKLE_SUFFIX = ".pkl"
     STORE_FS_JSON_SUFFIX = ".json"
     STORE_EXECUTION_TREE_PREFIX = "execution_tree"
+    # Directory of the result shards written by the jobs (see StoreShards)
+    STORE_SHARDS_DIR = "shards"
+    # Specification of the execution tree (see epac.workflow.spec)
+    STORE_TREE_SPEC = "execution_tree.spec"
     STORE_STORE_PREFIX = "store"
     SEP = "/"
     SUFFIX_JOB = "job"
@@ -37,12 +41,28 @@ class conf:
     MEMMAP = "memmap"
     MEMOBJ_SUFFIX = "_memobj.enpy"
     NOROBJ_SUFFIX = "_norobj.enpy"
+    COMPOBJ_SUFFIX = "_compobj.enpy"
+    # Smallest array written compressed by StoreFs(compress=True)
+    COMPRESS_MIN_NBYTES = 1024
     ML_CLASSIFICATION_MODE = None  # Set to True to force classification mode
     DICT_INDEX_FILE = "dict_index.txt"
+    # Index of an array saved by column groups (see save_dataset)
+    COLUMN_BLOCKS_SUFFIX = ".blocks.json"
     # when the data larger than 100MB, it needs memmory mapping
     MEMM_THRESHOLD = 100000000L
     # When split tree for parallel computing, the max depth we can split
     MAX_DEPTH_SPLIT_TREE = 4
+    # Bytes of results kept in memory by the store created on the tree root,
+    # least recently used results are written to disk beyond. None: no limit
+    STORE_MEM_BUDGET = None
+    # Directory where StoreHybrid writes evicted results. None: system tmp
+    STORE_MEM_SPILL_DIR = None
+    # Deduplicate by content the arrays saved in the stores created on the
+    # tree roots (see StoreMem)
+    STORE_DEDUP = False
+    # Keep the reduced results of the internal nodes, recompute only the
+    # subtrees whose results have changed (see ReduceCache)
+    REDUCE_CACHE = False
 
     @classmethod
     def init_ml(cls, **Xy):
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Hooks on the execution of the nodes, a profiler and a tracer built on them.
+
+Callbacks are registered by event (see EVENTS) and called as
+callback(event, node, **info). The nodes only test whether an event has
+callbacks before firing it: hooks cost nothing when unused.
+
+Events
+------
+enter, exit: a node starts / ends its top-down run (BaseNode.top_down).
+
+fit, predict: an Estimator calls fit / predict of its wrapped node.
+
+slice: a Slicer slices the data-flow for a child of a splitter.
+
+save: a leaf saves its results, info "results".
+
+reduce: the reduced results of a node are read (BaseNode.reduce_iter),
+    the time spent by the consumer between two results is not counted.
+
+load: a mapper reads the inputs of its subtrees from the dataset
+    (MapperSubtrees.get_inputs), the node is the tree root.
+
+The events of the operations (fit, predict, slice, save, reduce, load) come
+with info "wall" and "cpu", the wall time and CPU time they took in seconds.
+"""
+
+import os
+import json
+import time
+import threading
+
+EVENTS = ("enter", "exit", "fit", "predict", "slice", "save", "reduce",
+          "load")
+
+# Callbacks of each event, an event without callbacks has no entry
+listeners = dict()
+
+
+def add_hook(event, callback):
+    """Call callback(event, node, **info) on each event"""
+    if not event in EVENTS:
+        raise ValueError("Unknown event %s, should be one of %s" %
+                         (event, ", ".join(EVENTS)))
+    listeners.setdefault(event, list()).append(callback)
+
+
+def remove_hook(event, callback):
+    callbacks = listeners.get(event, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+    if not callbacks:
+        listeners.pop(event, None)
+
+
+def fire(event, node, **info):
+    for callback in listeners.get(event, []):
+        callback(event, node, **info)
+
+
+def call(event, node, func, args=(), kwargs=None, **info):
+    """Return func(*args, **kwargs), fire event with the time it took"""
+    if kwargs is None:
+        kwargs = dict()
+    if not event in listeners:
+        return func(*args, **kwargs)
+    wall, cpu = time.time(), time.clock()
+    ret = func(*args, **kwargs)
+    fire(event, node, wall=time.time() - wall, cpu=time.clock() - cpu,
+         **info)
+    return ret
+
+
+def call_iter(event, node, iterator, **info):
+    """Yield the items of iterator, fire event with the time taken to get
+    them once it is exhausted"""
+    wall, cpu = 0., 0.
+    iterator = iter(iterator)
+    while True:
+        wall_start, cpu_start = time.time(), time.clock()
+        try:
+            item = iterator.next()
+        except StopIteration:
+            break
+        finally:
+            wall += time.time() - wall_start
+            cpu += time.clock() - cpu_start
+        yield item
+    fire(event, node, wall=wall, cpu=cpu, **info)
+
+
+class NodeProfiler(object):
+    """Record the wall time, CPU time and result bytes of each node, by
+    node key, while it is started (see start, or use it as a context
+    manager).
+
+    The times of a node (enter to exit) include those of its subtree, the
+    times of its operations (fit, predict, slice, save, reduce) are also
+    recorded, "nbytes" are the bytes of the results it saved.
+
+    Example
+    -------
+    >>> from sklearn import datasets
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Methods
+    >>> from epac.hooks import NodeProfiler
+    >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+    ...                                     n_informative=2,
+    ...                                     random_state=1)
+    >>> wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+    >>> with NodeProfiler() as profiler:
+    ...     _ = wf.run(X=X, y=y)
+    >>> sorted([(name, count) for name, count, wall, cpu, nbytes in
+    ...         profiler.stats(group_by="class")])
+    [('CRSlicer', 2), ('CV', 1), ('Methods', 2), ('SVC', 4)]
+    """
+    OPERATIONS = ("fit", "predict", "slice", "save", "reduce")
+
+    def __init__(self):
+        self.records = dict()
+        self._stack = list()
+
+    def start(self):
+        add_hook("enter", self._on_enter)
+        add_hook("exit", self._on_exit)
+        for event in NodeProfiler.OPERATIONS:
+            add_hook(event, self._on_operation)
+        return self
+
+    def stop(self):
+        remove_hook("enter", self._on_enter)
+        remove_hook("exit", self._on_exit)
+        for event in NodeProfiler.OPERATIONS:
+            remove_hook(event, self._on_operation)
+        self._stack = list()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _record(self, node, key=None):
+        if key is None:
+            key = node.get_key()
+        if not key in self.records:
+            wrapped_node = getattr(node, "wrapped_node", node)
+            record = dict(key=key,
+                          cls=wrapped_node.__class__.__name__,
+                          signature=node.get_signature(),
+                          count=0, wall=0., cpu=0., nbytes=0)
+            for event in NodeProfiler.OPERATIONS:
+                record[event] = 0.
+            self.records[key] = record
+        return self.records[key]
+
+    def _on_enter(self, event, node, **info):
+        self._stack.append((node, node.get_key(), time.time(), time.clock()))
+
+    def _on_exit(self, event, node, **info):
+        # The nodes left without exit (on an exception) are dropped
+        while self._stack:
+            entered, key, wall, cpu = self._stack.pop()
+            if entered is node:
+                record = self._record(node, key)
+                record["count"] += 1
+                record["wall"] += time.time() - wall
+                record["cpu"] += time.clock() - cpu
+                break
+
+    def _on_operation(self, event, node, wall, cpu, **info):
+        record = self._record(node)
+        record[event] += wall
+        if event == "save":
+            from epac.stores import estimate_nbytes
+            record["nbytes"] += estimate_nbytes(info["results"])
+
+    def merge(self, profiler):
+        """Add the records of another profiler (e.g. of another process)"""
+        records = profiler.records if isinstance(profiler, NodeProfiler) \
+            else profiler
+        for key in records:
+            if not key in self.records:
+                self.records[key] = dict(records[key])
+                continue
+            record = self.records[key]
+            for name in ["count", "wall", "cpu", "nbytes"] + \
+                    list(NodeProfiler.OPERATIONS):
+                record[name] += records[key][name]
+        return self
+
+    def stats(self, group_by="key", sort_by="wall"):
+        """Return the list of (name, count, wall, cpu, nbytes), one item by
+        node key, by class name of the (wrapped) nodes ("class") or by
+        signature ("signature"), sorted by decreasing "wall", "cpu",
+        "nbytes", "count" or operation time (e.g. "fit")."""
+        group_field = dict(key="key", signature="signature").get(group_by,
+                                                                 "cls")
+        groups = dict()
+        for record in self.records.values():
+            name = record[group_field]
+            if not name in groups:
+                groups[name] = dict(record)
+                continue
+            for field in groups[name]:
+                if field not in ("key", "cls", "signature"):
+                    groups[name][field] += record[field]
+        names = sorted(groups, key=lambda name: groups[name][sort_by],
+                       reverse=True)
+        return [(name, groups[name]["count"], groups[name]["wall"],
+                 groups[name]["cpu"], groups[name]["nbytes"])
+                for name in names]
+
+    def save(self, filepath):
+        """Write the records as JSON"""
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        f = open(filepath, "w")
+        json.dump(sorted(self.records.values(), key=lambda r: r["key"]), f)
+        f.close()
+
+    @staticmethod
+    def load(path):
+        """Load the records written by save, path may be a directory: its
+        ".json" files are then merged (e.g. the profiles of the jobs)"""
+        if os.path.isdir(path):
+            filepaths = [os.path.join(path, basename)
+                         for basename in sorted(os.listdir(path))
+                         if basename.endswith(".json")]
+        else:
+            filepaths = [path]
+        profiler = NodeProfiler()
+        for filepath in filepaths:
+            f = open(filepath, "r")
+            records = json.load(f)
+            f.close()
+            profiler.merge(dict([(str(record["key"]), record)
+                                 for record in records]))
+        return profiler
+
+
+class Tracer(object):
+    """Record a timeline of the process as Chrome trace events (see
+    chrome://tracing or https://ui.perfetto.dev): the nodes run and their
+    operations while it is started (see start), and the spans of code
+    timed by span().
+
+    The traces written by several processes (see save) are merged into a
+    single file by merge_traces, their timestamps share the same clock.
+
+    Example
+    -------
+    >>> from sklearn import datasets
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Methods
+    >>> from epac.hooks import Tracer
+    >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+    ...                                     n_informative=2,
+    ...                                     random_state=1)
+    >>> wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+    >>> tracer = Tracer(name="main")
+    >>> with tracer.span("run"):
+    ...     with tracer:
+    ...         _ = wf.run(X=X, y=y)
+    >>> names = set([event["name"] for event in tracer.events])
+    >>> sorted(names)[:6]
+    ['CV', 'CV(nb=0)', 'CV(nb=1)', 'Methods', 'SVC(C=1)', 'SVC(C=3)']
+    >>> sorted(names)[6:]
+    ['fit', 'predict', 'process_name', 'run', 'save', 'slice']
+    """
+    OPERATIONS = ("fit", "predict", "slice", "save", "reduce", "load")
+
+    def __init__(self, name=None):
+        self.pid = os.getpid()
+        self.events = list()
+        self._stack = list()
+        if name:
+            self.events.append(dict(name="process_name", ph="M",
+                                    pid=self.pid, tid=0,
+                                    args=dict(name=name)))
+
+    def start(self):
+        add_hook("enter", self._on_enter)
+        add_hook("exit", self._on_exit)
+        for event in Tracer.OPERATIONS:
+            add_hook(event, self._on_operation)
+        return self
+
+    def stop(self):
+        remove_hook("enter", self._on_enter)
+        remove_hook("exit", self._on_exit)
+        for event in Tracer.OPERATIONS:
+            remove_hook(event, self._on_operation)
+        self._stack = list()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add(self, name, start, end, cat="epac", **args):
+        """Add the span of name from start to end (seconds since the
+        epoch, as time.time())"""
+        self.events.append(dict(name=name, cat=cat, ph="X",
+                                ts=int(start * 1e6),
+                                dur=max(int((end - start) * 1e6), 0),
+                                pid=self.pid,
+                                tid=threading.current_thread().ident % 100000,
+                                args=args))
+
+    def span(self, name, cat="epac", **args):
+        """Context manager which adds the span of the code it runs"""
+        return _Span(self, name, cat, args)
+
+    def _on_enter(self, event, node, **info):
+        self._stack.append((node, node.get_key(), time.time()))
+
+    def _on_exit(self, event, node, **info):
+        while self._stack:
+            entered, key, start = self._stack.pop()
+            if entered is node:
+                self.add(node.get_signature(), start, time.time(),
+                         cat="node", key=key)
+                break
+
+    def _on_operation(self, event, node, wall, cpu, **info):
+        end = time.time()
+        self.add(event, end - wall, end, cat=event, key=node.get_key(),
+                 cpu=cpu)
+
+    def save(self, filepath):
+        """Write the events as a Chrome trace JSON file"""
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        f = open(filepath, "w")
+        json.dump(dict(traceEvents=self.events, displayTimeUnit="ms"), f)
+        f.close()
+
+
+class _Span(object):
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.add(self.name, self.start, time.time(), cat=self.cat,
+                        **self.args)
+
+
+def merge_traces(paths, filepath):
+    """Merge the Chrome trace files written by Tracer.save (paths of files,
+    or of directories whose ".json" files are all read) into filepath,
+    return the number of events."""
+    filepaths = list()
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths += [os.path.join(path, basename)
+                          for basename in sorted(os.listdir(path))
+                          if basename.endswith(".json")]
+        else:
+            filepaths.append(path)
+    events = list()
+    for each_filepath in filepaths:
+        f = open(each_filepath, "r")
+        events += json.load(f)["traceEvents"]
+        f.close()
+    events.sort(key=lambda event: event.get("ts", 0))
+    f = open(filepath, "w")
+    json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+    f.close()
+    return len(events)
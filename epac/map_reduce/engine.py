@@ -8,6 +8,8 @@ Created on Mon Jun 17 11:09:30 2013
 """
 
 import os
+import time
+import cPickle
 import shutil
 import multiprocessing
 import tempfile
@@ -17,12 +19,13 @@ import socket
 
 from abc import ABCMeta, abstractmethod
 
-from epac import StoreFs
+from epac import StoreFs, StoreShards
+from epac.stores import attach_shards, create_store_mem
 from epac.errors import NoSomaWFError, NoEpacTreeRootError
 from epac.configuration import conf
 from epac.map_reduce.split_input import SplitNodesInput
 from epac.map_reduce.inputs import NodesInput
-from epac.map_reduce.exports import save_job_list
+from epac.map_reduce.exports import save_job_list, group_job_list
 from epac.utils import estimate_dataset_size
 from epac.utils import save_dataset
 
@@ -64,6 +67,28 @@ class LocalEngine(Engine):
     num_processes: integer
         Run map process in #processes
 
+    retention_policy: epac.map_reduce.results.RetentionPolicy
+        If provided, set as the retention policy of the tree root: leaves
+        trim their results before saving them. Default None (keep all).
+
+    store: epac.stores.Store
+        If provided, set as the store of the tree root. A store shared by
+        processes (is_shared, e.g. StoreSQLite) is written directly by the
+        map processes: their results are not merged afterwards.
+
+    profile: boolean
+        If True, the nodes are profiled while they run, in each map
+        process: the merged profile is then found in attribute "profiler"
+        (see epac.hooks.NodeProfiler).
+
+    trace: string
+        If provided, the path of a Chrome trace-event JSON file (see
+        chrome://tracing or https://ui.perfetto.dev) where the timeline of
+        the run is written: the nodes run by each map process, their
+        inputs load and the serialization of their results, the memory
+        mapping of the dataset and the merge of the results by this
+        process (see epac.hooks.Tracer).
+
     Example
     -------
 
@@ -103,10 +128,21 @@ class LocalEngine(Engine):
     def __init__(self,
                  tree_root,
                  function_name="transform",
-                 num_processes=-1):
+                 num_processes=-1,
+                 retention_policy=None,
+                 store=None,
+                 profile=False,
+                 trace=None):
 
         self.tree_root = tree_root
         self.function_name = function_name
+        self.profile = profile
+        self.profiler = None
+        self.trace = trace
+        if retention_policy and tree_root:
+            self.tree_root.retention_policy = retention_policy
+        if store and tree_root:
+            self.tree_root.store = store
         if num_processes == 0:
             num_processes = 1
         if num_processes < 0:
@@ -119,6 +155,8 @@ class LocalEngine(Engine):
         from multiprocessing import Pool
         from epac.map_reduce.mappers import MapperSubtrees
         from epac.map_reduce.mappers import map_process
+        from epac.map_reduce.mappers import instrumented_map_process
+        from epac.hooks import NodeProfiler, Tracer, merge_traces
 
         ## Split input into several parts and create mapper
         ## ================================================
@@ -126,30 +164,228 @@ class LocalEngine(Engine):
         split_node_input = SplitNodesInput(self.tree_root,
                                            num_processes=self.num_processes)
         input_list = split_node_input.split(node_input)
+        if self.profile:
+            self.profiler = NodeProfiler()
+        tracer = Tracer(name="epac engine") if self.trace else None
         if len(input_list) == 1:
-            self.tree_root.run(**Xy)
+            if self.profiler:
+                self.profiler.start()
+            if tracer:
+                tracer.start()
+            try:
+                self.tree_root.run(**Xy)
+            finally:
+                if self.profiler:
+                    self.profiler.stop()
+                if tracer:
+                    tracer.stop()
+            if self.tree_root.store:
+                self.tree_root.store.flush()
+            if tracer:
+                tracer.save(self.trace)
             return self.tree_root
-        mapper = MapperSubtrees(Xy=Xy,
-                                tree_root=self.tree_root,
-                                function=self.function_name)
-        ## Run map processes in parallel
-        ## =============================
-        partial_map_process = partial(map_process, mapper=mapper)
-#        res_tree_root_list = []
-#        for linput in input_list:
-#            res_tree_root_list.append(partial_map_process(linput))
-        # pool = Pool(processes=len(input_list))
-        # res_tree_root_list = pool.map(partial_map_process, input_list)
-        from joblib import Parallel, delayed
-        res_tree_root_list = \
-            Parallel(n_jobs=len(input_list))(delayed(partial_map_process)(i)
-                                             for i in input_list)
-
+        ## Big arrays are shared by the processes through memory mapping
+        ## ============================================================
+        mmap_dir = tempfile.mkdtemp(prefix="epac_Xy_")
+        trace_dir = tempfile.mkdtemp(prefix="epac_trace_") if tracer \
+            else None
+        try:
+            start = time.time()
+            Xy = mmap_big_arrays(Xy, mmap_dir)
+            if tracer:
+                tracer.add("mmap dataset", start, time.time())
+            mapper = MapperSubtrees(Xy=Xy,
+                                    tree_root=self.tree_root,
+                                    function=self.function_name)
+            ## Run map processes in parallel
+            ## =============================
+            if self.profile or tracer:
+                partial_map_process = partial(instrumented_map_process,
+                                              mapper=mapper,
+                                              profile=self.profile,
+                                              trace_dir=trace_dir)
+            else:
+                partial_map_process = partial(map_process, mapper=mapper)
+#            res_tree_root_list = []
+#            for linput in input_list:
+#                res_tree_root_list.append(partial_map_process(linput))
+            # pool = Pool(processes=len(input_list))
+            # res_tree_root_list = pool.map(partial_map_process, input_list)
+            from joblib import Parallel, delayed
+            start = time.time()
+            res_tree_root_list = \
+                Parallel(n_jobs=len(input_list))(
+                    delayed(partial_map_process)(i) for i in input_list)
+            if tracer:
+                tracer.add("map processes", start, time.time(),
+                           num_processes=len(input_list))
+        finally:
+            # Opened memory maps remain valid
+            shutil.rmtree(mmap_dir, ignore_errors=True)
+
+        if self.profile or tracer:
+            for _, records in res_tree_root_list:
+                if records:
+                    self.profiler.merge(records)
+            res_tree_root_list = [each_tree_root for each_tree_root, _ in
+                                  res_tree_root_list]
         for each_tree_root in res_tree_root_list:
-            self.tree_root.merge_tree_store(each_tree_root)
+            if tracer:
+                with tracer.span("deserialize results"):
+                    each_tree_root = cPickle.loads(each_tree_root)
+                with tracer.span("merge_tree_store"):
+                    self.tree_root.merge_tree_store(each_tree_root)
+            else:
+                self.tree_root.merge_tree_store(each_tree_root)
+        if tracer:
+            with tracer.span("flush store"):
+                self.tree_root.store.flush()
+            tracer.save(os.path.join(trace_dir, "%i.json" % os.getpid()))
+            merge_traces([trace_dir], self.trace)
+            shutil.rmtree(trace_dir, ignore_errors=True)
+        else:
+            self.tree_root.store.flush()
         return self.tree_root
 
 
+def mmap_big_arrays(Xy, dirpath):
+    """Return a copy of Xy where the in-memory arrays larger than
+    conf.MEMM_THRESHOLD bytes are saved in dirpath and replaced by their
+    read-only memory map: processes then share the same physical pages.
+
+    Example
+    -------
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from epac.configuration import conf
+    >>> from epac.map_reduce.engine import mmap_big_arrays
+    >>> memm_threshold, conf.MEMM_THRESHOLD = conf.MEMM_THRESHOLD, 100
+    >>> Xy = mmap_big_arrays({"X": np.zeros((10, 10)), "y": np.zeros(10),
+    ...                       "X/test": np.ones((10, 10))},
+    ...                      tempfile.mkdtemp())
+    >>> conf.MEMM_THRESHOLD = memm_threshold
+    >>> [(key, type(Xy[key]).__name__) for key in sorted(Xy)]
+    [('X', 'memmap'), ('X/test', 'memmap'), ('y', 'ndarray')]
+    """
+    mmap_Xy = dict()
+    for i, key in enumerate(Xy):
+        arr = Xy[key]
+        if type(arr) is np.ndarray and not arr.dtype.hasobject and \
+                arr.nbytes > conf.MEMM_THRESHOLD:
+            # Numbered: keys may hold conf.SEP or any character
+            filepath = os.path.join(dirpath, "%i.npy" % i)
+            np.save(filepath, arr)
+            arr = np.load(filepath, mmap_mode="r")
+        mmap_Xy[key] = arr
+    return mmap_Xy
+
+
+# Tree reduced by the processes of parallel_reduce, inherited when they
+# are forked rather than pickled
+_reduce_tree_root = None
+
+
+def _init_reduce_process(tree_root):
+    global _reduce_tree_root
+    _reduce_tree_root = tree_root
+
+
+def _reduce_subtrees(nodes_input):
+    """Reduce the subtrees of nodes_input, return their results indexed by
+    the keys of their root nodes."""
+    partials = dict()
+    for key in nodes_input:
+        node = _reduce_tree_root.get_node(nodes_input[key])
+        partials[node.get_key()] = list(node.reduce_iter())
+    return partials
+
+
+def parallel_reduce(tree_root, num_processes=-1):
+    """Reduce the tree in parallel: the subtrees are split between the
+    processes as for the map (see SplitNodesInput), each process reduces
+    its subtrees, then the tree root reduces their results (see
+    BaseNode.reduce_iter).
+
+    The tree is given to the processes when they are forked, its stores
+    are not copied. Processes are used rather than threads since the nodes
+    below a splitter are shared by its children.
+
+    Parameters
+    ----------
+    tree_root: BaseNode
+
+    num_processes: integer
+        Number of processes, -1 (default) for the number of CPUs
+
+    Example
+    -------
+    >>> from sklearn import datasets
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Perms, Methods
+    >>> from epac.map_reduce.engine import parallel_reduce
+    >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+    ...                                     n_informative=2,
+    ...                                     random_state=1)
+    >>> wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+    ...            n_perms=4, random_state=0)
+    >>> _ = wf.run(X=X, y=y)
+    >>> repr(parallel_reduce(wf, num_processes=2)) == repr(wf.reduce())
+    True
+    """
+    from multiprocessing import Pool
+    from epac.map_reduce.results import ResultSet
+    if num_processes < 0:
+        num_processes = multiprocessing.cpu_count()
+    node_input = NodesInput(tree_root.get_key())
+    input_list = SplitNodesInput(tree_root,
+                                 num_processes=max(num_processes, 1)).split(
+        node_input)
+    if len(input_list) <= 1:
+        return tree_root.reduce()
+    pool = Pool(processes=len(input_list),
+                initializer=_init_reduce_process,
+                initargs=(tree_root,))
+    try:
+        partials_list = pool.map(_reduce_subtrees, input_list)
+    finally:
+        pool.close()
+        pool.join()
+    partials = dict()
+    for each_partials in partials_list:
+        partials.update(each_partials)
+    return ResultSet(*tree_root.reduce_iter(partials=partials))
+
+
+def get_column_groups(tree_root):
+    """Return the column groups of the arrays split by the ColumnSplitters
+    of the tree, to be given to save_dataset. An array split differently
+    by two splitters is left out.
+
+    Example
+    -------
+    >>> from sklearn.svm import SVC
+    >>> from epac import ColumnSplitter, Methods
+    >>> from epac.map_reduce.engine import get_column_groups
+    >>> tree = ColumnSplitter(SVC(), {"X": [0, 0, 1, 1]})
+    >>> get_column_groups(tree)
+    {'X': [0, 0, 1, 1]}
+    """
+    from epac.workflow.splitters import CRSplitter
+    column_groups = dict()
+    conflicts = set()
+    for node in tree_root.walk_true_nodes():
+        if not isinstance(node, CRSplitter) or not node.slicer.col_or_row:
+            continue
+        for key in node.indices_of_groups:
+            groups = list(node.indices_of_groups[key])
+            if key in column_groups and column_groups[key] != groups:
+                conflicts.add(key)
+            column_groups[key] = groups
+    for key in conflicts:
+        del column_groups[key]
+    return column_groups
+
+
 class JobInfo:
     def __init__(self):
         self.mem_cost = None
@@ -166,6 +402,39 @@ class SomaWorkflowEngine(LocalEngine):
         'auto' means that the system determine if we use memory mapping or not.
         See numpy.load for the meaning of the other arguments.
 
+    compress: boolean
+        If True, the dataset and the results of the jobs are saved with
+        their compressible arrays compressed (see epac.compression).
+
+    column_blocks: boolean
+        If True, the arrays split by a ColumnSplitter of the tree are saved
+        by column groups (see epac.utils.save_dataset), each job then only
+        reads the columns it works on.
+
+    shards: boolean
+        If True, each job saves its results in a shard of its own instead
+        of saving the tree again (see epac.stores.StoreShards). The results
+        are then only loaded while reducing, unless the local tree is
+        removed.
+
+    tree_spec: boolean
+        If True, the specification of the tree is saved with it (see
+        epac.workflow.spec): each job builds from it the subtrees it runs
+        instead of unpickling the whole tree. The tree must be made of
+        nodes and objects that can be described, otherwise ValueError is
+        raised.
+
+    jobs_per_command: integer
+        The number of jobs run one after the other by each epac_mapper
+        command, which loads the dataset and the tree once for all of them.
+        Fewer commands than jobs are then submitted, which saves the start
+        up of the mapper processes when the jobs are short.
+
+    profile: boolean
+        If True, each job writes the profile of its nodes, they are merged
+        in attribute "profiler" once the workflow is done (see
+        epac.hooks.NodeProfiler).
+
     engine_info: list of JobInfo
         You can get engine_info when call SomaWorkflowEngine.run
         It works only on DRMS
@@ -173,6 +442,7 @@ class SomaWorkflowEngine(LocalEngine):
         local machine
     '''
     dataset_relative_path = "./dataset"
+    profiles_relative_path = "./profiles"
     open_me_by_soma_workflow_gui = "open_me_by_soma_workflow_gui"
 
     def __init__(self,
@@ -185,10 +455,20 @@ class SomaWorkflowEngine(LocalEngine):
                  remove_finished_wf=True,
                  remove_local_tree=True,
                  mmap_mode="auto",
-                 queue=None):
-        super(SomaWorkflowEngine, self).__init__(tree_root=tree_root,
-                                                 function_name=function_name,
-                                                 num_processes=num_processes)
+                 queue=None,
+                 retention_policy=None,
+                 compress=False,
+                 column_blocks=False,
+                 shards=False,
+                 tree_spec=False,
+                 jobs_per_command=1,
+                 profile=False):
+        super(SomaWorkflowEngine, self).__init__(
+            tree_root=tree_root,
+            function_name=function_name,
+            num_processes=num_processes,
+            retention_policy=retention_policy,
+            profile=profile)
         if num_processes == -1:
             self.num_processes = 20
         self.resource_id = resource_id
@@ -198,6 +478,11 @@ class SomaWorkflowEngine(LocalEngine):
         self.remove_local_tree = remove_local_tree
         self.mmap_mode = mmap_mode
         self.queue = queue
+        self.compress = compress
+        self.column_blocks = column_blocks
+        self.shards = shards
+        self.tree_spec = tree_spec
+        self.jobs_per_command = jobs_per_command
         self.engine_info = []
 
     def _save_job_list(self,
@@ -246,18 +531,30 @@ class SomaWorkflowEngine(LocalEngine):
                      ft_working_directory):
         from soma_workflow.client import Job
         jobs = []
-        for nodesfile in keysfile_list:
+        for nodesfiles in group_job_list(keysfile_list,
+                                         self.jobs_per_command):
+            nodesfile = ",".join(nodesfiles)
             command = []
             command.append("epac_mapper")
             command.append("--datasets")
             command.append('"'
                            + SomaWorkflowEngine.dataset_relative_path
                            + '"')
-            command.append("--keysfile")
-            command.append('"' + (nodesfile) + '"')
+            for keysfile in nodesfiles:
+                command.append("--keysfile")
+                command.append('"' + (keysfile) + '"')
             if self.mmap_mode:
                 command.append("--mmap_mode")
                 command.append(self.mmap_mode)
+            if self.compress:
+                command.append("--compress")
+            if self.shards:
+                command.append("--shards")
+            if self.profile:
+                command.append("--profile")
+                command.append('"'
+                               + SomaWorkflowEngine.profiles_relative_path
+                               + '"')
             if not is_run_local:
                 job = Job(command,
                           referenced_input_files=[ft_working_directory],
@@ -368,11 +665,19 @@ class SomaWorkflowEngine(LocalEngine):
         ## ===============================================
         # np.savez(os.path.join(tmp_work_dir_path,
         # SomaWorkflowEngine.dataset_relative_path), **Xy)
-        save_dataset(SomaWorkflowEngine.dataset_relative_path, **Xy)
+        column_groups = get_column_groups(self.tree_root) \
+            if self.column_blocks else None
+        save_dataset(SomaWorkflowEngine.dataset_relative_path,
+                     compress=self.compress, column_groups=column_groups,
+                     **Xy)
         store = StoreFs(dirpath=os.path.join(
             tmp_work_dir_path,
             SomaWorkflowEngine.tree_root_relative_path))
         self.tree_root.save_tree(store=store)
+        if self.tree_spec:
+            from epac.workflow.spec import save_tree_spec
+            save_tree_spec(self.tree_root, os.path.join(
+                store.dirpath, conf.STORE_TREE_SPEC))
 
         ## Subtree job allocation on disk
         ## ==============================
@@ -402,12 +707,24 @@ class SomaWorkflowEngine(LocalEngine):
         Helper.transfer_output_files(wf_id, controller)
 
         self.engine_info = self.get_engine_info(controller, wf_id)
+        profiles_path = os.path.join(
+            tmp_work_dir_path, SomaWorkflowEngine.profiles_relative_path)
+        if self.profile and os.path.isdir(profiles_path):
+            from epac.hooks import NodeProfiler
+            self.profiler = NodeProfiler.load(profiles_path)
 
         if self.remove_finished_wf:
             controller.delete_workflow(wf_id)
         ## read result tree
         ## ================
-        self.tree_root = store.load()
+        self.tree_root = attach_shards(store.load(), store.dirpath)
+        if self.remove_local_tree and \
+                isinstance(self.tree_root.store, StoreShards):
+            # the shards are about to be removed: load their results
+            shards = self.tree_root.store
+            self.tree_root.store = create_store_mem()
+            for key in shards.keys():
+                self.tree_root.store.save(key, shards.load(key))
         os.chdir(cur_work_dir)
         if os.path.isdir(tmp_work_dir_path) and self.remove_local_tree:
             shutil.rmtree(tmp_work_dir_path)
@@ -443,11 +760,19 @@ class SomaWorkflowEngine(LocalEngine):
 #                 SomaWorkflowEngine.dataset_relative_path), **Xy)
         db_size = estimate_dataset_size(**Xy)
         db_size = int(db_size / (1024 * 1024))  # convert it into mega byte
-        save_dataset(SomaWorkflowEngine.dataset_relative_path, **Xy)
+        column_groups = get_column_groups(self.tree_root) \
+            if self.column_blocks else None
+        save_dataset(SomaWorkflowEngine.dataset_relative_path,
+                     compress=self.compress, column_groups=column_groups,
+                     **Xy)
         store = StoreFs(dirpath=os.path.join(
             tmp_work_dir_path,
             SomaWorkflowEngine.tree_root_relative_path))
         self.tree_root.save_tree(store=store)
+        if self.tree_spec:
+            from epac.workflow.spec import save_tree_spec
+            save_tree_spec(self.tree_root, os.path.join(
+                store.dirpath, conf.STORE_TREE_SPEC))
         ## Subtree job allocation on disk
         ## ==============================
         node_input = NodesInput(self.tree_root.get_key())
@@ -478,7 +803,7 @@ class SomaWorkflowEngine(LocalEngine):
         store = StoreFs(dirpath=os.path.join(
             soma_workflow_dirpath,
             SomaWorkflowEngine.tree_root_relative_path))
-        tree_root = store.load()
+        tree_root = attach_shards(store.load(), store.dirpath)
         return tree_root
 
 
@@ -17,7 +17,7 @@ import subprocess
 
 from epac.errors import NoSomaWFError, NoEpacTreeRootError
 from epac.configuration import conf
-from epac.utils import which
+from epac.utils import which, trim_filepath
 from epac.workflow.splitters import CVBestSearchRefit
 
 # _classes_cannot_be_splicted = [CVBestSearchRefit.__class__.__name__]
@@ -174,6 +174,62 @@ def save_job_list(working_directory,
     return keysfile_list
 
 
+def load_job_list(paths):
+    '''Read the keys of the jobs written by save_job_list.
+
+    Parameters
+    ----------
+    paths: list of string
+        Paths of keysfiles, or of directories whose keysfiles (".job"
+        files) are all read, in name order.
+
+    Return the list of (keysfile path, list of keys), one item per job.
+
+    Example
+    -------
+    >>> import tempfile
+    >>> from epac.map_reduce.exports import save_job_list, load_job_list
+    >>> nodesinput_list = [{'Perms/Perm(nb=0)': 'Perms/Perm(nb=0)'},
+    ...                    {'Perms/Perm(nb=1)': 'Perms/Perm(nb=1)'}]
+    >>> working_directory = tempfile.mkdtemp()
+    >>> _ = save_job_list(working_directory, nodesinput_list)
+    >>> [keys for _, keys in load_job_list([working_directory])]
+    [['Perms/Perm(nb=0)'], ['Perms/Perm(nb=1)']]
+    '''
+    keysfiles = list()
+    for path in paths:
+        if os.path.isdir(path):
+            suffix = "." + conf.SUFFIX_JOB
+            keysfiles += [os.path.join(path, basename) for basename in
+                          sorted(os.listdir(path))
+                          if basename.endswith(suffix)]
+        else:
+            keysfiles.append(path)
+    jobs = list()
+    for keysfile in keysfiles:
+        f = open(keysfile, 'r')
+        keys = [trim_filepath(line) for line in f.readlines()]
+        f.close()
+        jobs.append((keysfile, [key for key in keys if key]))
+    return jobs
+
+
+def group_job_list(keysfile_list, jobs_per_command=1):
+    '''Group the keysfiles by jobs_per_command, the jobs run by a single
+    epac_mapper command (it accepts several keysfiles): the dataset and the
+    tree are loaded once for the jobs of a group.
+
+    Example
+    -------
+    >>> from epac.map_reduce.exports import group_job_list
+    >>> group_job_list(['./0.job', './1.job', './2.job'], jobs_per_command=2)
+    [['./0.job', './1.job'], ['./2.job']]
+    '''
+    jobs_per_command = max(1, int(jobs_per_command))
+    return [keysfile_list[i:i + jobs_per_command]
+            for i in xrange(0, len(keysfile_list), jobs_per_command)]
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
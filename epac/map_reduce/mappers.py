@@ -9,7 +9,10 @@ Created on Thu Jun 13 11:12:28 2013
 
 import os
 from abc import ABCMeta, abstractmethod
-from epac import key_pop, StoreMem
+from epac import key_pop
+from epac import hooks
+from epac.workflow.base import get_input_keys
+from epac.stores import create_store_mem
 from epac.utils import clean_tree_stores
 
 
@@ -19,6 +22,44 @@ def map_process(map_input, mapper):
     return mapper.map(map_input)
 
 
+def instrumented_map_process(map_input, mapper, profile=False,
+                             trace_dir=None):
+    '''map_process that profiles its nodes and / or traces the process
+    (see epac.hooks).
+
+    Return the tree root and the records of the NodeProfiler (None if
+    profile is False). When a trace is written in trace_dir, the tree
+    root is returned pickled so that its serialization is traced.
+    '''
+    import cPickle
+    import tempfile
+    from epac.hooks import NodeProfiler, Tracer
+    profiler = NodeProfiler().start() if profile else None
+    tracer = Tracer(name="map process %i" % os.getpid()).start() \
+        if trace_dir else None
+    try:
+        if tracer:
+            with tracer.span("map", keys=sorted(map_input.values())):
+                tree_root = mapper.map(map_input)
+        else:
+            tree_root = mapper.map(map_input)
+    finally:
+        if profiler:
+            profiler.stop()
+        if tracer:
+            tracer.stop()
+    records = profiler.records if profiler else None
+    if tracer:
+        with tracer.span("serialize results"):
+            tree_root = cPickle.dumps(tree_root, cPickle.HIGHEST_PROTOCOL)
+        # A process may run several map inputs
+        fd, trace_path = tempfile.mkstemp(prefix="%i_" % os.getpid(),
+                                          suffix=".json", dir=trace_dir)
+        os.close(fd)
+        tracer.save(trace_path)
+    return tree_root, records
+
+
 class Mapper(object):
     __metaclass__ = ABCMeta
 
@@ -34,7 +75,10 @@ class MapperSubtrees(Mapper):
 
     Parameters
     ----------
-    Xy:X matrix and y vertor
+    Xy: dictionary or mapping
+        X matrix and y vertor. Only the inputs read by the nodes of the
+        subtrees (see BaseNode.get_input_keys) are accessed, so that a
+        epac.utils.LazyDataset only loads those.
 
     tree_root: epac.BaseNode
         the root node of the epac tree
@@ -42,6 +86,17 @@ class MapperSubtrees(Mapper):
     store_fs:
         where the node want to save
 
+    shard_store: Store
+        If given (usually a StorePack), the results of the subtrees are
+        saved in it, keys and payloads only, and store_fs is not written:
+        the tree is not saved again (see StoreShards).
+
+    save_tree: boolean
+        If True (default), map() saves the whole tree in store_fs once its
+        subtrees have run. Set it to False to map several jobs with the
+        same tree and save it once, after the last one (see epac_mapper):
+        the results of each subtree are saved by map() anyway.
+
     function:
         function of node
 
@@ -108,12 +163,30 @@ class MapperSubtrees(Mapper):
                  Xy,
                  tree_root,
                  store_fs=None,
-                 function="transform"):
+                 function="transform",
+                 shard_store=None,
+                 save_tree=True):
 
         self.Xy = Xy
         self.tree_root = tree_root
         self.store_fs = store_fs
         self.function = function
+        self.shard_store = shard_store
+        self.save_tree = save_tree
+
+    def get_inputs(self, listkey):
+        """Return the dictionary of the items of self.Xy read by the nodes
+        from the root to the subtrees of listkey, all the items if a node
+        does not tell."""
+        nodes = list()
+        for key in listkey:
+            node = self.tree_root.get_node(key)
+            nodes += list(node.get_path_from_root())
+            nodes += list(node.walk_true_nodes())
+        input_keys = get_input_keys(nodes)
+        if input_keys is None:
+            return dict(self.Xy)
+        return {k: self.Xy[k] for k in self.Xy if k in input_keys}
 
     def map(self, nodes_input):
         """Run self.function for each sub_tree of map_input
@@ -127,6 +200,7 @@ class MapperSubtrees(Mapper):
         for key_map_input in nodes_input:
             listkey.append(nodes_input[key_map_input])
         common_parent_key, _ = key_pop(os.path.commonprefix(listkey))
+        Xy = hooks.call("load", self.tree_root, self.get_inputs, (listkey,))
         common_parent = None
         common_parent = self.tree_root.get_node(common_parent_key)
         if common_parent:
@@ -135,11 +209,11 @@ class MapperSubtrees(Mapper):
                     self.tree_root.get_node(node_root2common.get_key())
                 # print node_root2common
                 func = getattr(node_root2common, self.function)
-                self.Xy = func(**self.Xy)
+                Xy = func(**Xy)
         # Execute what is specific to each keys
         for curr_key in listkey:
             # curr_key = listkey.__iter__().next()
-            cpXy = self.Xy
+            cpXy = Xy
             # print curr_key
             # curr_key = 'Permutations/Perm(nb=3)'
             curr_node = self.tree_root.get_node(curr_key)
@@ -158,18 +232,33 @@ class MapperSubtrees(Mapper):
                 cpXy = func(**cpXy)
             curr_node = self.tree_root.get_node(curr_key)
             # print "Recursively run from root to current node"
-            if self.store_fs:
+            if self.store_fs or self.shard_store:
                 clean_tree_stores(curr_node)
-                curr_node.store = StoreMem()
+                curr_node.store = create_store_mem()
             curr_node.run(**cpXy)
             # print "Save results"
-            if self.store_fs:
+            if self.shard_store:
+                self._save_shard(curr_node)
+                clean_tree_stores(curr_node)
+            elif self.store_fs:
                 curr_node.collect_save(store=self.store_fs)
                 clean_tree_stores(curr_node)
-        if self.store_fs:
+        if self.shard_store:
+            self.shard_store.flush()
+        elif self.store_fs and self.save_tree:
             self.tree_root.save_tree(store=self.store_fs)
+        if self.tree_root.store:
+            self.tree_root.store.flush()
         return self.tree_root
 
+    def _save_shard(self, node):
+        """Save the results found in the stores of the subtree of node in
+        self.shard_store"""
+        for each_node in node.walk_true_nodes():
+            if each_node.store:
+                for key in each_node.store.keys():
+                    self.shard_store.save(key, each_node.store.load(key))
+
 
 if __name__ == "__main__":
     import doctest
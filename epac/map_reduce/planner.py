@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Dry run of a tree: predict the cost of each job of a partition (see
+epac.map_reduce.split_input.SplitNodesInput) without running it.
+
+The tree is walked symbolically: the data flow is a dictionary of array
+shapes, the children of the splitters (VirtualList) are planned once and
+counted as many times as the splitter has children.
+"""
+
+import os
+import numpy as np
+
+from epac.configuration import conf
+from epac.workflow.base import key_pop
+from epac.utils import train_test_merge, train_test_split, _sub_dict
+from epac.map_reduce.inputs import NodesInput
+from epac.map_reduce.split_input import SplitNodesInput
+
+# Counters of a plan, summed over the jobs (peak_nbytes: max)
+COUNTERS = ("nodes", "fits", "predicts", "slices", "slice_nbytes",
+            "result_nbytes", "time")
+
+
+def _nbytes(shapes):
+    """Bytes of the arrays of a data flow of shapes"""
+    return sum([int(np.prod(shapes[k][0])) * shapes[k][1] for k in shapes
+                if isinstance(shapes[k], tuple)])
+
+
+def _resize(shape, axis, size):
+    shape = list(shape)
+    if len(shape) > axis:
+        shape[axis] = size
+    return tuple(shape)
+
+
+def _cls(node):
+    """Class name of the (wrapped) node, as in epac.hooks.NodeProfiler"""
+    return getattr(node, "wrapped_node", node).__class__.__name__
+
+
+class ExecutionPlanner(object):
+    """Dry-run execution planner: predict, for each job of a partition of a
+    tree, its number of fits and predicts, the bytes of data sliced, the
+    bytes of its results and its time, from the shapes of the dataset.
+
+    The times are those of a calibration: the seconds of an execution of
+    each node class, by default none (time is 0). See calibrate, to get
+    them from the NodeProfiler of a pilot run (e.g. with a few permutations
+    on the same dataset).
+
+    Parameters
+    ----------
+    tree_root: BaseNode
+        The tree to plan.
+
+    Xy: dict
+        The dataset: arrays or shapes (tuples, of float64 items).
+
+    calibration: dict or epac.hooks.NodeProfiler
+        Seconds of an execution by node class (see calibrate).
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from sklearn.svm import LinearSVC
+    >>> from epac import Perms, CV, Methods
+    >>> from epac.map_reduce.planner import ExecutionPlanner
+    >>> wf = Perms(CV(Methods(LinearSVC(C=1), LinearSVC(C=10)), n_folds=5),
+    ...            n_perms=100)
+    >>> planner = ExecutionPlanner(wf, dict(X=(1000, 50000), y=(1000,)),
+    ...                            calibration=dict(LinearSVC=2.))
+    >>> plan = planner.plan(num_processes=4)
+    >>> [(job["fits"], job["time"]) for job in plan["jobs"]]
+    [(250, 500.0), (250, 500.0), (250, 500.0), (250, 500.0)]
+    >>> plan["total"]["fits"], plan["total"]["predicts"]
+    (1000, 2000)
+    >>> plan["total"]["slice_nbytes"] / 2 ** 30  # GiB sliced by the CVs
+    186
+    """
+
+    def __init__(self, tree_root, Xy, calibration=None):
+        self.tree_root = tree_root
+        self.shapes = dict()
+        for key in Xy:
+            if isinstance(Xy[key], tuple):
+                self.shapes[key] = (Xy[key], 8)
+            else:
+                arr = np.asarray(Xy[key]) if not hasattr(Xy[key], "shape") \
+                    else Xy[key]
+                self.shapes[key] = (arr.shape, arr.dtype.itemsize)
+        # Memory mapped arrays are not resident
+        self.input_nbytes = sum([
+            _nbytes({key: self.shapes[key]}) for key in Xy
+            if not isinstance(Xy[key], (tuple, np.memmap))])
+        if calibration is not None and \
+                not isinstance(calibration, dict):
+            calibration = ExecutionPlanner.calibrate(calibration)
+        self.calibration = calibration
+        self._uncalibrated = set()
+
+    @staticmethod
+    def calibrate(profiler):
+        """Return the seconds of an execution by node class from the
+        records of a NodeProfiler: the time of the operations of the node
+        (fit, predict, slice, save) by execution, its subtree excluded."""
+        from epac.hooks import NodeProfiler
+        records = profiler.records if isinstance(profiler, NodeProfiler) \
+            else profiler
+        times = dict()
+        counts = dict()
+        for record in records.values():
+            cls = record["cls"]
+            times[cls] = times.get(cls, 0.) + sum(
+                [record[op] for op in ("fit", "predict", "slice", "save")])
+            counts[cls] = counts.get(cls, 0) + record["count"]
+        return dict([(cls, times[cls] / counts[cls]) for cls in times
+                     if counts[cls]])
+
+    def plan(self, num_processes=None, input_list=None):
+        """Plan the jobs of input_list, a list of NodesInput (by default
+        the partition of the tree by SplitNodesInput in num_processes
+        jobs).
+
+        Return a dictionary: "jobs" the list of the plans of the jobs, a
+        dictionary of "keys", the counters "nodes", "fits", "predicts",
+        "slices", "slice_nbytes", "result_nbytes", "time" and
+        "peak_nbytes" (resident dataset + slices of the deepest path +
+        results); "total" the counters summed over the jobs ("peak_nbytes"
+        is the max); "makespan" the time of the longest job; and
+        "uncalibrated" the node classes without calibration.
+        """
+        if input_list is None:
+            input_list = SplitNodesInput(
+                self.tree_root,
+                num_processes=num_processes or 1).split(
+                    NodesInput(self.tree_root.get_key()))
+        self._uncalibrated = set()
+        jobs = [self.plan_job(nodes_input) for nodes_input in input_list]
+        total = dict([(name, sum([job[name] for job in jobs]))
+                      for name in COUNTERS])
+        total["peak_nbytes"] = max([job["peak_nbytes"] for job in jobs])
+        return dict(jobs=jobs, total=total,
+                    makespan=max([job["time"] for job in jobs]),
+                    uncalibrated=sorted(self._uncalibrated))
+
+    def plan_job(self, nodes_input):
+        """Plan a job, as run by epac.map_reduce.mappers.MapperSubtrees:
+        the path from the root to the common parent of its nodes once, then
+        for each node the rest of its path and its subtree."""
+        listkey = sorted(nodes_input.values())
+        cost = dict([(name, 0) for name in COUNTERS])
+        cost["path_nbytes"] = 0
+        common_parent_key, _ = key_pop(os.path.commonprefix(listkey))
+        common_parent = self.tree_root.get_node(common_parent_key)
+        shapes, path_nbytes = dict(self.shapes), 0
+        if common_parent:
+            path = list(common_parent.get_path_from_root())
+            shapes, path_nbytes = self._plan_path(path, shapes, cost, 1,
+                                                  path_nbytes)
+        for key in listkey:
+            node = self.tree_root.get_node(key)
+            path = list(node.get_path_from_node(common_parent)) \
+                if common_parent else list(node.get_path_from_root())
+            # The common parent has been run, the node is run with its
+            # subtree
+            path = [n for n in path[:-1] if n is not common_parent]
+            cp_shapes, cp_path_nbytes = self._plan_path(path, shapes, cost,
+                                                        1, path_nbytes)
+            self._plan_subtree(node, cp_shapes, cost, 1, cp_path_nbytes)
+        job = dict([(name, cost[name]) for name in COUNTERS])
+        job["keys"] = listkey
+        job["peak_nbytes"] = self.input_nbytes + cost["path_nbytes"] + \
+            cost["result_nbytes"]
+        return job
+
+    def _plan_path(self, path, shapes, cost, mult, path_nbytes):
+        for node in path:
+            shapes, nbytes = self._plan_node(node, shapes, cost, mult)
+            path_nbytes += nbytes
+            cost["path_nbytes"] = max(cost["path_nbytes"], path_nbytes)
+        return shapes, path_nbytes
+
+    def _plan_subtree(self, node, shapes, cost, mult, path_nbytes):
+        shapes, path_nbytes = self._plan_path([node], shapes, cost, mult,
+                                              path_nbytes)
+        children = node.children
+        if not children:
+            # Leaf: its output is saved as a result
+            cost["result_nbytes"] += mult * _nbytes(shapes)
+        elif isinstance(children, list):
+            for child in children:
+                self._plan_subtree(child, shapes, cost, mult, path_nbytes)
+        else:
+            # The children of a VirtualList only differ by their slices
+            self._plan_subtree(children[0], shapes, cost,
+                               mult * len(children), path_nbytes)
+
+    def _time(self, node):
+        if self.calibration is None:
+            return 0.
+        cls = _cls(node)
+        if not cls in self.calibration:
+            self._uncalibrated.add(cls)
+        return self.calibration.get(cls, 0.)
+
+    def _plan_node(self, node, shapes, cost, mult):
+        """Add the cost of the transform of node to cost, return the
+        shapes of its output and the bytes it allocated"""
+        from epac.workflow.splitters import CRSlicer, CVBestSearchRefit
+        from epac.workflow.splitters import CVBestSearchRefitParallel
+        from epac.sklearn_plugins.estimators import Estimator
+        cost["nodes"] += mult
+        cost["time"] += mult * self._time(node)
+        nbytes = 0
+        if isinstance(node, CRSlicer):
+            shapes, nbytes = self._plan_slicer(node, shapes)
+            cost["slices"] += mult
+            cost["slice_nbytes"] += mult * nbytes
+        elif isinstance(node, Estimator):
+            shapes = self._plan_estimator(node, shapes, cost, mult)
+        elif isinstance(node, CVBestSearchRefit):
+            Xy_train, Xy_test = train_test_split(shapes)
+            # Grid search on the train set, then refit of the best path,
+            # planned as the leftmost one
+            self._plan_subtree(node.cv, dict(Xy_train), cost, mult, 0)
+            path = list(node.cv.get_leftmost_leaf().get_path_from_node(
+                node.cv.children[0]))[1:]
+            shapes, _ = self._plan_path(path, shapes, cost, mult, 0)
+        elif isinstance(node, CVBestSearchRefitParallel):
+            # The input is saved for the refit of the reduce
+            cost["result_nbytes"] += mult * _nbytes(shapes)
+            shapes, _ = train_test_split(shapes)
+        return shapes, nbytes
+
+    def _plan_slicer(self, node, shapes):
+        """Return the shapes of the output of a slicer, and the bytes of
+        the arrays it sliced"""
+        from epac.workflow.splitters import CV, CRSplitter
+        splitter = node.parent
+        axis = 1 if node.col_or_row else 0
+        shapes = dict(shapes)
+        if isinstance(splitter, CV):
+            n_samples = shapes[splitter.cv_key][0][0]
+            n_test = 1 if splitter.cv_type == "loo" else \
+                int(np.ceil(float(n_samples) / splitter.n_folds))
+            data_keys = node.apply_on if node.apply_on else \
+                [k for k in shapes if isinstance(shapes[k], tuple)]
+            train, test = dict(), dict()
+            for key in data_keys:
+                shape, itemsize = shapes.pop(key)
+                train[key] = (_resize(shape, axis, n_samples - n_test),
+                              itemsize)
+                test[key] = (_resize(shape, axis, n_test), itemsize)
+            sliced = train_test_merge(train, test)
+            shapes.update(sliced)
+            shapes[conf.KW_SPLIT_TRAIN_TEST] = True
+        elif isinstance(splitter, CRSplitter):
+            # Mean size of the groups
+            sliced = dict()
+            for key in splitter.uni_indices_of_groups:
+                shape, itemsize = shapes[key]
+                size = int(np.ceil(float(shape[axis]) /
+                           len(splitter.uni_indices_of_groups[key])))
+                sliced[key] = (_resize(shape, axis, size), itemsize)
+            shapes.update(sliced)
+        else:
+            # Perms: the permuted arrays keep their shape
+            sliced = _sub_dict(shapes, node.apply_on or [])
+        return shapes, _nbytes(sliced)
+
+    def _plan_estimator(self, node, shapes, cost, mult):
+        Xy_train, Xy_test = train_test_split(shapes)
+        split = Xy_train is not Xy_test
+        cost["fits"] += mult
+        cost["predicts"] += mult * (2 if split else 1)
+        if not node.children and hasattr(node, "out_args_predict"):
+            # fit / predict: the predictions, and the true values
+            out = [k for k in node.out_args_predict if k in Xy_train]
+            if split:
+                shapes = dict()
+                for key in out:
+                    shapes[key + conf.SEP + conf.TRAIN + conf.SEP +
+                           conf.PREDICTION] = Xy_train[key]
+                    shapes[key + conf.SEP + conf.TEST + conf.SEP +
+                           conf.PREDICTION] = Xy_test[key]
+                    shapes[key + conf.SEP + conf.TEST + conf.SEP +
+                           conf.TRUE] = Xy_test[key]
+            else:
+                shapes = dict()
+                for key in out:
+                    shapes[key + conf.SEP + conf.PREDICTION] = Xy_train[key]
+                    shapes[key + conf.SEP + conf.TRUE] = Xy_train[key]
+            return shapes
+        # fit / transform: the shape of the output is unknown, planned as
+        # the one of the input
+        return shapes
+
+    @staticmethod
+    def report(plan):
+        """Return the plan as a table: a line by job and the total"""
+        lines = ["%-5s %7s %9s %9s %11s %11s %11s %10s" % (
+            "job", "nodes", "fits", "predicts", "sliced(MB)", "results(MB)",
+            "peak(MB)", "time(s)")]
+        rows = [(str(i), job) for i, job in enumerate(plan["jobs"])] + \
+            [("total", plan["total"])]
+        for name, job in rows:
+            lines.append("%-5s %7i %9i %9i %11.1f %11.1f %11.1f %10.1f" % (
+                name, job["nodes"], job["fits"], job["predicts"],
+                job["slice_nbytes"] / 1048576., job["result_nbytes"] /
+                1048576., job["peak_nbytes"] / 1048576., job["time"]))
+        lines.append("makespan %.1fs" % plan["makespan"])
+        if plan["uncalibrated"]:
+            lines.append("no calibration for %s" %
+                         ", ".join(plan["uncalibrated"]))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -6,14 +6,12 @@ Reducers for EPAC
 @author: edouard.duchesnay@cea.fr
 """
 import numpy as np
-from scipy.stats import binom_test
 import re
 from abc import abstractmethod
 from epac.map_reduce.results import Result
 from epac.configuration import conf
 from epac.workflow.base import key_push, key_pop
 from epac.workflow.base import key_split
-from sklearn.metrics import precision_recall_fscore_support, accuracy_score
 
 ## ======================================================================== ##
 ## == Reducers                                                           == ##
@@ -24,7 +22,14 @@ class Reducer:
     """ Reducer abstract class, called within the reduce method to process
     up-stream data flow of Result.
 
-    Inherited classes should implement reduce(result)."""
+    Inherited classes should implement reduce(result).
+
+    Splitters that group the results of their children by key (CV, Perms)
+    reduce each group in a streaming way (see BaseNode.reduce_iter):
+    state = fold_init(), then state = fold(state, result) for each result
+    of the group as it comes, then fold_finalize(state) returns the reduced
+    Result. By default the results are kept and given stacked to reduce(),
+    inherited classes may keep only what reduce needs."""
     @abstractmethod
     def reduce(self, result):
         """Reduce abstract method
@@ -36,6 +41,19 @@ class Reducer:
             A result
         """
 
+    def fold_init(self):
+        """Return the initial state of the reduction of a group"""
+        return list()
+
+    def fold(self, state, result):
+        """Add a result of the group to state, return the state"""
+        state.append(result)
+        return state
+
+    def fold_finalize(self, state):
+        """Return the reduced result of the group"""
+        return self.reduce(Result.stack(*state))
+
 
 class ClassificationReport(Reducer):
     """Reducer that computes classification statistics.
@@ -68,6 +86,10 @@ class ClassificationReport(Reducer):
         self.keep = keep
 
     def reduce(self, result):
+        # scipy and sklearn.metrics are slow to import: on first use
+        from scipy.stats import binom_test
+        from sklearn.metrics import precision_recall_fscore_support
+        from sklearn.metrics import accuracy_score
         if self.select_regexp:
             inputs = [key3 for key3 in result
                       if re.search(self.select_regexp, str(key3))]
@@ -127,6 +149,27 @@ class ClassificationReport(Reducer):
             out.update(result)
         return out
 
+    def fold_init(self):
+        if self.keep:
+            return Reducer.fold_init(self)
+        return dict()
+
+    def fold(self, state, result):
+        """Only keep the items used to compute the scores"""
+        if self.keep:
+            return Reducer.fold(self, state, result)
+        for key3 in result:
+            if key3 == "key" or not self.select_regexp or \
+                    re.search(self.select_regexp, str(key3)):
+                state.setdefault(key3, list()).append(result[key3])
+        return state
+
+    def fold_finalize(self, state):
+        if self.keep:
+            return Reducer.fold_finalize(self, state)
+        state["key"] = state["key"][0]
+        return self.reduce(Result(**state))
+
 
 class PvalPerms(Reducer):
     """Reducer that computes p-values of stattistics.
@@ -158,6 +201,42 @@ class PvalPerms(Reducer):
             out.update(result)
         return out
 
+    def fold_init(self):
+        if self.keep:
+            return Reducer.fold_init(self)
+        return dict(key=None, observed=dict(), count=dict(), n=dict())
+
+    def fold(self, state, result):
+        """The first result holds the observed statistics, the following
+        ones are only counted"""
+        if self.keep:
+            return Reducer.fold(self, state, result)
+        if state["key"] is None:
+            state["key"] = result.key()
+            for key in result:
+                if key != "key" and (not self.select_regexp or
+                                     re.search(self.select_regexp, str(key))):
+                    state["observed"][key] = result[key]
+                    state["count"][key] = 0
+                    state["n"][key] = 0
+            return state
+        for key in state["observed"]:
+            randm_res = np.vstack([result[key]])
+            state["count"][key] = state["count"][key] + \
+                np.sum(randm_res > state["observed"][key], axis=0)
+            state["n"][key] += randm_res.shape[0]
+        return state
+
+    def fold_finalize(self, state):
+        if self.keep:
+            return Reducer.fold_finalize(self, state)
+        out = Result(key=state["key"])
+        for key in state["observed"]:
+            out[key] = state["observed"][key]
+            count = np.asarray(state["count"][key]).astype("float")
+            out[key_push(key, "pval")] = count / state["n"][key]
+        return out
+
 
 class CVBestSearchRefitPReducer(Reducer):
     def __init__(self, NodeBestSearchRefit):
@@ -6,8 +6,11 @@ Created on Fri May 17 16:37:54 2013
 """
 from collections import Set
 import copy
+import re
 import warnings
+import numpy as np
 from epac.map_reduce.inputs import ReduceInput
+from epac.configuration import conf
 
 
 class ResultSet(Set):
@@ -186,6 +189,198 @@ class Result(ReduceInput):
         return Result(**stacked)
 
 
+class RetentionPolicy(object):
+    """Decide what a leaf keeps of its Result before saving it in a store.
+
+    Every leaf saves its predictions and true values. Under Perms(CV(...))
+    this means n_perms x n_folds x n_methods label vectors. A retention
+    policy, set on any node of the tree (attribute "retention_policy") or
+    given to the engine, trims each leaf Result right where it is produced.
+
+    Parameters
+    ----------
+    drop: list of str
+        Regular expressions, Result items whose name matches one of them
+        are not saved. Default drops the train predictions ("y/train/pred")
+        which are not used by ClassificationReport.
+
+    downcast: boolean
+        If True, the integer arrays of the items whose name matches one of
+        downcast_keys are saved with the smallest signed integer dtype that
+        holds their values. Default True.
+
+    downcast_keys: list of str
+        Regular expressions of the names of the items to downcast. Default
+        the labels: true values and predictions ("y/test/true",
+        "y/test/pred", ...). Other integer arrays (indices, ...) keep their
+        dtype.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac import Result, RetentionPolicy
+    >>> policy = RetentionPolicy()
+    >>> r = Result('SVC', **{'y/train/pred': np.array([0, 1, 1, 0]),
+    ...                      'y/test/pred': np.array([1, 0]),
+    ...                      'y/test/true': np.array([1, 1])})
+    >>> r = policy.apply(r)
+    >>> sorted(r.keys())
+    ['key', 'y/test/pred', 'y/test/true']
+    >>> r['y/test/pred'].dtype
+    dtype('int8')
+    >>> r = policy.apply(Result('SVC', **{'y/test/pred': np.array([1, 0]),
+    ...                                   'index': np.array([3, 7])}))
+    >>> r['y/test/pred'].dtype, r['index'].dtype
+    (dtype('int8'), dtype('int64'))
+    """
+    def __init__(self, drop=None, downcast=True, downcast_keys=None):
+        if drop is None:
+            drop = [conf.TRAIN + conf.SEP + conf.PREDICTION]
+        if downcast_keys is None:
+            downcast_keys = [conf.SEP + "(%s|%s)$" % (conf.TRUE,
+                                                      conf.PREDICTION)]
+        self.drop = list(drop)
+        self.downcast = downcast
+        self.downcast_keys = list(downcast_keys)
+        self._compile()
+
+    def _compile(self):
+        self._drop_re = [re.compile(regexp) for regexp in self.drop]
+        self._downcast_re = [re.compile(regexp)
+                             for regexp in self.downcast_keys]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_drop_re", None)
+        state.pop("_downcast_re", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    def apply(self, result):
+        """Return the result trimmed according to the policy."""
+        for k in result.keys():
+            if k == "key":
+                continue
+            if [r for r in self._drop_re if r.search(k)]:
+                del result[k]
+            elif self.downcast and \
+                    [r for r in self._downcast_re if r.search(k)]:
+                result[k] = downcast_int_array(result[k])
+        return result
+
+
+class ReduceCache(object):
+    """Reduced results of the internal nodes of a tree, kept with the stamp
+    of the results they were built from. Reducing again only recomputes the
+    nodes whose stamp has changed: the paths from the leaves whose results
+    have been saved again up to the root (see BaseNode.reduce_iter).
+
+    Set it on the tree root (attribute "reduce_cache"), conf.REDUCE_CACHE
+    sets one on every tree root which reduces. The stamp of a leaf is the
+    version of its results in the store (see Store.version), the stamp of
+    a node is a hash of the stamps of its children and of its reducer.
+    Nodes with an unknown stamp (None) are not cached. The cache keeps and
+    returns copies of the results, which can thus be modified; reducers
+    must not be modified. The cache is not pickled.
+
+    Attributes
+    ----------
+    hits: int
+        Number of nodes whose results have been read from the cache.
+
+    misses: int
+        Number of nodes whose results have been recomputed.
+
+    Example
+    -------
+    >>> from sklearn import datasets
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Methods, ReduceCache
+    >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+    ...                                     n_informative=2,
+    ...                                     random_state=1)
+    >>> wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+    >>> _ = wf.run(X=X, y=y)
+    >>> wf.reduce_cache = ReduceCache()
+    >>> _ = wf.reduce()
+    >>> wf.reduce_cache.hits, wf.reduce_cache.misses
+    (0, 5)
+    >>> _ = wf.reduce()
+    >>> wf.reduce_cache.hits, wf.reduce_cache.misses
+    (1, 5)
+    """
+    def __init__(self):
+        self.entries = dict()
+        self.stamps = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def set_stamps(self, stamps):
+        """Set the stamps of the nodes, indexed by node key, before a
+        reduce (see BaseNode.reduce_stamps)."""
+        self.stamps = stamps
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] == self.stamps.get(key)
+
+    def __getitem__(self, key):
+        self.hits += 1
+        return copy.deepcopy(self.entries[key][1])
+
+    def clear(self):
+        self.entries.clear()
+
+    def record(self, key, results):
+        """Yield results, the reduced results of node key, and keep them
+        once they have all been read."""
+        self.misses += 1
+        kept = list()
+        for result in results:
+            kept.append(copy.deepcopy(result))
+            yield result
+        stamp = self.stamps.get(key)
+        if stamp is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = (stamp, kept)
+
+
+def downcast_int_array(arr):
+    """Cast an integer array to the smallest signed integer dtype that holds
+    its values. Other objects are returned unchanged.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac.map_reduce.results import downcast_int_array
+    >>> downcast_int_array(np.array([0, 1, 200])).dtype
+    dtype('int16')
+    >>> downcast_int_array(np.array([0.5, 1.])).dtype
+    dtype('float64')
+    """
+    if not isinstance(arr, np.ndarray) or arr.dtype.kind not in "iu" \
+            or arr.size == 0:
+        return arr
+    arr_min, arr_max = arr.min(), arr.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.dtype(dtype).itemsize >= arr.dtype.itemsize:
+            break
+        info = np.iinfo(dtype)
+        if arr_min >= info.min and arr_max <= info.max:
+            return arr.astype(dtype)
+    return arr
+
+
 def _order_from_regexp(items, order_regexps):
     """Re-order list given regular expression listed by priorities
 
@@ -8,7 +8,7 @@ Created on Fri Oct 18 10:42:47 2013
 import os
 import sys
 from epac import StoreFs
-from epac.map_reduce.exports import save_job_list
+from epac.map_reduce.exports import save_job_list, group_job_list
 from epac.map_reduce.split_input import SplitNodesInput
 from epac.map_reduce.inputs import NodesInput
 from epac.utils import save_dataset_path
@@ -110,7 +110,7 @@ class BashWorkflowDescriptor(object):
         self.epac_tree_dir_path = epac_tree_dir_path
         self.out_dir_path = out_dir_path
 
-    def export(self, workflow_dir, num_processes):
+    def export(self, workflow_dir, num_processes, jobs_per_command=1):
         '''
         Parameters
         ----------
@@ -118,6 +118,9 @@ class BashWorkflowDescriptor(object):
             the directory to export workflow
         num_processes: integer
             the number of processes you want to run
+        jobs_per_command: integer
+            the number of jobs run one after the other by each epac_mapper
+            command, the dataset and the tree are loaded once for them
         '''
         self.workflow_dir = workflow_dir
         if not os.path.exists(self.workflow_dir):
@@ -128,14 +131,14 @@ class BashWorkflowDescriptor(object):
                                     workflow_dir)
         map_cmds = []
         reduce_cmds = []
-        for i in xrange(len(keysfile_list)):
-            key_path = os.path.join(workflow_dir, keysfile_list[i])
+        for keysfiles in group_job_list(keysfile_list, jobs_per_command):
             map_cmd = []
             map_cmd.append("epac_mapper")
             map_cmd.append("--datasets")
             map_cmd.append(self.dataset_dir_path)
-            map_cmd.append("--keysfile")
-            map_cmd.append(key_path)
+            for keysfile in keysfiles:
+                map_cmd.append("--keysfile")
+                map_cmd.append(os.path.join(workflow_dir, keysfile))
             map_cmd.append("--treedir")
             map_cmd.append(self.epac_tree_dir_path)
             map_cmds.append(map_cmd)
@@ -222,7 +225,7 @@ class SomaWorkflowDescriptor(object):
         self.epac_tree_dir_path = epac_tree_dir_path
         self.out_dir_path = out_dir_path
 
-    def export(self, workflow_dir, num_processes):
+    def export(self, workflow_dir, num_processes, jobs_per_command=1):
         '''
         Parameters
         ----------
@@ -230,6 +233,9 @@ class SomaWorkflowDescriptor(object):
             the directory to export workflow
         num_processes: integer
             the number of processes you want to run
+        jobs_per_command: integer
+            the number of jobs run one after the other by each epac_mapper
+            command, the dataset and the tree are loaded once for them
         '''
         try:
             from soma_workflow.client import Job
@@ -255,14 +261,14 @@ class SomaWorkflowDescriptor(object):
         # Building mapper task
         dependencies = []
         map_jobs = []
-        for i in xrange(len(keysfile_list)):
-            key_path = os.path.join(workflow_dir, keysfile_list[i])
+        for keysfiles in group_job_list(keysfile_list, jobs_per_command):
             map_cmd = []
             map_cmd.append("epac_mapper")
             map_cmd.append("--datasets")
             map_cmd.append(self.dataset_dir_path)
-            map_cmd.append("--keysfile")
-            map_cmd.append(key_path)
+            for keysfile in keysfiles:
+                map_cmd.append("--keysfile")
+                map_cmd.append(os.path.join(workflow_dir, keysfile))
             map_cmd.append("--treedir")
             map_cmd.append(self.epac_tree_dir_path)
             map_job = Job(command=map_cmd,
@@ -395,7 +401,16 @@ class SharePathSomaWorkflowDescriptor:
         self.jobs_relative_path = jobs_relative_path
         self.output_relative_path = output_relative_path
 
-    def export(self, script_path):
+    def export(self, script_path, jobs_per_command=1):
+        '''
+        Parameters
+        ----------
+        script_path: string
+            the path of the soma-workflow file to write
+        jobs_per_command: integer
+            the number of jobs run one after the other by each epac_mapper
+            command, the dataset and the tree are loaded once for them
+        '''
         try:
             from soma_workflow.client import Job
             from soma_workflow.client import Group
@@ -437,18 +452,19 @@ class SharePathSomaWorkflowDescriptor:
         # Building mapper task
         dependencies = []
         map_jobs = []
-        for i in xrange(len(job_paths)):
-            job_relative_path = os.path.join(self.jobs_relative_path,
-                                             job_paths[i])
-            key_path = SharedResourcePath(relative_path=job_relative_path,
-                                          namespace=self.namespace,
-                                          uuid=self.uuid)
+        for job_group in group_job_list(sorted(job_paths), jobs_per_command):
             map_cmd = []
             map_cmd.append("epac_mapper")
             map_cmd.append("--datasets")
             map_cmd.append(dataset_dir)
-            map_cmd.append("--keysfile")
-            map_cmd.append(key_path)
+            for job_path in job_group:
+                job_relative_path = os.path.join(self.jobs_relative_path,
+                                                 job_path)
+                key_path = SharedResourcePath(relative_path=job_relative_path,
+                                              namespace=self.namespace,
+                                              uuid=self.uuid)
+                map_cmd.append("--keysfile")
+                map_cmd.append(key_path)
             map_cmd.append("--treedir")
             map_cmd.append(epac_tree_dir)
             map_job = Job(command=map_cmd,
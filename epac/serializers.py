@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Serializers used by the stores to write objects in files.
+
+The serializer of an object is chosen up front from its type (see
+register_serializer and get_serializer): plain data (dict, list, str,
+numbers) is written in JSON, anything else is pickled once by
+PickleSerializer which writes numpy arrays out of the pickle, raw and
+aligned, so that they can be memory mapped. The format of a file is found
+back from its first bytes (get_file_serializer), files written by
+epac_joblib are still read.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import numpy as np
+from abc import ABCMeta, abstractmethod
+from StringIO import StringIO
+from epac.configuration import conf
+from epac.compression import is_compressible
+from epac.compression import write_compressed, read_compressed
+
+_pickle = None
+
+
+def get_pickle():
+    """Return dill if installed and recent enough, otherwise pickle. It is
+    imported on first use: dill is slow to import."""
+    global _pickle
+    if _pickle is not None:
+        return _pickle
+    from distutils.version import LooseVersion as V
+    try:
+        errmsg = "Falling back to pickle. "\
+                 "There may be problem when running soma-workflow on "\
+                 "cluster using EPAC\n"
+        import dill as pickle
+        if V(pickle.__version__) < V("0.2a"):
+            sys.stderr.write("warning: dill version is too old to use. " +
+                             errmsg)
+    except ImportError:
+        import pickle
+        sys.stderr.write("warning: Cannot import dill. " + errmsg)
+    _pickle = pickle
+    return _pickle
+
+
+def pickle_dumps(obj, persistent_id=None):
+    """Pickle obj in a string. persistent_id(obj) can return an id for the
+    objects that are saved separately (see pickle documentation)."""
+    pickle = get_pickle()
+    buff = StringIO()
+    pickler = pickle.Pickler(buff, pickle.HIGHEST_PROTOCOL)
+    if persistent_id:
+        pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return buff.getvalue()
+
+
+def pickle_loads(data, persistent_load=None):
+    """Unpickle the string data, see pickle_dumps()."""
+    unpickler = get_pickle().Unpickler(StringIO(data))
+    if persistent_load:
+        unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+class Serializer(object):
+    """Abstract serializer"""
+    __metaclass__ = ABCMeta
+    suffix = None
+
+    @abstractmethod
+    def dump(self, obj, filepath, compress=False):
+        """Write obj in filepath"""
+
+    @abstractmethod
+    def load(self, filepath, mmap_mode="r"):
+        """Read the object written in filepath"""
+
+    def is_file_format(self, head):
+        """Return True if head (the first bytes of a file) is the beginning
+        of a file written by this serializer."""
+        return False
+
+
+class JSONSerializer(Serializer):
+    """JSON, for plain data only (see is_json_plain)"""
+    suffix = conf.STORE_FS_JSON_SUFFIX
+
+    def dump(self, obj, filepath, compress=False):
+        outfile = open(filepath, "wb")
+        json.dump(obj, outfile)
+        outfile.close()
+
+    def load(self, filepath, mmap_mode="r"):
+        # Files written before the serializers may hold converted objects
+        from epac.stores import dict_to_obj
+        infile = open(filepath, "rb")
+        obj = json.load(infile)
+        infile.close()
+        return dict_to_obj(obj)
+
+    def is_file_format(self, head):
+        head = head.lstrip()[:1]
+        return head.isdigit() or head in ('{', '[', '"', '-', 't', 'f', 'n')
+
+
+class PickleSerializer(Serializer):
+    """Pickle with numpy arrays written out-of-band.
+
+    File layout: MAGIC, offset and length of the pickle (uint64), the
+    arrays (raw data aligned on ALIGN bytes, or compressed records, see
+    epac.compression), the pickle. Each array is written once even if it is
+    referenced several times.
+
+    The file is written under a temporary name then renamed: the arrays of
+    the previous version of the file, which may be memory mapped, are left
+    untouched.
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> import numpy as np
+    >>> from epac.serializers import PickleSerializer
+    >>> serializer = PickleSerializer()
+    >>> filepath = os.path.join(tempfile.mkdtemp(), "obj.pkl")
+    >>> X = np.random.random((1000, 10))
+    >>> serializer.dump(dict(X=X, X_again=X, a=[1, 2]), filepath)
+    >>> obj = serializer.load(filepath, mmap_mode="r")
+    >>> obj["X"].flags.owndata, obj["X"] is obj["X_again"]  # memory mapped
+    (False, True)
+    >>> np.all(obj["X"] == X), obj["a"]
+    (True, [1, 2])
+    """
+    suffix = conf.STORE_FS_PICKLE_SUFFIX
+    MAGIC = "EPACPKL1"
+    ALIGN = 64
+    _HEADER = struct.Struct("<QQ")
+
+    def __init__(self, mmap_min_nbytes=4096):
+        self.mmap_min_nbytes = mmap_min_nbytes
+
+    def dump(self, obj, filepath, compress=False):
+        tmp_filepath = "%s.%i.tmp" % (filepath, os.getpid())
+        try:
+            self._dump(obj, tmp_filepath, compress)
+            os.rename(tmp_filepath, filepath)
+        except:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
+    def _dump(self, obj, filepath, compress):
+        outfile = open(filepath, "w+b")
+        outfile.write(PickleSerializer.MAGIC)
+        outfile.write(PickleSerializer._HEADER.pack(0, 0))
+        arrays = dict()
+
+        def persistent_id(obj):
+            if not type(obj) in (np.ndarray, np.memmap) or \
+                    obj.dtype.hasobject or obj.ndim == 0 or obj.size == 0:
+                return None
+            if id(obj) in arrays:
+                return arrays[id(obj)][1]
+            if compress and obj.nbytes >= conf.COMPRESS_MIN_NBYTES and \
+                    is_compressible(obj):
+                pid = ("z", write_compressed(outfile, obj))
+            else:
+                outfile.seek(0, os.SEEK_END)
+                pos = outfile.tell()
+                outfile.write("\0" * ((-pos) % PickleSerializer.ALIGN))
+                pid = ("a", outfile.tell(), obj.dtype.str, obj.shape)
+                outfile.write(np.ascontiguousarray(obj).data)
+            # keep obj alive so that its id is not reused
+            arrays[id(obj)] = (obj, pid)
+            return pid
+        data = pickle_dumps(obj, persistent_id)
+        outfile.seek(0, os.SEEK_END)
+        offset = outfile.tell()
+        outfile.write(data)
+        outfile.seek(len(PickleSerializer.MAGIC))
+        outfile.write(PickleSerializer._HEADER.pack(offset, len(data)))
+        outfile.close()
+
+    # Access of the memory map of the file, by mmap_mode
+    _MMAP_ACCESS = {"r": mmap.ACCESS_READ, "c": mmap.ACCESS_COPY,
+                    "r+": mmap.ACCESS_WRITE}
+
+    def load(self, filepath, mmap_mode="r"):
+        """Arrays of at least mmap_min_nbytes bytes are memory mapped with
+        mmap_mode ("r", "c" or "r+"), unless it is None: they are views of
+        a single memory map of the file, so that any number of arrays holds
+        one file descriptor."""
+        infile = open(filepath, "rb")
+        infile.seek(len(PickleSerializer.MAGIC))
+        offset, length = PickleSerializer._HEADER.unpack(
+            infile.read(PickleSerializer._HEADER.size))
+        infile.seek(offset)
+        data = infile.read(length)
+        arrays = dict()
+        mapped = []
+
+        def persistent_load(pid):
+            if pid in arrays:
+                return arrays[pid]
+            if pid[0] == "z":
+                arr = read_compressed(infile, pid[1])
+            else:
+                _, arr_offset, dtype, shape = pid
+                dtype = np.dtype(dtype)
+                count = int(np.prod(shape))
+                if mmap_mode and \
+                        count * dtype.itemsize >= self.mmap_min_nbytes:
+                    if not mapped:
+                        mapped.append(mmap.mmap(
+                            infile.fileno(), 0,
+                            access=PickleSerializer._MMAP_ACCESS[mmap_mode]))
+                    arr = np.frombuffer(mapped[0], dtype=dtype, count=count,
+                                        offset=arr_offset).reshape(shape)
+                else:
+                    infile.seek(arr_offset)
+                    arr = np.fromfile(infile, dtype=dtype, count=count)
+                    arr = arr.reshape(shape)
+            arrays[pid] = arr
+            return arr
+        obj = pickle_loads(data, persistent_load)
+        infile.close()
+        return obj
+
+    def is_file_format(self, head):
+        return head.startswith(PickleSerializer.MAGIC)
+
+
+class EpacJoblibSerializer(Serializer):
+    """Files written by epac.stores.epac_joblib, the format of the stores
+    before PickleSerializer (not used to write unless registered)"""
+    suffix = conf.STORE_FS_PICKLE_SUFFIX
+
+    def dump(self, obj, filepath, compress=False):
+        from epac.stores import epac_joblib
+        epac_joblib.dump(obj, filepath, compress=compress)
+
+    def load(self, filepath, mmap_mode="r+"):
+        from epac.stores import epac_joblib
+        return epac_joblib.load(filepath, mmap_mode=mmap_mode or "r+")
+
+    def is_file_format(self, head):
+        return head.startswith(conf.MEMOBJ_SUFFIX)
+
+
+def is_json_plain(obj, max_depth=100):
+    """Return True if obj is made of dict (with str keys), list, str,
+    numbers, booleans and None only.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac.serializers import is_json_plain
+    >>> is_json_plain({"a": [1, 2.5, "b", None]})
+    True
+    >>> is_json_plain({"a": np.arange(3)})
+    False
+    """
+    if obj is None or type(obj) in (bool, int, long, float, str, unicode):
+        return True
+    if max_depth <= 0:
+        return False
+    if type(obj) is list:
+        for item in obj:
+            if not is_json_plain(item, max_depth - 1):
+                return False
+        return True
+    if type(obj) is dict:
+        for k in obj:
+            if not type(k) in (str, unicode) or \
+                    not is_json_plain(obj[k], max_depth - 1):
+                return False
+        return True
+    return False
+
+
+_json_serializer = JSONSerializer()
+_pickle_serializer = PickleSerializer()
+_serializers = [(is_json_plain, _json_serializer)]
+_file_serializers = [_pickle_serializer, EpacJoblibSerializer(),
+                     _json_serializer]
+
+
+def register_serializer(serializer, accept):
+    """Use serializer for the objects for which accept(obj) is True.
+    The last registered serializers are tried first, PickleSerializer is
+    used if none accepts the object.
+
+    Parameters
+    ----------
+    serializer: Serializer
+        Its is_file_format() method is used to read files back.
+
+    accept: function, or type or tuple of types
+        Types are tested with isinstance.
+    """
+    if not callable(accept) or isinstance(accept, type):
+        types = accept
+        accept = lambda obj: isinstance(obj, types)
+    _serializers.insert(0, (accept, serializer))
+    if not serializer in _file_serializers:
+        _file_serializers.insert(0, serializer)
+
+
+def get_serializer(obj, text=True):
+    """Return the serializer for obj, JSON is not used if text is False"""
+    for accept, serializer in _serializers:
+        if not text and isinstance(serializer, JSONSerializer):
+            continue
+        if accept(obj):
+            return serializer
+    return _pickle_serializer
+
+
+def get_file_serializer(filepath):
+    """Return the serializer that wrote filepath"""
+    infile = open(filepath, "rb")
+    head = infile.read(64)
+    infile.close()
+    for serializer in _file_serializers:
+        if serializer.is_file_format(head):
+            return serializer
+    raise IOError("Unknown file format: %s" % filepath)
+
+
+def dump(obj, filepath, compress=False):
+    """Write obj in filepath with the serializer of obj, return the
+    serializer.
+
+    Parameters
+    ----------
+    compress: boolean
+        If True compressible arrays are compressed (see epac.compression)
+    """
+    serializer = get_serializer(obj)
+    serializer.dump(obj, filepath, compress=compress)
+    return serializer
+
+
+def load(filepath, mmap_mode="r"):
+    """Read an object written by dump (or by epac_joblib)"""
+    return get_file_serializer(filepath).load(filepath, mmap_mode=mmap_mode)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -20,6 +20,7 @@ from epac.utils import _dict_suffix_keys
 from epac.utils import _sub_dict, _as_dict
 from epac.configuration import conf
 from epac.workflow.wrappers import Wrapper
+from epac import hooks
 
 
 class Estimator(Wrapper):
@@ -128,6 +129,17 @@ class Estimator(Wrapper):
             else:
                 self.out_args_predict = out_args_predict
 
+    def get_input_keys(self):
+        input_keys = list(self.in_args_fit)
+        for in_args in ("in_args_transform", "in_args_predict"):
+            if hasattr(self, in_args):
+                input_keys += getattr(self, in_args)
+        return input_keys
+
+    def _wrapped_node_fit(self, **Xy):
+        return hooks.call("fit", self, self.wrapped_node.fit,
+                          kwargs=_sub_dict(Xy, self.in_args_fit))
+
     def _wrapped_node_transform(self, **Xy):
         Xy_out = _as_dict(self.wrapped_node.transform(
             **_sub_dict(Xy, self.in_args_transform)),
@@ -135,8 +147,9 @@ class Estimator(Wrapper):
         return Xy_out
 
     def _wrapped_node_predict(self, **Xy):
-        Xy_out = _as_dict(self.wrapped_node.predict(
-            **_sub_dict(Xy, self.in_args_predict)),
+        Xy_out = _as_dict(hooks.call(
+            "predict", self, self.wrapped_node.predict,
+            kwargs=_sub_dict(Xy, self.in_args_predict)),
             keys=self.out_args_predict)
         return Xy_out
 
@@ -165,13 +178,12 @@ class Estimator(Wrapper):
         if is_fit_transform:
             Xy_train, Xy_test = train_test_split(Xy)
             if Xy_train is not Xy_test:
-                res = self.wrapped_node.fit(**_sub_dict(Xy_train,
-                                                        self.in_args_fit))
+                res = self._wrapped_node_fit(**Xy_train)
                 Xy_out_tr = self._wrapped_node_transform(**Xy_train)
                 Xy_out_te = self._wrapped_node_transform(**Xy_test)
                 Xy_out = train_test_merge(Xy_out_tr, Xy_out_te)
             else:
-                res = self.wrapped_node.fit(**_sub_dict(Xy, self.in_args_fit))
+                res = self._wrapped_node_fit(**Xy)
                 Xy_out = self._wrapped_node_transform(**Xy)
             # update ds with transformed values
             Xy.update(Xy_out)
@@ -180,8 +192,7 @@ class Estimator(Wrapper):
             Xy_train, Xy_test = train_test_split(Xy)
             if Xy_train is not Xy_test:
                 Xy_out = dict()
-                res = self.wrapped_node.fit(**_sub_dict(Xy_train,
-                                            self.in_args_fit))
+                res = self._wrapped_node_fit(**Xy_train)
                 Xy_out_tr = self._wrapped_node_predict(**Xy_train)
                 Xy_out_tr = _dict_suffix_keys(
                     Xy_out_tr,
@@ -200,7 +211,7 @@ class Estimator(Wrapper):
                     suffix=conf.SEP + conf.TEST + conf.SEP + conf.TRUE)
                 Xy_out.update(Xy_out_true)
             else:
-                res = self.wrapped_node.fit(**_sub_dict(Xy, self.in_args_fit))
+                res = self._wrapped_node_fit(**Xy)
                 Xy_out = self._wrapped_node_predict(**Xy)
                 Xy_out = _dict_suffix_keys(
                     Xy_out,
@@ -7,7 +7,6 @@ Created on Mon Oct 29 16:20:03 2012
 
 ## Class Permutations to be added to sklearn
 import numpy as np
-from sklearn.utils import check_random_state
 from warnings import warn
 
 
@@ -38,6 +37,7 @@ class Permutations(object):
         self.n_perms = int(n_perms)
 
     def __iter__(self):
+        from sklearn.utils import check_random_state
         rng = check_random_state(self.random_state)
         if self.first_perm_is_id:
             yield np.arange(self.n)  # id permutation
@@ -68,9 +68,6 @@ def _clean_nans(scores):
     scores[np.isnan(scores)] = np.finfo(scores.dtype).min
     return scores
 
-from sklearn.feature_selection import SelectKBest
-from sklearn.feature_selection import f_classif
-
 
 class FeatureRanking():
     """
@@ -96,8 +93,10 @@ class FeatureRanking():
     <...FeatureRanking instance at 0x...>
     """
 
-    def __init__(self, score_func=f_classif):
-
+    def __init__(self, score_func=None):
+        if score_func is None:
+            from sklearn.feature_selection import f_classif
+            score_func = f_classif
         if not callable(score_func):
             raise TypeError(
                 "The score function should be a callable, %s (%s) "
@@ -10,27 +10,25 @@ Stores for EPAC
 import os
 import shutil
 import sys
-import joblib
 import json
 import inspect
+import hashlib
+import itertools
+import weakref
+import tempfile
+import mmap
+import struct
+import types
+from StringIO import StringIO
 import numpy as np
 from abc import abstractmethod
+from collections import MutableMapping, OrderedDict
 from epac.configuration import conf
 from epac.map_reduce.results import ResultSet
-
-# Import dill if installed and recent enough, otherwise falls back to pickle
-from distutils.version import LooseVersion as V
-try:
-    errmsg = "Falling back to pickle. "\
-             "There may be problem when running soma-workflow on cluster "\
-             "using EPAC\n"
-    import dill as pickle
-    if V(pickle.__version__) < V("0.2a"):
-        sys.stderr.write("warning: dill version is too old to use. " + errmsg)
-except ImportError:
-    import pickle
-    sys.stderr.write("warning: Cannot import dill. " + errmsg)
-
+from epac.compression import is_compressible
+from epac.compression import write_compressed, read_compressed
+from epac import serializers
+from epac.serializers import get_pickle, pickle_dumps, pickle_loads
 
 class TagObject:
     def __init__(self):
@@ -118,8 +116,12 @@ def replace_values(obj, extracted_values, max_depth=10):
 
 def extract_values(obj,
                    func_is_need_extract,
-                   max_depth=10):
+                   max_depth=10,
+                   memo=None):
     """
+    The same object found several times in obj is extracted once: all its
+    occurrences are replaced by the same TagObject.
+
     Example
     -------
     >>> import numpy as np
@@ -153,9 +155,16 @@ def extract_values(obj,
     """
     replaced_array = {}
     is_modified = False
+    if memo is None:
+        memo = dict()
     # When obj is replace-able
     if func_is_need_extract(obj):
-        replaced_object = TagObject()
+        if id(obj) in memo:
+            replaced_object = memo[id(obj)][0]
+        else:
+            replaced_object = TagObject()
+            # keep obj alive so that its id is not reused
+            memo[id(obj)] = (replaced_object, obj)
         tag_value = obj
         obj = replaced_object
         replaced_array[replaced_object.hash_id] = tag_value
@@ -172,7 +181,8 @@ def extract_values(obj,
         pros_replaced_array, obj2set, tmp_is_modified \
                             = extract_values(obj.dict,
                                              func_is_need_extract,
-                                             max_depth)
+                                             max_depth,
+                                             memo)
         if tmp_is_modified:
             is_modified = True
             StoreMem.dict = obj2set
@@ -183,7 +193,8 @@ def extract_values(obj,
         pros_replaced_array, obj2set, tmp_is_modified \
                             = extract_values(obj.results,
                                              func_is_need_extract,
-                                             max_depth)
+                                             max_depth,
+                                             memo)
         if tmp_is_modified:
             is_modified = True
             obj.results = obj2set
@@ -194,7 +205,8 @@ def extract_values(obj,
             pros_replaced_array, obj2set, tmp_is_modified \
                                 = extract_values(obj[key],
                                                  func_is_need_extract,
-                                                 max_depth)
+                                                 max_depth,
+                                                 memo)
             if tmp_is_modified:
                 is_modified = True
                 obj[key] = obj2set
@@ -205,7 +217,8 @@ def extract_values(obj,
             pros_replaced_array, obj2set, tmp_is_modified \
                                     = extract_values(obj[iobj],
                                                      func_is_need_extract,
-                                                     max_depth)
+                                                     max_depth,
+                                                     memo)
             if tmp_is_modified:
                 is_modified = True
                 obj[iobj] = obj2set
@@ -214,6 +227,17 @@ def extract_values(obj,
     return (replaced_array, obj, is_modified)
 
 
+def _import_joblib():
+    """Import joblib, slow to import, on first use (see epac_joblib)"""
+    import joblib
+    from distutils.version import LooseVersion as V
+    if V(joblib.__version__) < V("0.7.1"):
+        raise ValueError("joblib version is too old to use, "
+                         "please use version on "
+                         "https://github.com/joblib/joblib")
+    return joblib
+
+
 class epac_joblib:
     """
     It is optimized for dictionary dump and load
@@ -267,30 +291,62 @@ class epac_joblib:
     @staticmethod
     def _pickle_dump(obj, filename):
         output = open(filename, 'w+')
-        pickle.dump(obj, output)
+        get_pickle().dump(obj, output)
         output.close()
 
     @staticmethod
     def _pickle_load(filename):
         infile = open(filename, 'rb')
-        obj = pickle.load(infile)
+        obj = get_pickle().load(infile)
         infile.close()
         return obj
 
     @staticmethod
-    def dump(obj, filename):
+    def dump(obj, filename, compress=False):
+        """Dump obj. If compress, the compressible arrays (see
+        epac.compression) are written compressed in a third file, they are
+        no more memory mapped on load."""
         filename_memobj = filename + conf.MEMOBJ_SUFFIX
         filename_norobj = filename + conf.NOROBJ_SUFFIX
+        filename_compobj = filename + conf.COMPOBJ_SUFFIX
+        func_is_need_extract = func_is_big_nparray
+        if compress:
+            func_is_need_extract = lambda obj: func_is_big_nparray(obj) and \
+                not is_compressible(obj)
         mem_obj, normal_obj, _ = extract_values(obj,
-                                             func_is_big_nparray)
+                                             func_is_need_extract)
+        joblib = _import_joblib()
         joblib.dump(mem_obj, filename_memobj)
-        epac_joblib._pickle_dump(normal_obj, filename_norobj)
+        if compress:
+            compfile = open(filename_compobj, "wb")
+            offsets = dict()
+
+            def persistent_id(obj):
+                if not type(obj) in (np.ndarray, np.memmap) or \
+                        obj.nbytes < conf.COMPRESS_MIN_NBYTES or \
+                        not is_compressible(obj):
+                    return None
+                if not id(obj) in offsets:
+                    offsets[id(obj)] = (obj, write_compressed(compfile, obj))
+                return offsets[id(obj)][1]
+            data = pickle_dumps(normal_obj, persistent_id)
+            compfile.close()
+            outfile = open(filename_norobj, "wb")
+            outfile.write(data)
+            outfile.close()
+        else:
+            epac_joblib._pickle_dump(normal_obj, filename_norobj)
+        # Put back the extracted values, obj is left unchanged
+        replace_values(normal_obj, mem_obj)
 
         outfile = open(filename, "w+")
         outfile.write(conf.MEMOBJ_SUFFIX)
         outfile.write("\n")
         outfile.write(conf.NOROBJ_SUFFIX)
         outfile.write("\n")
+        if compress:
+            outfile.write(conf.COMPOBJ_SUFFIX)
+            outfile.write("\n")
         outfile.close()
 
     @staticmethod
@@ -308,8 +364,18 @@ class epac_joblib:
         filename_memobj = filename + lines[0]
         filename_norobj = filename + lines[1]
         # Load Memory obj and Normal obj
+        joblib = _import_joblib()
         mem_obj = joblib.load(filename_memobj, mmap_mode)
-        normal_obj = epac_joblib._pickle_load(filename_norobj)
+        if len(lines) > 2 and lines[2]:  # compressed arrays
+            compfile = open(filename + lines[2], "rb")
+            infile = open(filename_norobj, "rb")
+            normal_obj = pickle_loads(
+                infile.read(),
+                lambda offset: read_compressed(compfile, offset))
+            infile.close()
+            compfile.close()
+        else:
+            normal_obj = epac_joblib._pickle_load(filename_norobj)
         # Replace mem_obj (extracted values)
         normal_obj, _ = replace_values(normal_obj, mem_obj)
         return normal_obj
@@ -326,14 +392,83 @@ class Store(object):
     def load(self, key):
         """Store abstract method"""
 
+    @abstractmethod
+    def keys(self):
+        """Return the list of the keys of the saved objects"""
+
+    def contains(self, key):
+        """Return True if an object has been saved with key, without
+        loading it."""
+        return key in self.keys()
+
+    def flush(self):
+        """Write what save() may have kept pending."""
+
+    def version(self, key):
+        """Return the version of the object saved with key, a value which
+        changes each time the object is saved again, 0 if no object has
+        been saved with key. None (default) means that the store can not
+        tell (see ReduceCache)."""
+        return None
+
+
+# Versions of the objects saved in the memory stores, unique in the process
+_mem_versions = itertools.count(1)
+
 
 class StoreMem(Store):
-    """ Store based on memory"""
+    """ Store based on memory
 
-    def __init__(self):
+    Parameters
+    ----------
+    dedup: boolean
+        If True, numpy arrays found in saved objects (ResultSet, Result,
+        dict or list) are compared by content (sha1) with the arrays
+        already in the store. An identical array is stored once, other
+        occurrences reference it: saved arrays must then not be modified
+        in place. Default False, conf.STORE_DEDUP sets it on the stores of
+        the tree roots.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac import Result, ResultSet
+    >>> from epac.stores import StoreMem
+    >>> store = StoreMem(dedup=True)
+    >>> store.save('SVC(C=1)', ResultSet(Result('SVC(C=1)', y=np.arange(5))))
+    >>> store.save('SVC(C=3)', ResultSet(Result('SVC(C=3)', y=np.arange(5))))
+    >>> y1 = store.load('SVC(C=1)')['SVC(C=1)']['y']
+    >>> y3 = store.load('SVC(C=3)')['SVC(C=3)']['y']
+    >>> y1 is y3
+    True
+    """
+
+    def __init__(self, dedup=False):
         self.dict = dict()
+        self.dedup = dedup
+        self._arrays = weakref.WeakValueDictionary()
+        self._digests = dict()
+        self._versions = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_arrays", None)
+        state.pop("_digests", None)
+        state.pop("_versions", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not "dedup" in state:
+            self.dedup = False
+        self._arrays = weakref.WeakValueDictionary()
+        self._digests = dict()
+        self._versions = dict((key, _mem_versions.next())
+                              for key in self.dict)
 
     def save(self, key, obj, merge=False):
+        if self.dedup:
+            obj = self._dedup(obj)
         if not merge or not (key in self.dict):
             self.dict[key] = obj
         else:
@@ -342,6 +477,7 @@ class StoreMem(Store):
                 v.update(obj)
             elif isinstance(v, list):
                 v.append(obj)
+        self._versions[key] = _mem_versions.next()
 
     def load(self, key):
         try:
@@ -349,6 +485,357 @@ class StoreMem(Store):
         except KeyError:
             return None
 
+    def version(self, key):
+        # Objects put directly in self.dict have no version
+        if key in self._versions:
+            return self._versions[key]
+        return None if key in self.dict else 0
+
+    def keys(self):
+        return self.dict.keys()
+
+    def contains(self, key):
+        return key in self.dict
+
+    def _dedup(self, obj, max_depth=10):
+        """Replace, in place, the arrays of obj by identical arrays already
+        in the store."""
+        max_depth = max_depth - 1
+        if max_depth < 0:
+            return obj
+        if type(obj) is np.ndarray:
+            return self._intern_array(obj)
+        if isinstance(obj, ResultSet):
+            for res in obj:
+                self._dedup(res, max_depth)
+        elif isinstance(obj, dict):
+            for k in obj:
+                obj[k] = self._dedup(obj[k], max_depth)
+        elif isinstance(obj, list):
+            for i in xrange(len(obj)):
+                obj[i] = self._dedup(obj[i], max_depth)
+        return obj
+
+    def _intern_array(self, arr):
+        if arr.dtype.hasobject:
+            return arr
+        # An array already seen: skip hashing
+        digest = self._digests.get(id(arr))
+        if digest is None or self._arrays.get(digest) is not arr:
+            digest = array_digest(arr)
+        shared = self._arrays.get(digest)
+        if shared is not None and (shared is arr or
+                                   np.array_equal(shared, arr)):
+            return shared
+        self._arrays[digest] = arr
+        self._digests[id(arr)] = digest
+        if len(self._digests) > 2 * len(self._arrays) + 1024:
+            # forget arrays that have been garbage collected
+            self._digests = dict((id(a), d) for d, a in self._arrays.items())
+        return arr
+
+
+class StoreHybrid(StoreMem):
+    """ Store based on memory, within a memory budget.
+
+    The approximate size of the stored objects is tracked. Beyond the budget,
+    the least recently used objects are written to disk (see epac.serializers)
+    and transparently reloaded by load(). Objects must not be modified once
+    saved since an evicted object is a copy.
+
+    A reloaded object is read back in memory (its arrays are owned, not
+    memory mapped) and its file is removed. Pickling the store does not
+    unpickle the evicted objects: the bytes of their files are pickled and
+    written back to disk by the unpickled store, which thus stays within
+    its budget. Only the pickle itself holds them in memory.
+
+    Parameters
+    ----------
+    budget: int
+        Approximate number of bytes kept in memory. None: no limit.
+        Default conf.STORE_MEM_BUDGET.
+
+    dirpath: str
+        Directory in which a temporary directory is created to write the
+        evicted objects. It is removed with the store. Default
+        conf.STORE_MEM_SPILL_DIR, None means the system temporary directory.
+
+    dedup: boolean
+        See StoreMem.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac import Result, ResultSet
+    >>> from epac.stores import StoreHybrid
+    >>> store = StoreHybrid(budget=10000)
+    >>> for i in xrange(5):
+    ...     res = Result('SVC(C=%i)' % i, y=np.ones(500) * i)
+    ...     store.save('SVC(C=%i)' % i, ResultSet(res))
+    >>> store.dict.mem_keys()
+    ['SVC(C=3)', 'SVC(C=4)']
+    >>> store.load('SVC(C=1)')['SVC(C=1)']['y'].sum()
+    500.0
+    >>> sorted(store.dict.keys())
+    ['SVC(C=0)', 'SVC(C=1)', 'SVC(C=2)', 'SVC(C=3)', 'SVC(C=4)']
+    """
+
+    def __init__(self, budget=None, dirpath=None, dedup=False):
+        super(StoreHybrid, self).__init__(dedup=dedup)
+        if budget is None:
+            budget = conf.STORE_MEM_BUDGET
+        if dirpath is None:
+            dirpath = conf.STORE_MEM_SPILL_DIR
+        self.dict = SpillDict(budget=budget, dirpath=dirpath)
+
+
+
+class SpillDict(MutableMapping):
+    """Dictionary that keeps at most budget bytes of values in memory, the
+    least recently used values are written to disk. See StoreHybrid.
+    """
+
+    def __init__(self, budget=None, dirpath=None):
+        self.budget = budget
+        self.dirpath = dirpath
+        self.nbytes = 0
+        self._mem = OrderedDict()  # key => (value, nbytes), LRU first
+        self._spilled = dict()  # key => file path
+        self._spill_dir = None
+
+    def __del__(self):
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def __getstate__(self):
+        # The spilled values are not unpickled: the bytes of their files are
+        # pickled
+        spilled = dict()
+        for key in self._spilled:
+            infile = open(self._spilled[key], "rb")
+            spilled[key] = infile.read()
+            infile.close()
+        return dict(budget=self.budget, dirpath=self.dirpath,
+                    mem=[(key, self._mem[key][0]) for key in self._mem],
+                    spilled=spilled)
+
+    def __setstate__(self, state):
+        self.__init__(budget=state["budget"], dirpath=state["dirpath"])
+        for key in state["spilled"]:
+            outfile = open(self._spill_path(key), "wb")
+            outfile.write(state["spilled"][key])
+            outfile.close()
+            self._spilled[key] = self._spill_path(key)
+        for key, value in state["mem"]:
+            self._insert(key, value)
+
+    def __getitem__(self, key):
+        if key in self._mem:
+            value, nbytes = self._mem.pop(key)
+            self._mem[key] = (value, nbytes)
+            return value
+        if key in self._spilled:
+            filename = self._spilled.pop(key)
+            # Read in memory: the file is removed
+            value = serializers.load(filename, mmap_mode=None)
+            self._remove_files(filename)
+            self._insert(key, value)
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+        self._insert(key, value)
+
+    def __delitem__(self, key):
+        if key in self._mem:
+            _, nbytes = self._mem.pop(key)
+            self.nbytes -= nbytes
+        elif key in self._spilled:
+            self._remove_files(self._spilled.pop(key))
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._mem or key in self._spilled
+
+    def __iter__(self):
+        for key in self._mem.keys() + self._spilled.keys():
+            yield key
+
+    def __len__(self):
+        return len(self._mem) + len(self._spilled)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def mem_keys(self):
+        """Keys of the values held in memory, least recently used first"""
+        return self._mem.keys()
+
+    def _insert(self, key, value):
+        nbytes = estimate_nbytes(value)
+        self._mem[key] = (value, nbytes)
+        self.nbytes += nbytes
+        if self.budget is None:
+            return
+        while self.nbytes > self.budget and len(self._mem) > 1:
+            lru_key = next(iter(self._mem))
+            lru_value, lru_nbytes = self._mem.pop(lru_key)
+            self._spill(lru_key, lru_value)
+            self.nbytes -= lru_nbytes
+
+    def _spill_path(self, key):
+        if not self._spill_dir:
+            self._spill_dir = tempfile.mkdtemp(prefix="epac_store_",
+                                               dir=self.dirpath)
+        return os.path.join(self._spill_dir, hashlib.sha1(key).hexdigest())
+
+    def _spill(self, key, value):
+        filename = self._spill_path(key)
+        serializers.PickleSerializer().dump(value, filename)
+        self._spilled[key] = filename
+
+    def _remove_files(self, filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def estimate_nbytes(obj, max_depth=10):
+    """Approximate size in bytes of obj. numpy arrays count for their data,
+    memory mapped arrays count for nothing.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac import Result
+    >>> from epac.stores import estimate_nbytes
+    >>> estimate_nbytes(Result('SVC', y=np.zeros(100))) >= 800
+    True
+    """
+    max_depth = max_depth - 1
+    if isinstance(obj, np.ndarray):
+        # Memory mapped arrays: np.memmap, or views of a mmap
+        if _array_owner(obj)[1]:
+            return 0
+        return obj.nbytes
+    nbytes = sys.getsizeof(obj)
+    if max_depth < 0:
+        return nbytes
+    if isinstance(obj, ResultSet):
+        nbytes += sum([estimate_nbytes(res, max_depth) for res in obj])
+    elif isinstance(obj, dict):
+        nbytes += sum([estimate_nbytes(obj[k], max_depth) for k in obj])
+    elif isinstance(obj, (list, tuple)):
+        nbytes += sum([estimate_nbytes(item, max_depth) for item in obj])
+    return nbytes
+
+
+# Objects not followed by deep_nbytes: shared by all the trees
+_NOT_FOLLOWED = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType, types.ClassType)
+
+
+def _array_owner(arr):
+    """Return the object owning the memory of arr (the last ndarray or
+    the mmap of its chain of bases), and whether it is memory mapped"""
+    owner = arr
+    while isinstance(owner, np.ndarray) and owner.base is not None:
+        owner = owner.base
+    mapped = isinstance(owner, mmap.mmap) or isinstance(arr, np.memmap)
+    if not isinstance(owner, np.ndarray) and not mapped:
+        # e.g. a buffer: the array is the owner
+        owner = arr
+    return owner, mapped
+
+
+def deep_nbytes(obj, seen=None):
+    """Deep and deduplicated size in bytes of obj: return (resident,
+    mapped), the bytes in memory and the bytes of memory mapped arrays.
+
+    Objects are followed through containers and attributes, and counted
+    once: those whose id is in seen are skipped, the counted ones are added
+    to seen (share it to count several objects together). The memory of a
+    numpy array is counted once for all its views, the whole buffer of a
+    view is counted. Classes, modules and functions are not followed.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac import Result
+    >>> from epac.stores import deep_nbytes
+    >>> y = np.zeros(1000)
+    >>> resident, mapped = deep_nbytes(Result('SVC', y=y, y_view=y[:10]))
+    >>> resident > y.nbytes, resident < 2 * y.nbytes, mapped
+    (True, True, 0)
+    """
+    if seen is None:
+        seen = set()
+    resident, mapped = 0, 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_FOLLOWED):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            owner, is_mapped = _array_owner(obj)
+            # The header, the data is counted with its owner
+            resident += sys.getsizeof(obj) - \
+                (obj.nbytes if obj.flags.owndata else 0)
+            if not ("data", id(owner)) in seen:
+                seen.add(("data", id(owner)))
+                nbytes = owner.nbytes if isinstance(owner, np.ndarray) \
+                    else len(owner)
+                if is_mapped:
+                    mapped += nbytes
+                else:
+                    resident += nbytes
+            if obj.dtype.hasobject:
+                stack += list(obj.flat)
+            continue
+        resident += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack += obj.keys() + obj.values()
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack += list(obj)
+        elif isinstance(obj, SpillDict):
+            # The values written to disk are not in memory
+            stack += [obj._mem]
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), "__slots__", ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return resident, mapped
+
+
+def create_store_mem():
+    """Create the store of a tree root: a StoreHybrid if
+    conf.STORE_MEM_BUDGET is set, a StoreMem otherwise, deduplicating
+    arrays if conf.STORE_DEDUP is set."""
+    if conf.STORE_MEM_BUDGET is not None:
+        return StoreHybrid(dedup=conf.STORE_DEDUP)
+    return StoreMem(dedup=conf.STORE_DEDUP)
+
+
+def array_digest(arr):
+    """Content digest of a numpy array: dtype, shape and sha1 of the data.
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from epac.stores import array_digest
+    >>> array_digest(np.arange(3)) == array_digest(np.arange(3))
+    True
+    >>> array_digest(np.arange(3)) == array_digest(np.arange(3.))
+    False
+    """
+    data = np.ascontiguousarray(arr).ravel().view(np.uint8)
+    return (arr.dtype.str, arr.shape, hashlib.sha1(data).hexdigest())
+
 
 class StoreFs(Store):
     """ Store based of file system
@@ -361,15 +848,63 @@ class StoreFs(Store):
     clear: boolean
         If True clear (delete) everything under the root directory.
 
+    compress: boolean
+        If True, compressible arrays of the pickled objects are written
+        compressed (see epac.compression). Default False.
+
+    The keys of the files found under the root directory are indexed when
+    the store is opened, and kept up to date by save(). Call refresh() to
+    see the files written by other processes.
+
+    Example
+    -------
+    >>> import tempfile
+    >>> from epac.stores import StoreFs
+    >>> store = StoreFs(tempfile.mkdtemp())
+    >>> store.save("CV/CV(nb=0)/store", dict(a=1))
+    >>> store.contains("CV/CV(nb=0)/store"), store.contains("CV")
+    (True, False)
+    >>> StoreFs(store.dirpath).keys()
+    ['CV/CV(nb=0)/store']
     """
 
-    def __init__(self, dirpath, clear=False):
+    def __init__(self, dirpath, clear=False, compress=False):
 
         self.dirpath = dirpath
+        self.compress = compress
         if clear:
             shutil.rmtree(self.dirpath)
         if not os.path.isdir(self.dirpath):
             os.mkdir(self.dirpath)
+        self.refresh()
+
+    def refresh(self):
+        """(Re)build the index of the keys from the files under dirpath."""
+        from epac.configuration import conf
+        self._index = dict()
+        dirpath = os.path.join(self.dirpath, "")
+        for base, dirs, files in os.walk(self.dirpath):
+            # the shards are read by StoreShards
+            dirs[:] = [d for d in dirs if d != conf.STORE_SHARDS_DIR]
+            for basename in files:
+                filepath, ext = os.path.splitext(os.path.join(base, basename))
+                if ext in (conf.STORE_FS_PICKLE_SUFFIX,
+                           conf.STORE_FS_JSON_SUFFIX):
+                    key = filepath.replace(dirpath, "", 1)
+                    if self._index.get(key) != conf.STORE_FS_PICKLE_SUFFIX:
+                        self._index[key] = ext
+
+    def keys(self):
+        return self._index.keys()
+
+    def contains(self, key):
+        return key in self._index
+
+    def version(self, key):
+        if not key in self._index:
+            return 0
+        stat = os.stat(os.path.join(self.dirpath, key) + self._index[key])
+        return (stat.st_mtime, stat.st_size)
 
     def save(self, key, obj, protocol="txt", merge=False):
         """ Save object
@@ -384,21 +919,22 @@ class StoreFs(Store):
             object to be saved
 
         protocol: str
-            "txt": try with JSON if fail use "bin": (pickle)
+            "txt": JSON for plain data, otherwise the serializer of obj
+            (see epac.serializers). "bin": no JSON.
         """
         #path = self.key2path(key)
         path = os.path.join(self.dirpath, key)
         if not os.path.exists(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
-        # JSON
-        from epac.configuration import conf
-        if protocol is "txt":
-            file_path = path + conf.STORE_FS_JSON_SUFFIX
-            json_failed = self.save_json(file_path, obj)
-        if protocol is "bin" or json_failed:
-            # saving in json failed => pickle
-            file_path = path + conf.STORE_FS_PICKLE_SUFFIX
-            self.save_pickle(file_path, obj)
+        serializer = serializers.get_serializer(obj, text=protocol == "txt")
+        serializer.dump(obj, path + serializer.suffix,
+                        compress=getattr(self, "compress", False))
+        # Remove what was saved with the other suffix
+        for suffix in (conf.STORE_FS_JSON_SUFFIX,
+                       conf.STORE_FS_PICKLE_SUFFIX):
+            if suffix != serializer.suffix and os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+        self._index[key] = serializer.suffix
 
     def load(self, key=""):
         """Load everything that is prefixed with key.
@@ -417,21 +953,23 @@ class StoreFs(Store):
         BaseNode.save()
         """
         from epac.configuration import conf
-        from epac.workflow.base import key_pop
         path = os.path.join(self.dirpath, key)
         # prefix = os.path.join(path, conf.STORE_FS_NODE_PREFIX)
         if os.path.isfile(path + conf.STORE_FS_PICKLE_SUFFIX):
             loaded_node = self.load_pickle(path + conf.STORE_FS_PICKLE_SUFFIX)
             return loaded_node
         if os.path.isfile(path + conf.STORE_FS_JSON_SUFFIX):
-            loaded_node = self.load_pickle(path + conf.STORE_FS_JSON_SUFFIX)
+            loaded_node = self.load_json(path + conf.STORE_FS_JSON_SUFFIX)
             return loaded_node
         if os.path.isdir(path):
             filepaths = []
             for base, dirs, files in os.walk(self.dirpath):
                 #print base, dirs, files
+                dirs[:] = [d for d in dirs if d != conf.STORE_SHARDS_DIR]
+                # the tree specification is read by epac.workflow.spec
                 for filepath in [os.path.join(base, basename) for
-                                 basename in files]:
+                                 basename in files
+                                 if basename != conf.STORE_TREE_SPEC]:
                     _, ext = os.path.splitext(filepath)
                     if not ext == ".npy" and not ext == ".enpy":
                         filepaths.append(filepath)
@@ -455,27 +993,12 @@ class StoreFs(Store):
                     raise IOError('File %s has an unkown extension: %s' %
                                   (filepath, ext))
             if key == "":  # No key provided assume a whole tree to load
-                tree = loaded.pop(conf.STORE_EXECUTION_TREE_PREFIX)
-                for key1 in loaded:
-                    key, attrname = key_pop(key1)
-                    #attrname, ext = os.path.splitext(basename)
-                    if attrname != conf.STORE_STORE_PREFIX:
-                        raise ValueError('Do not know what to do with %s') \
-                            % key1
-                    node = tree.get_node(key)
-                    if not node.store:
-                        node.store = loaded[key1]
-                    else:
-                        keys_local = node.store.dict.keys()
-                        keys_disk = loaded[key1].dict.keys()
-                        if set(keys_local).intersection(set(keys_disk)):
-                            raise KeyError("Merge store with same keys")
-                        node.store.dict.update(loaded[key1].dict)
-                loaded = tree
+                loaded = assemble_tree(loaded)
             return loaded
 
     def save_pickle(self, file_path, obj):
-        epac_joblib.dump(obj, file_path)
+        serializers.PickleSerializer().dump(
+            obj, file_path, compress=getattr(self, "compress", False))
 #        output = open(file_path, 'wb')
 #        pickle.dump(obj, output)
 #        output.close()
@@ -486,8 +1009,8 @@ class StoreFs(Store):
 #        obj = pickle.load(inputf)
 #        inputf.close()
         from epac.utils import try_fun_num_trials
-        kwarg = {"filename": file_path}
-        obj = try_fun_num_trials(epac_joblib.load,
+        kwarg = {"filepath": file_path}
+        obj = try_fun_num_trials(serializers.load,
                                  ntrials=10,
                                  **kwarg)
         # obj = joblib.load(filename=file_path)
@@ -512,6 +1035,515 @@ class StoreFs(Store):
         return dict_to_obj(obj_dict)
 
 
+class StorePack(Store):
+    """ Store packed in a single data file
+
+    Objects are pickled and appended to the data file, numpy arrays of at
+    least ARRAY_MIN_NBYTES bytes are written raw, aligned on ALIGN bytes.
+    Loaded arrays are read-only views of the memory mapped data file: no
+    copy. An index file (filepath + ".idx") maps each key to its record.
+    Saving a key again appends a new record, compact() drops the old ones
+    (see bin/epac_compact_store).
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the data file
+
+    clear: boolean
+        If True delete the data and index files.
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> import numpy as np
+    >>> from epac.stores import StorePack
+    >>> store = StorePack(os.path.join(tempfile.mkdtemp(), "results.pack"))
+    >>> store.save("SVC(C=1)/result_set", dict(y=np.arange(1000)))
+    >>> y = store.load("SVC(C=1)/result_set")["y"]
+    >>> y.sum(), y.flags.writeable
+    (499500, False)
+    >>> store.keys()
+    ['SVC(C=1)/result_set']
+    """
+    ALIGN = 64
+    ARRAY_MIN_NBYTES = 512
+    INDEX_SUFFIX = ".idx"
+    _INDEX_ENTRY = struct.Struct("<QQH")
+
+    def __init__(self, filepath, clear=False):
+        self.filepath = filepath
+        self.index_filepath = filepath + StorePack.INDEX_SUFFIX
+        if clear:
+            for path in (self.filepath, self.index_filepath):
+                if os.path.exists(path):
+                    os.remove(path)
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        for path in (self.filepath, self.index_filepath):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        self._open()
+
+    def _open(self):
+        self._data_file = None
+        self._index_file = None
+        self._mm = None
+        self.refresh()
+
+    def __getstate__(self):
+        return dict(filepath=self.filepath,
+                    index_filepath=self.index_filepath)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def close(self):
+        for f in (self._data_file, self._index_file):
+            if f:
+                f.close()
+        self._data_file = None
+        self._index_file = None
+        self._mm = None
+
+    def refresh(self):
+        """(Re)read the index file."""
+        self._index = OrderedDict()
+        # Offsets are reused when the data file is written again
+        self._mtime = os.path.getmtime(self.filepath)
+        if not os.path.getsize(self.index_filepath):
+            return
+        infile = open(self.index_filepath, "rb")
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        infile.close()
+        entry = StorePack._INDEX_ENTRY
+        pos = 0
+        while pos + entry.size <= len(mm):
+            offset, length, key_len = entry.unpack_from(mm, pos)
+            pos += entry.size
+            if pos + key_len > len(mm):  # truncated last entry
+                break
+            key = mm[pos:pos + key_len]
+            pos += key_len
+            self._index.pop(key, None)
+            self._index[key] = (offset, length)
+        mm.close()
+
+    def keys(self):
+        return self._index.keys()
+
+    def contains(self, key):
+        return key in self._index
+
+    def version(self, key):
+        if not key in self._index:
+            return 0
+        return (self._mtime,) + self._index[key]
+
+    def save(self, key, obj, protocol="bin", merge=False):
+        """ Save object
+
+        Parameters
+        ----------
+        key: str
+            The primary key
+
+        obj:
+            object to be saved
+
+        protocol: str
+            Ignored, for compatibility with StoreFs.save()
+        """
+        if self._data_file is None:
+            self._data_file = open(self.filepath, "ab")
+            self._index_file = open(self.index_filepath, "ab")
+        data_file = self._data_file
+        data_file.seek(0, os.SEEK_END)
+        arrays = dict()
+
+        def persistent_id(obj):
+            if not type(obj) in (np.ndarray, np.memmap) or \
+                    obj.dtype.hasobject or \
+                    obj.nbytes < StorePack.ARRAY_MIN_NBYTES:
+                return None
+            if not id(obj) in arrays:
+                pos = data_file.tell()
+                data_file.write("\0" * ((-pos) % StorePack.ALIGN))
+                offset = data_file.tell()
+                data_file.write(np.ascontiguousarray(obj).data)
+                arrays[id(obj)] = (obj, (offset, obj.dtype.str, obj.shape))
+            return arrays[id(obj)][1]
+        data = pickle_dumps(obj, persistent_id)
+        offset = data_file.tell()
+        data_file.write(data)
+        data_file.flush()
+        key_utf8 = key.encode("utf-8") if isinstance(key, unicode) else key
+        self._index_file.write(
+            StorePack._INDEX_ENTRY.pack(offset, len(data),
+                                        len(key_utf8)) + key_utf8)
+        self._index_file.flush()
+        self._index.pop(key, None)
+        self._index[key] = (offset, len(data))
+
+    def load(self, key=""):
+        """Load the object saved with key. If there is none, return a
+        dictionary of the objects whose key is prefixed with key, or if key
+        is an empty string the tree (see StoreFs.load())."""
+        if key in self._index:
+            return self._load_record(*self._index[key])
+        prefix = key + conf.SEP if key else ""
+        keys = [k for k in self._index if k.startswith(prefix)]
+        if not keys:
+            return None
+        loaded = dict([(k[len(prefix):], self.load(k)) for k in keys])
+        if key == "" and conf.STORE_EXECUTION_TREE_PREFIX in loaded:
+            loaded = assemble_tree(loaded)
+        return loaded
+
+    def _load_record(self, offset, length):
+        if self._mm is None or offset + length > len(self._mm):
+            infile = open(self.filepath, "rb")
+            self._mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            infile.close()
+        mm = self._mm
+        arrays = dict()
+
+        def persistent_load(pid):
+            if not pid in arrays:
+                arr_offset, dtype, shape = pid
+                dtype = np.dtype(dtype)
+                count = int(np.prod(shape)) if shape else 1
+                arr = np.frombuffer(mm, dtype=dtype, count=count,
+                                    offset=arr_offset)
+                arrays[pid] = arr.reshape(shape)
+            return arrays[pid]
+        return pickle_loads(mm[offset:offset + length], persistent_load)
+
+    def nbytes(self):
+        """Return (size of the data file, size of the live records)."""
+        live = 0
+        for key in self._index:
+            live += self._index[key][1]
+        return os.path.getsize(self.filepath), live
+
+    def compact(self):
+        """Rewrite the data and index files without the records of
+        overwritten keys."""
+        tmp_filepath = self.filepath + ".compact"
+        compacted = StorePack(tmp_filepath, clear=True)
+        for key in self._index:
+            compacted.save(key, self.load(key))
+        compacted.close()
+        self.close()
+        os.rename(compacted.filepath, self.filepath)
+        os.rename(compacted.index_filepath, self.index_filepath)
+        self._open()
+
+
+class StoreShards(Store):
+    """ Store over the result shards written by the jobs
+
+    Each job (see MapperSubtrees) writes its results, without the tree, in
+    a StorePack of its own: a shard, conf.STORE_SHARDS_DIR under the tree
+    directory. StoreShards indexes the keys of all the shards found in
+    dirpath and loads an object from its shard when asked, so results are
+    only read while reducing. Objects saved in StoreShards are kept in
+    memory, the shards are not modified.
+
+    Parameters
+    ----------
+    dirpath: str
+        Directory of the shards
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> from epac.stores import StorePack, StoreShards
+    >>> dirpath = tempfile.mkdtemp()
+    >>> StorePack(os.path.join(dirpath, "0.pack")).save("Perm(nb=0)/a", 0)
+    >>> StorePack(os.path.join(dirpath, "1.pack")).save("Perm(nb=1)/a", 1)
+    >>> store = StoreShards(dirpath)
+    >>> sorted(store.keys())
+    ['Perm(nb=0)/a', 'Perm(nb=1)/a']
+    >>> store.load("Perm(nb=1)/a")
+    1
+    """
+    SUFFIX = ".pack"
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self._mem = StoreMem(dedup=False)
+        self.refresh()
+
+    def refresh(self):
+        """(Re)build the index of the keys from the shards in dirpath.
+        When shards have the same key, the last one in name order wins."""
+        self._shards = list()
+        self._index = dict()
+        if not os.path.isdir(self.dirpath):
+            return
+        for basename in sorted(os.listdir(self.dirpath)):
+            if not basename.endswith(StoreShards.SUFFIX):
+                continue
+            shard = StorePack(os.path.join(self.dirpath, basename))
+            self._shards.append(shard)
+            for key in shard.keys():
+                self._index[key] = shard
+
+    def __getstate__(self):
+        return dict(dirpath=self.dirpath, _mem=self._mem)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.refresh()
+
+    def keys(self):
+        return list(set(self._index.keys() + self._mem.keys()))
+
+    def contains(self, key):
+        return self._mem.contains(key) or key in self._index
+
+    def save(self, key, obj, protocol="bin", merge=False):
+        self._mem.save(key, obj, merge=merge)
+
+    def load(self, key):
+        if self._mem.contains(key):
+            return self._mem.load(key)
+        if key in self._index:
+            return self._index[key].load(key)
+        return None
+
+    def version(self, key):
+        if self._mem.contains(key):
+            return self._mem.version(key)
+        if key in self._index:
+            shard = self._index[key]
+            return (shard.filepath,) + shard.version(key)
+        return 0
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+
+class StoreSQLite(Store):
+    """ Store in a SQLite database
+
+    Objects are pickled in a table, numpy arrays of at least
+    array_min_nbytes bytes are written in .npy files next to the database
+    (directory filepath + "_arrays") and loaded memory mapped (read-only).
+    Saved objects are written by batches of batch_size in one transaction,
+    call flush() to write the pending ones. Several processes can write in
+    the same database: SQLite locking serializes the transactions. So,
+    given to LocalEngine, the store is shared by the workers and their
+    results are not merged afterwards.
+
+    Parameters
+    ----------
+    filepath: str
+        Path of the database file
+
+    clear: boolean
+        If True delete the database and the arrays.
+
+    batch_size: int
+        Number of saved objects written in one transaction.
+
+    array_min_nbytes: int
+        Arrays from this size are written in .npy files.
+
+    timeout: float
+        Seconds to wait for the lock of another process.
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> import numpy as np
+    >>> from epac.stores import StoreSQLite
+    >>> store = StoreSQLite(os.path.join(tempfile.mkdtemp(), "results.db"),
+    ...                     array_min_nbytes=1000)
+    >>> store.save("CV/CV(nb=0)/SVC/result_set", dict(a=1))
+    >>> store.save("CV/CV(nb=1)/SVC/result_set", dict(y=np.arange(1000)))
+    >>> store.flush()
+    >>> sorted(store.load("CV").keys())
+    ['CV(nb=0)/SVC/result_set', 'CV(nb=1)/SVC/result_set']
+    >>> isinstance(store.load("CV/CV(nb=1)/SVC/result_set")["y"], np.memmap)
+    True
+    """
+    is_shared = True
+
+    def __init__(self, filepath, clear=False, batch_size=100,
+                 array_min_nbytes=1048576, timeout=600.):
+        self.filepath = filepath
+        self.arrays_dirpath = filepath + "_arrays"
+        self.batch_size = batch_size
+        self.array_min_nbytes = array_min_nbytes
+        self.timeout = timeout
+        if clear:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            if os.path.isdir(self.arrays_dirpath):
+                shutil.rmtree(self.arrays_dirpath)
+        dirpath = os.path.dirname(filepath)
+        if dirpath and not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        self._pending = OrderedDict()
+        self._db = None
+        self._db_pid = None
+        self._connect().execute("CREATE TABLE IF NOT EXISTS store "
+                                "(key TEXT PRIMARY KEY, value BLOB)")
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state["_db"] = None
+        state["_db_pid"] = None
+        return state
+
+    def _connect(self):
+        # A connection must not be used by a forked process
+        if self._db is None or self._db_pid != os.getpid():
+            import sqlite3
+            self._db = sqlite3.connect(self.filepath, timeout=self.timeout,
+                                       isolation_level=None)
+            self._db.text_factory = str
+            self._db_pid = os.getpid()
+        return self._db
+
+    def save(self, key, obj, protocol="bin", merge=False):
+        """ Save object
+
+        Parameters
+        ----------
+        key: str
+            The primary key
+
+        obj:
+            object to be saved
+
+        protocol: str
+            Ignored, for compatibility with StoreFs.save()
+        """
+        self._pending.pop(key, None)
+        self._pending[key] = self._dumps(obj)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending objects in one transaction."""
+        if not self._pending:
+            return
+        import sqlite3
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR REPLACE INTO store VALUES (?, ?)",
+                           [(key, sqlite3.Binary(self._pending[key]))
+                            for key in self._pending])
+        except:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self._pending = OrderedDict()
+
+    def load(self, key=""):
+        """Load the object saved with key. If there is none, return a
+        dictionary of the objects whose key is prefixed with key, or if key
+        is an empty string the tree (see StoreFs.load())."""
+        if key in self._pending:
+            return self._loads(self._pending[key])
+        row = self._connect().execute("SELECT value FROM store WHERE key=?",
+                                      (key,)).fetchone()
+        if row:
+            return self._loads(row[0])
+        prefix = key + conf.SEP if key else ""
+        loaded = dict()
+        for key1, value in self._select_prefix("key, value", prefix):
+            loaded[key1[len(prefix):]] = self._loads(value)
+        for key1 in self._pending:
+            if key1.startswith(prefix):
+                loaded[key1[len(prefix):]] = self._loads(self._pending[key1])
+        if not loaded:
+            return None
+        if key == "" and conf.STORE_EXECUTION_TREE_PREFIX in loaded:
+            loaded = assemble_tree(loaded)
+        return loaded
+
+    def keys(self, prefix=""):
+        keys = [row[0] for row in self._select_prefix("key", prefix)]
+        return keys + [key for key in self._pending
+                       if key.startswith(prefix) and not key in keys]
+
+    def contains(self, key):
+        if key in self._pending:
+            return True
+        return self._connect().execute("SELECT 1 FROM store WHERE key=?",
+                                       (key,)).fetchone() is not None
+
+    def _select_prefix(self, columns, prefix):
+        query = "SELECT %s FROM store" % columns
+        if not prefix:
+            return self._connect().execute(query)
+        # keys in [prefix, prefix + 1) uses the primary key index
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._connect().execute(query + " WHERE key>=? AND key<?",
+                                       (prefix, upper))
+
+    def _dumps(self, obj):
+        def persistent_id(obj):
+            if not type(obj) in (np.ndarray, np.memmap) or \
+                    obj.dtype.hasobject or \
+                    obj.nbytes < self.array_min_nbytes:
+                return None
+            # Content addressed: an array saved twice is written once
+            basename = hashlib.sha1(repr(array_digest(obj))).hexdigest()
+            basename += ".npy"
+            path = os.path.join(self.arrays_dirpath, basename)
+            if not os.path.exists(path):
+                if not os.path.isdir(self.arrays_dirpath):
+                    try:
+                        os.makedirs(self.arrays_dirpath)
+                    except OSError:  # created by another process
+                        pass
+                fd, tmp_path = tempfile.mkstemp(dir=self.arrays_dirpath)
+                with os.fdopen(fd, "wb") as outfile:
+                    np.save(outfile, obj)
+                os.rename(tmp_path, path)
+            return basename
+        return pickle_dumps(obj, persistent_id)
+
+    def _loads(self, data):
+        def persistent_load(basename):
+            return np.load(os.path.join(self.arrays_dirpath, basename),
+                           mmap_mode="r")
+        return pickle_loads(str(data), persistent_load)
+
+
+def assemble_tree(loaded):
+    """Return the execution tree found in loaded (a dictionary key => object
+    as returned by Store.load()), the other objects are the stores of the
+    tree nodes and are put back in the tree."""
+    from epac.workflow.base import key_pop
+    tree = loaded.pop(conf.STORE_EXECUTION_TREE_PREFIX)
+    for key1 in loaded:
+        key, attrname = key_pop(key1)
+        if attrname != conf.STORE_STORE_PREFIX:
+            raise ValueError('Do not know what to do with %s' % key1)
+        node = tree.get_node(key)
+        if not node.store:
+            node.store = loaded[key1]
+        else:
+            keys_disk = loaded[key1].keys()
+            for key_disk in keys_disk:
+                if node.store.contains(key_disk):
+                    raise KeyError("Merge store with same keys")
+            for key_disk in keys_disk:
+                node.store.save(key_disk, loaded[key1].load(key_disk))
+    return tree
+
+
 ## ============================== ##
 ## == Conversion Object / dict == ##
 ## ============================== ##
@@ -574,8 +1606,22 @@ def save_tree(tree_root, dir_path):
 
 
 def load_tree(dir_path):
+    """Load a tree saved by save_tree(), dir_path may also be the data file
+    of a StorePack. The results of the shards found in dir_path are
+    attached to the tree (see attach_shards)."""
+    if os.path.isfile(dir_path):
+        return StorePack(dir_path).load()
     store_fs = StoreFs(dirpath=dir_path)
-    return store_fs.load()
+    return attach_shards(store_fs.load(), dir_path)
+
+
+def attach_shards(tree_root, dir_path):
+    """If jobs wrote result shards in dir_path (see StoreShards), set a
+    StoreShards over them as the store of tree_root. Return tree_root."""
+    shards_dirpath = os.path.join(dir_path, conf.STORE_SHARDS_DIR)
+    if tree_root is not None and os.path.isdir(shards_dirpath):
+        tree_root.store = StoreShards(shards_dirpath)
+    return tree_root
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Smoke test of the benchmarks harnesses (benchmarks/run_benchmarks.py,
+benchmarks/run_scaling.py and benchmarks/run_memory.py).
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import epac
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(
+    epac.__file__)))
+RUN_BENCHMARKS = os.path.join(PACKAGE_DIR, "benchmarks", "run_benchmarks.py")
+RUN_SCALING = os.path.join(PACKAGE_DIR, "benchmarks", "run_scaling.py")
+RUN_MEMORY = os.path.join(PACKAGE_DIR, "benchmarks", "run_memory.py")
+
+
+def run_benchmarks(*args, **kwargs):
+    script = kwargs.get("script", RUN_BENCHMARKS)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [PACKAGE_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+    process = subprocess.Popen([sys.executable, script] + list(args),
+                               env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    process.communicate()
+    return process.returncode
+
+
+@unittest.skipUnless(os.path.isfile(RUN_BENCHMARKS),
+                     "benchmarks are not installed")
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_compare(self):
+        tmp_dir = tempfile.mkdtemp()
+        before = os.path.join(tmp_dir, "before.json")
+        self.assertEqual(run_benchmarks("--quick", "--filter", "CRSlicer",
+                                        "--output", before), 0)
+        f = open(before)
+        run = json.load(f)
+        f.close()
+        self.assertEqual(sorted(run["results"]),
+                         ["bench_tree.TimeCRSlicer.time_transform"])
+        timings = run["results"]["bench_tree.TimeCRSlicer.time_transform"]
+        self.assertEqual(sorted(timings), ["100", "10000", "100000"])
+        self.assertTrue(timings["100"]["best"] > 0)
+        self.assertEqual(run_benchmarks("--compare", before, before), 0)
+        # A benchmark twice slower is a regression
+        after = os.path.join(tmp_dir, "after.json")
+        timings["100"]["best"] *= 2
+        f = open(after, "w")
+        json.dump(run, f)
+        f.close()
+        self.assertEqual(run_benchmarks("--compare", before, after), 1)
+        shutil.rmtree(tmp_dir)
+
+    def test_scaling(self):
+        tmp_dir = tempfile.mkdtemp()
+        output = os.path.join(tmp_dir, "scaling.json")
+        self.assertEqual(run_benchmarks("--processes", "1,2",
+                                        "--n_perms", "2",
+                                        "--n_features", "20",
+                                        "--n_folds", "2",
+                                        "--weak",
+                                        "--output", output,
+                                        script=RUN_SCALING), 0)
+        f = open(output)
+        runs = json.load(f)["runs"]
+        f.close()
+        self.assertEqual([(run["engine"], run["num_processes"],
+                           run["n_perms"]) for run in runs],
+                         [("local", 1, 2), ("local", 2, 4),
+                          ("bash", 1, 2), ("bash", 2, 4)])
+        for run in runs:
+            self.assertTrue(run["total"] > 0)
+            self.assertTrue(run["peak_rss_mb"] > 0)
+            self.assertAlmostEqual(run["total"], run["map"] + run["merge"] +
+                                   run["reduce"])
+        self.assertEqual(runs[0]["efficiency"], 1.)
+        shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(os.path.isfile("/proc/self/status"),
+                         "needs /proc")
+    def test_memory(self):
+        tmp_dir = tempfile.mkdtemp()
+        thresholds = os.path.join(tmp_dir, "thresholds.json")
+        output = os.path.join(tmp_dir, "memory.json")
+        scenario = dict(parent_base_mb=500., parent_x_factor=1.5,
+                        worker_base_mb=500., worker_x_factor=2.5)
+        f = open(thresholds, "w")
+        json.dump(dict(perms_memmap=scenario), f)
+        f.close()
+        args = ["--scenario", "perms_memmap", "--n_samples", "50",
+                "--n_features", "2000", "--thresholds", thresholds]
+        self.assertEqual(run_benchmarks(*(args + ["--output", output]),
+                                        script=RUN_MEMORY), 0)
+        f = open(output)
+        measure = json.load(f)["perms_memmap"]
+        f.close()
+        self.assertAlmostEqual(measure["x_mb"], 50 * 2000 * 8 / 1048576.)
+        self.assertTrue(measure["n_workers"] > 0)
+        self.assertTrue(measure["worker_mb"] > 0)
+        # A worker beyond its threshold fails the run
+        scenario["worker_base_mb"] = 0.
+        f = open(thresholds, "w")
+        json.dump(dict(perms_memmap=scenario), f)
+        f.close()
+        self.assertEqual(run_benchmarks(*args, script=RUN_MEMORY), 1)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
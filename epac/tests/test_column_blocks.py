@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Test datasets saved by column groups.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import ColumnSplitter, Methods
+from epac.map_reduce.engine import get_column_groups
+from epac.utils import save_dataset, load_dataset, ColumnBlockArray
+from epac.tests.utils import isequal
+
+
+class TestColumnBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.X, self.y = datasets.make_classification(n_samples=20,
+                                                      n_features=9,
+                                                      n_informative=2,
+                                                      random_state=1)
+        self.groups = [2, 0, 0, 1, 1, 2, 0, 1, 2]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_load(self):
+        save_dataset(self.tmp_dir, column_groups=dict(X=self.groups),
+                     X=self.X, y=self.y)
+        Xy = load_dataset(self.tmp_dir)
+        self.assertTrue(isinstance(Xy["X"], ColumnBlockArray))
+        self.assertTrue(isinstance(Xy["y"], np.ndarray))
+        self.assertEqual(Xy["X"].shape, self.X.shape)
+        self.assertEqual(Xy["X"].loaded_blocks(), [])
+        columns = [3, 4, 7]
+        self.assertTrue(np.all(Xy["X"][:, columns] == self.X[:, columns]))
+        self.assertEqual(Xy["X"].loaded_blocks(), [1])
+        self.assertTrue(np.all(Xy["X"][:, [8, 1]] == self.X[:, [8, 1]]))
+        self.assertTrue(np.all(Xy["X"][2:5, 3] == self.X[2:5, 3]))
+        self.assertTrue(np.all(np.asarray(Xy["X"]) == self.X))
+        self.assertTrue(np.all(Xy["X"][3] == self.X[3]))
+
+    def test_column_splitter(self):
+        indices_of_groups = dict(X=self.groups)
+        tree = ColumnSplitter(Methods(SVC(C=1), SVC(C=10)), indices_of_groups)
+        self.assertEqual(get_column_groups(tree), indices_of_groups)
+        save_dataset(self.tmp_dir, column_groups=get_column_groups(tree),
+                     X=self.X, y=self.y)
+        Xy = load_dataset(self.tmp_dir)
+        tree.run(**Xy)
+        self.assertEqual(Xy["X"].loaded_blocks(), [0, 1, 2])
+        tree_ref = ColumnSplitter(Methods(SVC(C=1), SVC(C=10)),
+                                  indices_of_groups)
+        tree_ref.run(X=self.X, y=self.y)
+        self.assertTrue(isequal(tree.reduce(), tree_ref.reduce()))
+
+if __name__ == '__main__':
+    unittest.main()
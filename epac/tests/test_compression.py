@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Test compressed storage of arrays.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Methods, StoreFs
+from epac.compression import save_compressed, load_compressed
+from epac.stores import load_tree
+from epac.utils import save_dataset, load_dataset
+
+
+def dir_size(dirpath):
+    size = 0
+    for base, dirs, files in os.walk(dirpath):
+        for basename in files:
+            size += os.path.getsize(os.path.join(base, basename))
+    return size
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_partial_read(self):
+        filepath = os.path.join(self.tmp_dir, "X")
+        X = np.repeat(np.arange(100), 50).reshape((100, 50))
+        save_compressed(filepath, X, chunk_nbytes=1000)
+        self.assertTrue(np.all(load_compressed(filepath) == X))
+        self.assertTrue(np.all(load_compressed(filepath, 33, 77) == X[33:77]))
+        self.assertTrue(np.all(load_compressed(filepath, 90) == X[90:]))
+
+    def test_dataset(self):
+        X_random = np.random.random((50, 20))
+        X_sparse = np.zeros((50, 1000))
+        X_sparse[:, 0] = 1
+        y = np.arange(50) % 2
+        dataset_dir = os.path.join(self.tmp_dir, "dataset")
+        save_dataset(dataset_dir, compress=True,
+                     X_random=X_random, X_sparse=X_sparse, y=y)
+        # incompressible data is saved as usual
+        self.assertTrue(os.path.isfile(os.path.join(dataset_dir,
+                                                    "X_random.npy")))
+        self.assertTrue(os.path.getsize(os.path.join(dataset_dir,
+                                                     "X_sparse.cnpy"))
+                        < X_sparse.nbytes / 10)
+        Xy = load_dataset(dataset_dir)
+        self.assertTrue(np.all(Xy["X_random"] == X_random))
+        self.assertTrue(np.all(Xy["X_sparse"] == X_sparse))
+        self.assertTrue(np.all(Xy["y"] == y))
+
+    def test_store_fs(self):
+        X, y = datasets.make_classification(n_samples=2000, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        dirpaths = list()
+        for compress in (False, True):
+            dirpaths.append(os.path.join(self.tmp_dir, str(compress)))
+            wf_copy = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+            wf_copy.merge_tree_store(wf)
+            wf_copy.save_tree(store=StoreFs(dirpaths[-1], compress=compress))
+            self.assertEqual(repr(load_tree(dirpaths[-1]).reduce()),
+                             repr(reduced))
+        self.assertTrue(dir_size(dirpaths[1]) < dir_size(dirpaths[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Test the hooks on the execution of the nodes and the node profiler.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Perms, Methods, LocalEngine, NodeProfiler
+from epac import hooks
+from epac.hooks import Tracer, merge_traces
+
+
+class TestHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = datasets.make_classification(n_samples=20,
+                                                      n_features=5,
+                                                      n_informative=2,
+                                                      random_state=1)
+
+    def test_events(self):
+        events = list()
+
+        def callback(event, node, **info):
+            events.append((event, node.get_key()))
+        for event in hooks.EVENTS:
+            hooks.add_hook(event, callback)
+        try:
+            wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+            wf.run(X=self.X, y=self.y)
+            wf.reduce()
+        finally:
+            for event in hooks.EVENTS:
+                hooks.remove_hook(event, callback)
+        self.assertEqual(hooks.listeners, dict())
+        counts = dict()
+        for event, _ in events:
+            counts[event] = counts.get(event, 0) + 1
+        self.assertEqual(counts["enter"], 1 + 2 + 2 + 4)
+        self.assertEqual(counts["exit"], counts["enter"])
+        self.assertEqual(counts["fit"], 4)
+        self.assertEqual(counts["predict"], 4 * 2)
+        self.assertEqual(counts["slice"], 2)
+        self.assertEqual(counts["save"], 4)
+        self.assertTrue(("enter", "CV/CV(nb=1)/Methods/SVC(C=3)") in events)
+        self.assertTrue(("reduce", "CV") in events)
+        self.assertRaises(ValueError, hooks.add_hook, "run", callback)
+
+    def test_profiler(self):
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        engine = LocalEngine(wf, num_processes=2, profile=True)
+        engine.run(X=self.X, y=self.y)
+        self.assertEqual(hooks.listeners, dict())
+        stats = dict([(name, (count, nbytes)) for name, count, wall, cpu,
+                      nbytes in engine.profiler.stats(group_by="class")])
+        self.assertEqual(stats["SVC"][0], 3 * 2 * 2)
+        self.assertTrue(stats["SVC"][1] > 0)
+        self.assertEqual(stats["Methods"], (3 * 2, 0))
+        records = engine.profiler.records
+        key = "Perms/Perm(nb=0)/CV/CV(nb=0)/Methods/SVC(C=1)"
+        self.assertTrue(records[key]["fit"] > 0)
+        # Save and merge the profiles of several jobs
+        tmp_dir = tempfile.mkdtemp()
+        engine.profiler.save(os.path.join(tmp_dir, "0.job.json"))
+        engine.profiler.save(os.path.join(tmp_dir, "1.job.json"))
+        profiler = NodeProfiler.load(tmp_dir)
+        self.assertEqual(sorted(profiler.records), sorted(records))
+        self.assertEqual(profiler.stats()[0][1],
+                         2 * engine.profiler.stats()[0][1])
+        shutil.rmtree(tmp_dir)
+
+    def test_trace(self):
+        tmp_dir = tempfile.mkdtemp()
+        trace_path = os.path.join(tmp_dir, "trace.json")
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        reduced = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+                        n_perms=3, random_state=0)
+        reduced.run(X=self.X, y=self.y)
+        engine = LocalEngine(wf, num_processes=2, trace=trace_path)
+        wf = engine.run(X=self.X, y=self.y)
+        self.assertEqual(hooks.listeners, dict())
+        self.assertEqual(repr(reduced.reduce()), repr(wf.reduce()))
+        f = open(trace_path)
+        events = json.load(f)["traceEvents"]
+        f.close()
+        # The engine and its map processes
+        self.assertTrue(len(set([event["pid"] for event in events])) >= 2)
+        names = set([event["name"] for event in events])
+        for name in ["map", "load", "fit", "serialize results",
+                     "deserialize results", "merge_tree_store",
+                     "SVC(C=1)"]:
+            self.assertTrue(name in names, name)
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertEqual(spans, sorted(spans, key=lambda e: e["ts"]))
+        # merge_traces
+        tracer = Tracer(name="other")
+        with tracer.span("wait", cat="test"):
+            pass
+        tracer.save(os.path.join(tmp_dir, "other.json"))
+        self.assertEqual(merge_traces([trace_path,
+                                       os.path.join(tmp_dir, "other.json")],
+                                      os.path.join(tmp_dir, "all.json")),
+                         len(events) + 2)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Test that "import epac" is fast: the jobs (epac_mapper) are short lived
+processes, slow to import modules are imported on first use.
+"""
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+import epac
+
+# Seconds that "import epac" may take, numpy aside
+IMPORT_TIME_BUDGET = 0.3
+# Modules that "import epac" must not import
+DEFERRED_MODULES = ["scipy.stats", "sklearn.metrics", "sklearn.utils",
+                    "joblib", "dill"]
+
+IMPORT_EPAC = """
+import sys, time, json
+import numpy
+start = time.time()
+import epac
+elapsed = time.time() - start
+print json.dumps(dict(elapsed=elapsed, modules=[name for name in sys.modules
+                                                if sys.modules[name]]))
+"""
+
+
+def import_epac():
+    """Import epac in a new process, return the time it took and the names
+    of the imported modules"""
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(epac.__file__))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get("PYTHONPATH")] if p])
+    process = subprocess.Popen([sys.executable, "-c", IMPORT_EPAC], env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, _ = process.communicate()
+    out = json.loads(out.strip().splitlines()[-1])
+    return out["elapsed"], out["modules"]
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_import_time(self):
+        # The first import may compile the modules
+        elapsed = min([import_epac()[0] for i in xrange(3)])
+        self.assertTrue(elapsed < IMPORT_TIME_BUDGET,
+                        "import epac took %.3fs, budget %.3fs" %
+                        (elapsed, IMPORT_TIME_BUDGET))
+
+    def test_deferred_modules(self):
+        _, modules = import_epac()
+        for name in DEFERRED_MODULES:
+            self.assertFalse(name in modules, "%s is imported" % name)
+
+    def test_public_names(self):
+        for name in epac.__all__:
+            self.assertTrue(getattr(epac, name) is not None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the mappers only load the dataset entries read by their jobs.
+"""
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Perms, Methods, MapperSubtrees
+from epac.map_reduce.inputs import NodesInput
+from epac.workflow.base import BaseNode
+from epac.utils import save_dataset, load_dataset
+from epac.tests.utils import comp_2wf_reduce_res
+
+
+class PassAll(BaseNode):
+    """Node that does not tell which inputs it reads"""
+    def transform(self, **Xy):
+        return Xy
+
+    def get_parameters(self):
+        return dict()
+
+
+class TestLazyDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        self.Xy = dict(X=X, y=y, covariates=np.random.random((20, 3)))
+        save_dataset(self.tmp_dir, **self.Xy)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def map_leftmost_perm(self, tree, Xy):
+        key = tree.children[0].get_key()
+        mapper = MapperSubtrees(Xy=Xy, tree_root=tree)
+        mapper.map(NodesInput(key))
+        return key
+
+    def test_only_read_keys_are_loaded(self):
+        tree = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+                     n_perms=2, random_state=0)
+        Xy = load_dataset(self.tmp_dir, lazy=True)
+        key = self.map_leftmost_perm(tree, Xy)
+        self.assertEqual(Xy.loaded_keys(), ['X', 'y'])
+        tree_ref = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+                         n_perms=2, random_state=0)
+        tree_ref.run(**self.Xy)
+        self.assertTrue(comp_2wf_reduce_res(tree.get_node(key),
+                                            tree_ref.get_node(key)))
+
+    def test_unknown_inputs(self):
+        tree = Perms(PassAll(), n_perms=2, random_state=0)
+        Xy = load_dataset(self.tmp_dir, lazy=True)
+        self.map_leftmost_perm(tree, Xy)
+        self.assertEqual(Xy.loaded_keys(), ['X', 'covariates', 'y'])
+
+if __name__ == '__main__':
+    unittest.main()
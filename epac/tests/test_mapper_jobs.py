@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Test several jobs run by a single epac_mapper command.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from sklearn import datasets
+from sklearn.svm import SVC
+import epac
+from epac import CV, Perms, Methods, StoreFs, NodeProfiler, conf
+from epac.map_reduce.inputs import NodesInput
+from epac.map_reduce.split_input import SplitNodesInput
+from epac.map_reduce.exports import save_job_list, load_job_list
+from epac.map_reduce.exports import group_job_list
+from epac.stores import load_tree
+from epac.utils import save_dataset
+from epac.workflow.spec import save_tree_spec
+
+
+def run_mapper(cwd, *args):
+    package_dir = os.path.dirname(os.path.dirname(epac.__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get("PYTHONPATH")] if p])
+    command = [sys.executable, os.path.join(package_dir, "bin", "epac_mapper")]
+    return subprocess.call(command + list(args), cwd=cwd, env=env)
+
+
+class TestMapperJobs(unittest.TestCase):
+
+    def test_group_job_list(self):
+        keysfile_list = ["./%i.job" % i for i in xrange(5)]
+        self.assertEqual(group_job_list(keysfile_list),
+                         [[keysfile] for keysfile in keysfile_list])
+        groups = group_job_list(keysfile_list, jobs_per_command=2)
+        self.assertEqual([len(group) for group in groups], [2, 2, 1])
+        self.assertEqual(sum(groups, []), keysfile_list)
+
+    def test_mapper_jobs(self):
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        tmp_dir = tempfile.mkdtemp()
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        tree_dir = os.path.join(tmp_dir, "epac_tree")
+        wf.save_tree(StoreFs(tree_dir))
+        save_dataset(os.path.join(tmp_dir, "dataset"), X=X, y=y)
+        jobs_dir = os.path.join(tmp_dir, "jobs")
+        os.makedirs(jobs_dir)
+        nodesinput_list = SplitNodesInput(wf, num_processes=3).split(
+            NodesInput(wf.get_key()))
+        save_job_list(jobs_dir, nodesinput_list)
+        jobs = load_job_list([jobs_dir])
+        self.assertEqual([keys for _, keys in jobs],
+                         [nodesinput.keys() for nodesinput in nodesinput_list])
+        # All the jobs in one process, each one saves its own shard
+        self.assertEqual(run_mapper(tmp_dir,
+                                    "--datasets", "dataset",
+                                    "--keysfile", "jobs",
+                                    "--treedir", "epac_tree",
+                                    "--shards",
+                                    "--profile", "profiles"), 0)
+        shards_dir = os.path.join(tree_dir, conf.STORE_SHARDS_DIR)
+        self.assertEqual(sorted(f for f in os.listdir(shards_dir)
+                                if f.endswith(".pack")),
+                         sorted(os.path.basename(keysfile) + ".pack"
+                                for keysfile, _ in jobs))
+        self.assertEqual(repr(reduced), repr(load_tree(tree_dir).reduce()))
+        # The profiles of the jobs
+        profiles_dir = os.path.join(tmp_dir, "profiles")
+        self.assertEqual(sorted(os.listdir(profiles_dir)),
+                         sorted(os.path.basename(keysfile) + ".json"
+                                for keysfile, _ in jobs))
+        stats = NodeProfiler.load(profiles_dir).stats(group_by="class")
+        self.assertEqual([count for name, count, _, _, _ in stats
+                          if name == "SVC"], [3 * 2 * 2])
+        # Without shards, the results of each job are saved in the tree
+        # directory, the tree is saved once after the last job
+        shutil.rmtree(tree_dir)
+        wf.save_tree(StoreFs(tree_dir))
+        self.assertEqual(run_mapper(tmp_dir,
+                                    "--datasets", "dataset",
+                                    "--keysfile", "jobs",
+                                    "--treedir", "epac_tree"), 0)
+        self.assertEqual(repr(reduced), repr(load_tree(tree_dir).reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_tree_spec_without_shards(self):
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        tmp_dir = tempfile.mkdtemp()
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        tree_dir = os.path.join(tmp_dir, "epac_tree")
+        wf.save_tree(StoreFs(tree_dir))
+        save_tree_spec(wf, os.path.join(tree_dir, conf.STORE_TREE_SPEC))
+        save_dataset(os.path.join(tmp_dir, "dataset"), X=X, y=y)
+        jobs_dir = os.path.join(tmp_dir, "jobs")
+        os.makedirs(jobs_dir)
+        # Jobs below the Methods nodes: each builds a part of the tree only
+        nodesinput_list = SplitNodesInput(wf, num_processes=4).split(
+            NodesInput(wf.get_key()))
+        self.assertEqual(len(nodesinput_list), 4)
+        save_job_list(jobs_dir, nodesinput_list)
+        for keysfile, _ in load_job_list([jobs_dir]):
+            self.assertEqual(run_mapper(tmp_dir,
+                                        "--datasets", "dataset",
+                                        "--keysfile", keysfile,
+                                        "--treedir", "epac_tree"), 0)
+        self.assertEqual(repr(reduced), repr(load_tree(tree_dir).reduce()))
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,17 +10,69 @@ Created on 20 June 2013
 
 """
 
+import glob
+import os
+import tempfile
 import unittest
 import numpy as np
+from sklearn.svm import SVC
 from epac.tests.wfexamples2test import get_wf_example_classes
+from epac import CV, Methods
 from epac import LocalEngine
 from epac import SomaWorkflowEngine
+from epac.configuration import conf
+from epac.map_reduce.engine import mmap_big_arrays
 
 from sklearn import datasets
 from epac.tests.utils import comp_2wf_reduce_res
 from epac.tests.utils import compare_two_node
 
 
+class InputFlags:
+    """Tell whether X is a read-only memory map"""
+    def __init__(self, C=1):
+        self.C = C
+
+    def transform(self, X, y):
+        return {"X/memmap": np.array([isinstance(X, np.memmap)]),
+                "X/writeable": np.array([X.flags.writeable])}
+
+
+class TestLocalEngineMmap(unittest.TestCase):
+    def test_mmap_big_arrays(self):
+        X, y = datasets.make_classification(n_samples=50, n_features=100,
+                                            n_informative=5, random_state=0)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        memm_threshold = conf.MEMM_THRESHOLD
+        tmp_dirs = glob.glob(os.path.join(tempfile.gettempdir(), "epac_Xy_*"))
+        try:
+            conf.MEMM_THRESHOLD = X.nbytes - 1
+            Xy = mmap_big_arrays(dict(X=X, y=y), tempfile.mkdtemp())
+            self.assertTrue(isinstance(Xy["X"], np.memmap))
+            self.assertFalse(Xy["X"].flags.writeable)
+            self.assertFalse(isinstance(Xy["y"], np.memmap))
+            wf_engine = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+            wf_engine = LocalEngine(wf_engine, num_processes=2).run(X=X, y=y)
+            # The processes read X from the read-only memory map
+            wf_flags = Methods(InputFlags(C=1), InputFlags(C=3))
+            wf_flags = LocalEngine(wf_flags, num_processes=2).run(X=X, y=y)
+            for leaf in wf_flags.walk_leaves():
+                result = leaf.load_results().values()[0]
+                self.assertTrue(result["X/memmap"][0])
+                self.assertFalse(result["X/writeable"][0])
+            # Keys holding the separator of the keys
+            Xy = mmap_big_arrays({"X" + conf.SEP + "train": X},
+                                 tempfile.mkdtemp())
+            self.assertTrue(np.all(Xy["X" + conf.SEP + "train"] == X))
+        finally:
+            conf.MEMM_THRESHOLD = memm_threshold
+        self.assertTrue(comp_2wf_reduce_res(wf, wf_engine))
+        self.assertEqual(
+            tmp_dirs,
+            glob.glob(os.path.join(tempfile.gettempdir(), "epac_Xy_*")))
+
+
 class EpacWorkflowTest(unittest.TestCase):
     def setUp(self):
         self.n_cores = 3
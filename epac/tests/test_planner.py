@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the plan of a tree (epac.map_reduce.planner) predicts the counts
+of its run.
+"""
+
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import LinearSVC
+
+from epac import Perms, CV, Methods, ExecutionPlanner
+from epac.hooks import NodeProfiler
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = datasets.make_classification(n_samples=30,
+                                                      n_features=20,
+                                                      random_state=1)
+        self.wf = Perms(CV(Methods(LinearSVC(C=1), LinearSVC(C=10)),
+                           n_folds=3),
+                        n_perms=4, random_state=0)
+
+    def test_plan_vs_run(self):
+        plan = ExecutionPlanner(self.wf, dict(X=self.X, y=self.y)).plan()
+        with NodeProfiler() as profiler:
+            self.wf.run(X=self.X, y=self.y)
+        counts = dict([(name, count) for name, count, _, _, nbytes
+                       in profiler.stats(group_by="class")])
+        self.assertEqual(len(plan["jobs"]), 1)
+        self.assertEqual(plan["total"]["nodes"], sum(counts.values()))
+        self.assertEqual(plan["total"]["fits"], counts["LinearSVC"])
+        self.assertEqual(plan["total"]["predicts"], 2 * counts["LinearSVC"])
+        self.assertEqual(plan["total"]["slices"], counts["CRSlicer"])
+        # The train and test sets of X and y by fold, y by permutation
+        self.assertEqual(plan["total"]["slice_nbytes"],
+                         4 * 3 * (self.X.nbytes + self.y.nbytes) +
+                         4 * self.y.nbytes)
+        # The results saved hold at least the predictions
+        self.assertTrue(0 < plan["total"]["result_nbytes"] <=
+                        profiler.stats(group_by="class",
+                                       sort_by="nbytes")[0][4])
+
+    def test_partition(self):
+        planner = ExecutionPlanner(self.wf, dict(X=self.X.shape,
+                                                 y=self.y.shape),
+                                   calibration=dict(LinearSVC=1.))
+        plan = planner.plan(num_processes=2)
+        self.assertEqual([len(job["keys"]) for job in plan["jobs"]], [2, 2])
+        self.assertEqual([job["fits"] for job in plan["jobs"]], [12, 12])
+        self.assertEqual(plan["total"]["fits"], 24)
+        self.assertEqual(plan["makespan"], 12.)
+        self.assertEqual(plan["uncalibrated"],
+                         ["CRSlicer", "CV", "Methods", "Perms"])
+        self.assertTrue("makespan 12.0s" in ExecutionPlanner.report(plan))
+
+    def test_calibrate(self):
+        with NodeProfiler() as profiler:
+            self.wf.run(X=self.X, y=self.y)
+        calibration = ExecutionPlanner.calibrate(profiler)
+        self.assertTrue(calibration["LinearSVC"] > 0)
+        plan = ExecutionPlanner(self.wf, dict(X=self.X, y=self.y),
+                                calibration=profiler).plan()
+        self.assertEqual(plan["uncalibrated"], [])
+        fit_predict = sum([r["fit"] + r["predict"]
+                           for r in profiler.records.values()])
+        self.assertTrue(plan["makespan"] >= fit_predict * 0.99)
+
+if __name__ == '__main__':
+    unittest.main()
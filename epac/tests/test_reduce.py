@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Test the streaming reduce.
+"""
+
+import copy
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Perms, Methods, Result
+from epac import ClassificationReport, PvalPerms, ReduceCache, conf
+from epac.map_reduce.engine import parallel_reduce
+from epac.tests.utils import isequal
+
+
+def same_results(results1, results2):
+    results1, results2 = list(results1), list(results2)
+    if [r["key"] for r in results1] != [r["key"] for r in results2]:
+        return False
+    for result1, result2 in zip(results1, results2):
+        if not isequal(result1, result2):
+            return False
+    return True
+
+
+def fold_all(reducer, results):
+    state = reducer.fold_init()
+    for result in results:
+        state = reducer.fold(state, result)
+    return reducer.fold_finalize(state)
+
+
+class TestStreamingReduce(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = datasets.make_classification(n_samples=20,
+                                                      n_features=5,
+                                                      n_informative=2,
+                                                      random_state=1)
+
+    def test_reducers_fold(self):
+        random_state = np.random.RandomState(0)
+        results = [Result(key="SVC", **{
+            "y/test/pred": random_state.randint(2, size=5),
+            "y/test/true": random_state.randint(2, size=5),
+            "y/train/pred": random_state.randint(2, size=15)})
+            for i in xrange(4)]
+        for keep in (False, True):
+            reducer = ClassificationReport(keep=keep)
+            self.assertTrue(isequal(reducer.reduce(Result.stack(*results)),
+                                    fold_all(reducer, results)))
+        results = [Result(key="SVC", score_a=random_state.rand(),
+                          score_b=random_state.rand(3), other=i)
+                   for i in xrange(10)]
+        for keep in (False, True):
+            reducer = PvalPerms(keep=keep)
+            self.assertTrue(isequal(reducer.reduce(Result.stack(*results)),
+                                    fold_all(reducer, results)))
+
+    def test_reduce_iter(self):
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.run(X=self.X, y=self.y)
+        reduced = wf.reduce()
+        results = wf.reduce_iter()
+        self.assertFalse(isinstance(results, list))
+        self.assertTrue(same_results(reduced, results))
+        # The stored results are left unchanged
+        self.assertTrue(same_results(reduced, wf.reduce()))
+
+    def test_partials(self):
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=self.X, y=self.y)
+        key = wf.children[1].get_key()
+        partials = {key: list(wf.children[1].reduce_iter())}
+        self.assertTrue(same_results(wf.reduce(),
+                                     wf.reduce_iter(partials=partials)))
+        for result in partials[key]:
+            result["y/test/pred"] = 1 - result["y/test/pred"]
+        self.assertFalse(same_results(wf.reduce(),
+                                      wf.reduce_iter(partials=partials)))
+
+    def test_parallel_reduce(self):
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=5,
+                   random_state=0)
+        wf.run(X=self.X, y=self.y)
+        self.assertTrue(same_results(wf.reduce(),
+                                     parallel_reduce(wf, num_processes=3)))
+
+    def test_reduce_cache(self):
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.run(X=self.X, y=self.y)
+        reduced = wf.reduce()
+        wf.reduce_cache = cache = ReduceCache()
+        self.assertTrue(same_results(reduced, wf.reduce()))
+        self.assertEqual((cache.hits, cache.misses), (0, 19))
+        self.assertTrue(same_results(reduced, wf.reduce()))
+        self.assertEqual((cache.hits, cache.misses), (1, 19))
+        # Modifying the results of a reduce does not change the cache
+        for reduced_modified in (wf.reduce(), wf.reduce()):
+            for result in reduced_modified:
+                for k in result.keys():
+                    if k != "key" and isinstance(result[k], np.ndarray):
+                        result[k] *= 0
+                result["extra"] = 1
+            self.assertFalse(same_results(reduced, reduced_modified))
+        self.assertTrue(same_results(reduced, wf.reduce()))
+        self.assertEqual((cache.hits, cache.misses), (4, 19))
+        # Save again the results of a leaf: only its path to the root is
+        # reduced again
+        leaf = wf.get_leftmost_leaf()
+        results = copy.deepcopy(leaf.load_results())
+        for result in results:
+            result["y/test/pred"] = 1 - result["y/test/pred"]
+        leaf.save_results(results)
+        reduced_cached = wf.reduce()
+        self.assertEqual((cache.hits, cache.misses), (7, 24))
+        wf.reduce_cache = None
+        self.assertTrue(same_results(wf.reduce(), reduced_cached))
+        self.assertFalse(same_results(reduced, reduced_cached))
+
+    def test_reduce_cache_conf(self):
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=self.X, y=self.y)
+        reduce_cache = conf.REDUCE_CACHE
+        conf.REDUCE_CACHE = True
+        try:
+            reduced = wf.reduce()
+            self.assertTrue(isinstance(wf.reduce_cache, ReduceCache))
+            self.assertTrue(same_results(reduced, wf.reduce()))
+            self.assertEqual(wf.reduce_cache.hits, 1)
+        finally:
+            conf.REDUCE_CACHE = reduce_cache
+
+if __name__ == '__main__':
+    unittest.main()
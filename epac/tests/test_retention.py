@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Test result retention policies.
+"""
+
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Perms, Methods, LocalEngine
+from epac import RetentionPolicy, Result
+from epac.configuration import conf
+from epac.tests.utils import isequal
+
+
+class TestRetentionPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = datasets.make_classification(n_samples=20,
+                                                      n_features=5,
+                                                      n_informative=2,
+                                                      random_state=1)
+
+    def get_workflow(self):
+        return Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+                     n_perms=3, random_state=0)
+
+    def test_leaves_are_trimmed(self):
+        wf = self.get_workflow()
+        wf.retention_policy = RetentionPolicy()
+        wf.run(X=self.X, y=self.y)
+        key_train = key_test = 'y' + conf.SEP
+        key_train += conf.TRAIN + conf.SEP + conf.PREDICTION
+        key_test += conf.TEST + conf.SEP + conf.PREDICTION
+        for leaf in wf.walk_leaves():
+            result = leaf.load_results().values()[0]
+            self.assertFalse(key_train in result)
+            self.assertEqual(result[key_test].dtype, np.int8)
+
+    def test_downcast_labels_only(self):
+        policy = RetentionPolicy()
+        r = Result("SVC", **{"y/test/true": np.array([1, 0]),
+                             "indices": np.array([3, 7])})
+        r = policy.apply(r)
+        self.assertEqual(r["y/test/true"].dtype, np.int8)
+        self.assertEqual(r["indices"].dtype, np.array([3, 7]).dtype)
+        r = RetentionPolicy(downcast_keys=["^indices$"]).apply(
+            Result("SVC", **{"indices": np.array([3, 7])}))
+        self.assertEqual(r["indices"].dtype, np.int8)
+        # The default drop list is not shared between policies
+        policy.drop.append("^indices$")
+        self.assertEqual(len(RetentionPolicy().drop), 1)
+
+    def test_reduce_unchanged(self):
+        wf_all = self.get_workflow()
+        wf_all.run(X=self.X, y=self.y)
+        wf_trimmed = self.get_workflow()
+        wf_trimmed.retention_policy = RetentionPolicy()
+        wf_trimmed.run(X=self.X, y=self.y)
+        self.assertTrue(isequal(wf_all.reduce(), wf_trimmed.reduce()))
+
+    def test_local_engine(self):
+        wf = self.get_workflow()
+        engine = LocalEngine(wf, num_processes=2,
+                             retention_policy=RetentionPolicy(downcast=False))
+        wf = engine.run(X=self.X, y=self.y)
+        leaf = wf.get_leftmost_leaf()
+        self.assertTrue(leaf.get_retention_policy() is not None)
+        result = leaf.load_results().values()[0]
+        self.assertEqual(len(result), 3)
+
+if __name__ == '__main__':
+    unittest.main()
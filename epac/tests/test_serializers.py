@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Test the serializers used by the stores.
+"""
+
+import os
+import shutil
+import resource
+import tempfile
+import unittest
+import numpy as np
+from epac import Result, ResultSet, StoreFs
+from epac.configuration import conf
+from epac.stores import epac_joblib
+from epac import serializers
+
+
+class ReprSerializer(serializers.Serializer):
+    suffix = conf.STORE_FS_PICKLE_SUFFIX
+
+    def dump(self, obj, filepath, compress=False):
+        outfile = open(filepath, "wb")
+        outfile.write("REPR" + repr(obj))
+        outfile.close()
+
+    def load(self, filepath, mmap_mode="r"):
+        return complex(open(filepath, "rb").read()[4:])
+
+    def is_file_format(self, head):
+        return head.startswith("REPR")
+
+
+class TestSerializers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dispatch(self):
+        store = StoreFs(self.tmp_dir)
+        store.save("plain", dict(a=[1, 2], b="c"))
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.tmp_dir, "plain" + conf.STORE_FS_JSON_SUFFIX)))
+        y = np.arange(10)
+        store.save("results", ResultSet(Result("SVC", y=y)))
+        filepath = os.path.join(self.tmp_dir,
+                                "results" + conf.STORE_FS_PICKLE_SUFFIX)
+        self.assertTrue(isinstance(serializers.get_file_serializer(filepath),
+                                   serializers.PickleSerializer))
+        self.assertEqual(store.load("plain"), dict(a=[1, 2], b="c"))
+        self.assertTrue(np.all(store.load("results")["SVC"]["y"] == y))
+
+    def test_no_depth_limit(self):
+        X = np.random.random((100, 10))
+        nested = X
+        for i in xrange(30):
+            nested = [nested]
+        filepath = os.path.join(self.tmp_dir, "nested")
+        serializers.dump(dict(nested=nested), filepath)
+        loaded = serializers.load(filepath)["nested"]
+        for i in xrange(30):
+            loaded = loaded[0]
+        self.assertTrue(np.all(loaded == X))
+
+    def test_epac_joblib_files(self):
+        conf.MEMM_THRESHOLD = 100
+        X = np.random.random((100, 10))
+        filepath = os.path.join(self.tmp_dir, "old" +
+                                conf.STORE_FS_PICKLE_SUFFIX)
+        epac_joblib.dump(ResultSet(Result("SVC", X=X)), filepath)
+        loaded = StoreFs(self.tmp_dir).load("old")
+        self.assertTrue(np.all(loaded["SVC"]["X"] == X))
+
+    def test_dump_over_memory_mapped_file(self):
+        X = np.random.random((100, 10))
+        store = StoreFs(self.tmp_dir)
+        store.save("results", ResultSet(Result("SVC", X=X)), protocol="bin")
+        X_mapped = store.load("results")["SVC"]["X"]
+        self.assertFalse(X_mapped.flags.owndata)
+        self.assertFalse(X_mapped.flags.writeable)
+        # Saving again while X_mapped maps the file, and from X_mapped
+        store.save("results", ResultSet(Result("SVC", X=X_mapped, Y=-X)),
+                   protocol="bin")
+        self.assertTrue(np.all(X_mapped == X))
+        loaded = store.load("results")["SVC"]
+        self.assertTrue(np.all(loaded["X"] == X))
+        self.assertTrue(np.all(loaded["Y"] == -X))
+        self.assertEqual(os.listdir(self.tmp_dir),
+                         ["results" + conf.STORE_FS_PICKLE_SUFFIX])
+
+    def test_many_arrays(self):
+        # The memory mapped arrays of a file share one file descriptor
+        arrays = [np.random.random(512) for i in xrange(2000)]
+        store = StoreFs(self.tmp_dir)
+        store.save("results", ResultSet(Result("SVC", arrays=arrays)),
+                   protocol="bin")
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(512, soft), hard))
+        try:
+            loaded = store.load("results")["SVC"]["arrays"]
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.assertEqual(len(loaded), len(arrays))
+        self.assertFalse(loaded[0].flags.owndata)
+        for i in xrange(len(arrays)):
+            self.assertTrue(np.all(loaded[i] == arrays[i]))
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, serializers.Serializer)
+
+    def test_register(self):
+        serializers.register_serializer(ReprSerializer(), complex)
+        filepath = os.path.join(self.tmp_dir, "complex")
+        self.assertTrue(isinstance(serializers.dump(1 + 2j, filepath),
+                                   ReprSerializer))
+        self.assertEqual(serializers.load(filepath), 1 + 2j)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,11 +5,27 @@ Created on Thu Oct 10 15:55:05 2013
 @author: jinpeng.li@cea.fr
 """
 
+import os
+import shutil
+import tempfile
+import pickle
 import unittest
 import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from epac import CV, Perms, Methods, Result, ResultSet
+from epac import MapperSubtrees
 from epac.configuration import conf
 from epac.stores import epac_joblib
 from epac.stores import TagObject
+from epac.stores import StoreMem, StoreHybrid, StoreFs, StorePack
+from epac.stores import StoreSQLite, StoreShards
+from epac.map_reduce.inputs import NodesInput
+from epac.map_reduce.split_input import SplitNodesInput
+from epac.map_reduce.engine import LocalEngine
+from epac.stores import save_tree, load_tree, assemble_tree
+from epac.stores import deep_nbytes
+from epac.workflow.base import key_pop
 
 
 class TestStore(unittest.TestCase):
@@ -25,5 +41,286 @@ class TestStore(unittest.TestCase):
         self.assertTrue(np.all(dict_data2["1"] == npdata1))
         self.assertTrue(np.all(dict_data2["2"] == npdata2))
 
+    def test_store_mem_dedup(self):
+        store = StoreMem(dedup=True)
+        y = np.arange(10)
+        store.save("a", ResultSet(Result("a", y=y, z=np.ones(3))))
+        store.save("b", ResultSet(Result("b", y=y.copy(), z=np.zeros(3))))
+        self.assertTrue(store.load("a")["a"]["y"] is store.load("b")["b"]["y"])
+        self.assertFalse(store.load("a")["a"]["z"] is
+                         store.load("b")["b"]["z"])
+        # Off by default
+        store = StoreMem()
+        store.save("a", ResultSet(Result("a", y=y)))
+        store.save("b", ResultSet(Result("b", y=y.copy())))
+        self.assertFalse(store.load("a")["a"]["y"] is
+                         store.load("b")["b"]["y"])
+
+    def test_epac_joblib_dedup(self):
+        conf.MEMM_THRESHOLD = 100
+        npdata = np.random.random(size=(100, 5))
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, "dedup")
+        epac_joblib.dump({"1": npdata, "2": npdata}, filename)
+        dict_data = epac_joblib.load(filename)
+        self.assertTrue(dict_data["1"] is dict_data["2"])
+        self.assertTrue(np.all(dict_data["1"] == npdata))
+        shutil.rmtree(tmp_dir)
+
+    def test_save_tree_dedup(self):
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        key_true = "y" + conf.SEP + conf.TEST + conf.SEP + conf.TRUE
+        results = [leaf.load_results().values()[0]
+                   for leaf in wf.walk_leaves()]
+        self.assertTrue(results[0][key_true] is results[1][key_true])
+        reduced = wf.reduce()
+        tmp_dir = tempfile.mkdtemp()
+        save_tree(wf, tmp_dir)
+        wf_loaded = load_tree(tmp_dir)
+        results = [leaf.load_results().values()[0]
+                   for leaf in wf_loaded.walk_leaves()]
+        self.assertTrue(results[0][key_true] is results[1][key_true])
+        self.assertEqual(repr(reduced), repr(wf_loaded.reduce()))
+        # The results of the leaves are saved in the stores of their parents
+        store_keys = sorted([key for key in StoreFs(tmp_dir).keys()
+                             if key != conf.STORE_EXECUTION_TREE_PREFIX])
+        self.assertEqual(store_keys,
+                         sorted([leaf.parent.get_key() + conf.SEP +
+                                 conf.STORE_STORE_PREFIX
+                                 for leaf in wf.walk_leaves()][::2]))
+        shutil.rmtree(tmp_dir)
+        # Trees saved with one store by node are loaded alike
+        tmp_dir = tempfile.mkdtemp()
+        store_fs = StoreFs(tmp_dir)
+        stores = dict()
+        for node in wf_loaded.walk_true_nodes():
+            if node.store:
+                for key in node.store.keys():
+                    node_key, _ = key_pop(key)
+                    stores.setdefault(node_key, StoreMem()).save(
+                        key, node.store.load(key))
+                node.store = None
+        self.assertEqual(len(stores), 4)
+        store_fs.save(key=conf.STORE_EXECUTION_TREE_PREFIX, obj=wf_loaded,
+                      protocol="bin")
+        for node_key in stores:
+            store_fs.save(key=node_key + conf.SEP + conf.STORE_STORE_PREFIX,
+                          obj=stores[node_key], protocol="bin")
+        self.assertEqual(repr(reduced), repr(load_tree(tmp_dir).reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_store_hybrid(self):
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        budget = conf.STORE_MEM_BUDGET
+        try:
+            conf.STORE_MEM_BUDGET = 1
+            wf_hybrid = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+            wf_hybrid.run(X=X, y=y)
+        finally:
+            conf.STORE_MEM_BUDGET = budget
+        store = wf_hybrid.store
+        self.assertTrue(isinstance(store, StoreHybrid))
+        self.assertEqual(len(store.dict.mem_keys()), 1)
+        self.assertEqual(len(store.dict), 4)
+        self.assertEqual(repr(reduced), repr(wf_hybrid.reduce()))
+        # Pickling does not reload the evicted results. Each unpickled
+        # store owns the files of its evicted results
+        data = pickle.dumps(store)
+        store_copy = pickle.loads(data)
+        spill_dir = store_copy.dict._spill_dir
+        self.assertTrue(os.path.isdir(spill_dir))
+        del store_copy
+        self.assertFalse(os.path.isdir(spill_dir))
+        store_copy = pickle.loads(data)
+        self.assertEqual(store_copy.dict.mem_keys(), store.dict.mem_keys())
+        self.assertEqual(len(store_copy.dict), 4)
+        for key in store.keys():
+            result = store_copy.load(key).values()[0]
+            for k in result:
+                self.assertFalse(isinstance(result[k], np.memmap))
+            self.assertEqual(repr(result), repr(store.load(key).values()[0]))
+        del store_copy
+        tmp_dir = tempfile.mkdtemp()
+        save_tree(wf_hybrid, tmp_dir)
+        self.assertEqual(repr(reduced), repr(load_tree(tmp_dir).reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_contains_keys(self):
+        tmp_dir = tempfile.mkdtemp()
+        for store in (StoreMem(), StoreHybrid(budget=1), StoreFs(tmp_dir),
+                      StorePack(os.path.join(tmp_dir, "pack", "results")),
+                      StoreSQLite(os.path.join(tmp_dir, "db", "results"))):
+            store.save("a/b", dict(a=1))
+            store.save("a/c", np.ones(10))
+            self.assertTrue(store.contains("a/b"))
+            self.assertFalse(store.contains("a"))
+            self.assertEqual(sorted(store.keys()), ["a/b", "a/c"])
+        # Index built at open and refreshed on demand
+        store = StoreFs(tmp_dir)
+        self.assertEqual(sorted(store.keys()), ["a/b", "a/c"])
+        StoreFs(tmp_dir).save("d", dict(d=1))
+        self.assertFalse(store.contains("d"))
+        store.refresh()
+        self.assertTrue(store.contains("d"))
+        shutil.rmtree(tmp_dir)
+
+    def test_store_pack(self):
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, "results.pack")
+        store = StorePack(filepath)
+        arr = np.random.random(size=(100, 5))
+        store.save("a", dict(x=arr, y=arr, z=np.arange(3)))
+        store.save("b", "first")
+        store.save("b", "second")
+        loaded = StorePack(filepath).load("a")
+        self.assertTrue(np.all(loaded["x"] == arr))
+        self.assertTrue(loaded["x"] is loaded["y"])
+        self.assertEqual(loaded["x"].ctypes.data % StorePack.ALIGN, 0)
+        self.assertEqual(store.load("b"), "second")
+        size = store.nbytes()[0]
+        store.compact()
+        self.assertTrue(store.nbytes()[0] < size)
+        self.assertEqual(StorePack(filepath).load("b"), "second")
+        self.assertTrue(np.all(store.load("a")["x"] == arr))
+        # A whole tree
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        filepath = os.path.join(tmp_dir, "tree.pack")
+        wf.save_tree(store=StorePack(filepath))
+        self.assertEqual(repr(reduced), repr(load_tree(filepath).reduce()))
+        # Stores loaded in a node whose store is not a StoreMem
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        loaded = {conf.STORE_EXECUTION_TREE_PREFIX: wf,
+                  wf.get_key() + conf.SEP + conf.STORE_STORE_PREFIX:
+                  wf.store}
+        wf.store = StorePack(os.path.join(tmp_dir, "root.pack"))
+        wf = assemble_tree(loaded)
+        self.assertTrue(isinstance(wf.store, StorePack))
+        self.assertEqual(repr(reduced), repr(wf.reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_store_sqlite(self):
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, "results.db")
+        store = StoreSQLite(filepath, batch_size=2, array_min_nbytes=100)
+        arr = np.random.random(size=(100, 5))
+        store.save("a/b", dict(x=arr, y=arr.copy()))
+        # pending objects are readable
+        self.assertTrue(StoreSQLite(filepath).load("a/b") is None)
+        self.assertTrue(np.all(store.load("a/b")["x"] == arr))
+        store.save("a/c", "c")
+        self.assertEqual(StoreSQLite(filepath).load("a/c"), "c")
+        self.assertEqual(sorted(store.load("a").keys()), ["b", "c"])
+        # identical arrays are written once
+        self.assertEqual(len(os.listdir(store.arrays_dirpath)), 1)
+        # Processes write the results in the same database
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        filepath = os.path.join(tmp_dir, "tree.db")
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        engine = LocalEngine(wf, num_processes=2, store=StoreSQLite(filepath))
+        wf = engine.run(X=X, y=y)
+        self.assertEqual(len(StoreSQLite(filepath).keys()), 4)
+        self.assertEqual(repr(reduced), repr(wf.reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_store_shards(self):
+        X, y = datasets.make_classification(n_samples=20, n_features=5,
+                                            n_informative=2, random_state=1)
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.run(X=X, y=y)
+        reduced = wf.reduce()
+        # The jobs of epac_mapper --shards
+        tmp_dir = tempfile.mkdtemp()
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        save_tree(wf, tmp_dir)
+        tree_files = sorted(StoreFs(tmp_dir).keys())
+        nodes_inputs = SplitNodesInput(wf, num_processes=2).split(
+            NodesInput(wf.get_key()))
+        for i, nodes_input in enumerate(nodes_inputs):
+            store_fs = StoreFs(tmp_dir)
+            shard_store = StorePack(os.path.join(
+                tmp_dir, conf.STORE_SHARDS_DIR, "%i.job.pack" % i))
+            mapper = MapperSubtrees(Xy=dict(X=X, y=y),
+                                    tree_root=store_fs.load(),
+                                    store_fs=store_fs,
+                                    shard_store=shard_store)
+            mapper.map(nodes_input)
+        # The tree is not saved again, the shards are not seen by StoreFs
+        self.assertEqual(tree_files, sorted(StoreFs(tmp_dir).keys()))
+        shards = StoreShards(os.path.join(tmp_dir, conf.STORE_SHARDS_DIR))
+        self.assertEqual(len(shards.keys()), 3 * 2 * 2)
+        wf = load_tree(tmp_dir)
+        self.assertTrue(isinstance(wf.store, StoreShards))
+        self.assertEqual(repr(reduced), repr(wf.reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_deep_nbytes(self):
+        y = np.zeros(1000)
+        resident, mapped = deep_nbytes([y, y[:10], dict(y=y[5:])])
+        self.assertTrue(y.nbytes < resident < 2 * y.nbytes)
+        self.assertEqual(mapped, 0)
+        tmp_dir = tempfile.mkdtemp()
+        filepath = os.path.join(tmp_dir, "y.npy")
+        np.save(filepath, y)
+        y_map = np.load(filepath, mmap_mode="r")
+        resident, mapped = deep_nbytes([y_map, y_map[:10]])
+        self.assertTrue(resident < y.nbytes)
+        self.assertEqual(mapped, os.path.getsize(filepath))
+        del y_map
+        shutil.rmtree(tmp_dir)
+        # Objects already seen are not counted again
+        seen = set()
+        self.assertTrue(deep_nbytes(y, seen)[0] >= y.nbytes)
+        self.assertTrue(deep_nbytes(y[:10], seen)[0] < y.nbytes)
+
+    def test_memory_stats(self):
+        X, y = datasets.make_classification(n_samples=100, n_features=500,
+                                            n_informative=2, random_state=1)
+        wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        wf.run(X=X, y=y)
+        stats = dict([(row[0], row[1:]) for row in
+                      wf.memory_stats(group_by="class")])
+        count, resident, mapped, estimator, store, cache, other = \
+            stats["SVC"]
+        # 2 nodes and their results in 2 folds
+        self.assertEqual(count, 6)
+        self.assertEqual(resident, estimator + store + cache + other)
+        svc = wf.get_node("CV/CV(nb=1)/Methods/SVC(C=1)").wrapped_node
+        self.assertTrue(estimator >= svc.support_vectors_.nbytes)
+        results_nbytes = deep_nbytes(wf.store.dict)[0]
+        self.assertTrue(0 < store < results_nbytes)
+        # Deep sizes in stats
+        sizes = dict([(name, size) for name, count, size in
+                      wf.stats(group_by="class", sort_by="size")])
+        self.assertTrue(sizes["Estimator"] >= svc.support_vectors_.nbytes)
+        # Spilled results are not in memory
+        budget = conf.STORE_MEM_BUDGET
+        try:
+            conf.STORE_MEM_BUDGET = 1
+            wf_hybrid = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+            wf_hybrid.run(X=X, y=y)
+        finally:
+            conf.STORE_MEM_BUDGET = budget
+        stats = dict([(row[0], row[1:]) for row in
+                      wf_hybrid.memory_stats(group_by="class")])
+        self.assertEqual(stats["SVC"][0], 2 + 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Test the declarative specification of the trees.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn import datasets
+from sklearn.svm import SVC
+from sklearn.feature_selection import SelectKBest
+from epac import CV, Perms, Methods, Pipe, ColumnSplitter, CVBestSearchRefit
+from epac import RetentionPolicy, StoreFs, StorePack, MapperSubtrees, conf
+from epac.map_reduce.inputs import NodesInput
+from epac.map_reduce.split_input import SplitNodesInput
+from epac.stores import load_tree
+from epac.workflow.spec import tree_to_spec, tree_from_spec
+from epac.workflow.spec import save_tree_spec, load_tree_spec
+from epac.tests.utils import comp_2wf_reduce_res
+
+
+def leaves_keys(tree):
+    return [leaf.get_key() for leaf in tree.walk_leaves()]
+
+
+def to_json(tree):
+    return json.loads(json.dumps(tree_to_spec(tree)))
+
+
+class TestTreeSpec(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = datasets.make_classification(n_samples=20,
+                                                      n_features=6,
+                                                      n_informative=2,
+                                                      random_state=1)
+
+    def trees(self):
+        return [Perms(CV(Methods(Pipe(SelectKBest(k=2), SVC()),
+                                 Pipe(SelectKBest(k=3), SVC()),
+                                 SVC(C=3)), n_folds=2),
+                      n_perms=2, random_state=0),
+                ColumnSplitter(Methods(SVC(C=1), SVC(C=10)),
+                               dict(X=[0, 0, 1, 1, 2, 2])),
+                CV(CVBestSearchRefit(Methods(SVC(C=1), SVC(C=2)),
+                                     n_folds=2), n_folds=2)]
+
+    def test_round_trip(self):
+        for tree in self.trees():
+            tree.retention_policy = RetentionPolicy(downcast=False)
+            tree_spec = tree_from_spec(to_json(tree))
+            self.assertEqual(leaves_keys(tree), leaves_keys(tree_spec))
+            self.assertEqual(tree_spec.retention_policy.downcast, False)
+            tree.run(X=self.X, y=self.y)
+            tree_spec.run(X=self.X, y=self.y)
+            self.assertTrue(comp_2wf_reduce_res(tree, tree_spec))
+
+    def test_subtrees(self):
+        for tree in self.trees():
+            spec = to_json(tree)
+            key = leaves_keys(tree)[-1]
+            subtrees = tree_from_spec(spec, keys=[key])
+            self.assertTrue(key in leaves_keys(subtrees))
+            tree.run(X=self.X, y=self.y)
+            mapper = MapperSubtrees(Xy=dict(X=self.X, y=self.y),
+                                    tree_root=subtrees)
+            mapper.map(NodesInput(key))
+            self.assertTrue(comp_2wf_reduce_res(tree.get_node(key),
+                                                subtrees.get_node(key)))
+        tree = Perms(Methods(SVC(C=1), SVC(C=3), SVC(C=10)), n_perms=2)
+        subtrees = tree_from_spec(to_json(tree),
+                                  keys=["Perms/Perm(nb=1)/Methods/SVC(C=3)"])
+        self.assertEqual(leaves_keys(subtrees),
+                         ["Perms/Perm(nb=0)/Methods/SVC(C=3)",
+                          "Perms/Perm(nb=1)/Methods/SVC(C=3)"])
+        self.assertRaises(ValueError, tree_from_spec, to_json(tree),
+                          keys=["CV/CV(nb=0)"])
+
+    def test_jobs(self):
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.run(X=self.X, y=self.y)
+        reduced = wf.reduce()
+        # The jobs of epac_mapper --shards, with a tree specification
+        tmp_dir = tempfile.mkdtemp()
+        wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2), n_perms=3,
+                   random_state=0)
+        wf.save_tree(StoreFs(tmp_dir))
+        spec_path = os.path.join(tmp_dir, conf.STORE_TREE_SPEC)
+        save_tree_spec(wf, spec_path)
+        nodes_inputs = SplitNodesInput(wf, num_processes=2).split(
+            NodesInput(wf.get_key()))
+        for i, nodes_input in enumerate(nodes_inputs):
+            shard_store = StorePack(os.path.join(
+                tmp_dir, conf.STORE_SHARDS_DIR, "%i.job.pack" % i))
+            mapper = MapperSubtrees(
+                Xy=dict(X=self.X, y=self.y),
+                tree_root=load_tree_spec(spec_path,
+                                         keys=nodes_input.values()),
+                store_fs=StoreFs(tmp_dir),
+                shard_store=shard_store)
+            mapper.map(nodes_input)
+        self.assertEqual(repr(reduced), repr(load_tree(tmp_dir).reduce()))
+        shutil.rmtree(tmp_dir)
+
+    def test_not_described(self):
+        tree = CV(SVC(), random_state=np.random.RandomState(0))
+        self.assertRaises(ValueError, tree_to_spec, tree)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,27 +7,16 @@ Created on Thu Mar 14 16:13:26 2013
 import numpy as np
 import os
 import csv
-import sys
+import collections
 
 from epac.configuration import conf
 from epac.workflow.base import key_push, key_pop
 from epac.map_reduce.results import ResultSet
+from epac.compression import COMPRESSED_ARRAY_SUFFIX
+from epac.compression import is_compressible
+from epac.compression import save_compressed, load_compressed
 import json
 
-# Import dill if installed and recent enough, otherwise falls back to pickle
-from distutils.version import LooseVersion as V
-try:
-    errmsg = "Falling back to pickle. "\
-             "There may be problem when running soma-workflow on cluster "\
-             "using EPAC\n"
-    import dill as pickle
-    if V(pickle.__version__) < V("0.2a"):
-        sys.stderr.write("warning: dill version is too old to use. " + errmsg)
-except ImportError:
-    import pickle
-    sys.stderr.write("warning: Cannot import dill. " + errmsg)
-
-
 def estimate_dataset_size(**Xy):
     '''
 
@@ -548,11 +537,26 @@ def save_dataset_path(dataset_dir, **Xy_path):
     file_dict_index.close()
 
 
-def save_dataset(dataset_dir, **Xy):
+def save_dataset(dataset_dir, compress=False, column_groups=None, **Xy):
     '''Save a dictionary to a directory
     Save a dictionary to a directory. This dictionary may contain
     numpy array, numpy.memmap
 
+    Parameters
+    ----------
+    dataset_dir: str
+        the directory where you want to save your dataset
+
+    compress: boolean
+        If True, compressible arrays are saved compressed (see
+        epac.compression), they are no more memory mapped by load_dataset.
+
+    column_groups: dictionary
+        Group index of each column, for the 2D arrays to be saved by column
+        groups, same as the indices_of_groups of a ColumnSplitter. Each
+        group is saved in a file of its own, load_dataset returns a
+        ColumnBlockArray which only reads the groups that are indexed.
+
     Example
     -------
     from sklearn import datasets
@@ -566,14 +570,185 @@ def save_dataset(dataset_dir, **Xy):
     '''
     if not os.path.exists(dataset_dir):
         os.makedirs(dataset_dir)
+    if column_groups is None:
+        column_groups = dict()
     path_Xy = dict()
     for key in Xy:
-        filepath = os.path.join(dataset_dir, key + ".npy")
-        np.save(filepath, Xy[key])
-        path_Xy[key] = filepath
+        filepath = os.path.join(dataset_dir, key)
+        if key in column_groups and np.ndim(Xy[key]) == 2:
+            path_Xy[key] = save_column_blocks(filepath, Xy[key],
+                                              column_groups[key],
+                                              compress=compress)
+        else:
+            path_Xy[key] = _save_array(filepath, Xy[key], compress)
     save_dataset_path(dataset_dir, **path_Xy)
 
 
+def _save_array(filepath, arr, compress=False):
+    """Save arr in filepath + ".npy" (or compressed), return the path"""
+    if compress and is_compressible(arr):
+        filepath += COMPRESSED_ARRAY_SUFFIX
+        save_compressed(filepath, arr)
+    else:
+        filepath += ".npy"
+        np.save(filepath, arr)
+    return filepath
+
+
+def _load_array(filepath, mmap_mode="auto"):
+    """Load an array saved by _save_array"""
+    if filepath.endswith(COMPRESSED_ARRAY_SUFFIX):
+        return load_compressed(filepath)
+    elif not mmap_mode:
+        return np.load(filepath)
+    elif (not "auto" in mmap_mode) and mmap_mode:
+        return np.load(filepath, mmap_mode)
+    elif ("auto" in mmap_mode) and is_need_mem(filepath):
+        # read-only: pages are shared between the processes
+        return np.load(filepath, "r")
+    return np.load(filepath)
+
+
+def save_column_blocks(filepath, arr, groups, compress=False):
+    """Save the 2D array arr by column groups: the columns of each group
+    are saved contiguously in a file of their own, an index (JSON) is
+    saved in filepath + conf.COLUMN_BLOCKS_SUFFIX. Return the path of the
+    index, see ColumnBlockArray.
+
+    Parameters
+    ----------
+    groups: list
+        Group index of each column of arr.
+    """
+    groups = np.asarray(groups)
+    if groups.shape != (arr.shape[1],):
+        raise ValueError("%i group indices given for %i columns" %
+                         (groups.shape[0], arr.shape[1]))
+    blocks = list()
+    for i, group in enumerate(np.unique(groups)):
+        columns = np.nonzero(groups == group)[0]
+        block_filepath = _save_array("%s.block-%i" % (filepath, i),
+                                     arr[:, columns], compress)
+        blocks.append(dict(columns=columns.tolist(),
+                           filepath=block_filepath))
+    index_filepath = filepath + conf.COLUMN_BLOCKS_SUFFIX
+    index_file = open(index_filepath, "w")
+    json.dump(dict(shape=list(arr.shape), dtype=np.dtype(arr.dtype).str,
+                   blocks=blocks), index_file)
+    index_file.close()
+    return index_filepath
+
+
+class ColumnBlockArray(object):
+    """2D array saved by column groups (see save_column_blocks).
+
+    Selecting columns, X[:, columns], only loads the blocks that hold those
+    columns. A block is returned as is (memory mapped if so) when the
+    columns are exactly the ones of the block, which is what a
+    ColumnSplitter with the same groups asks for. Any other use loads the
+    whole array (np.asarray).
+
+    Example
+    -------
+    >>> import os, tempfile
+    >>> import numpy as np
+    >>> from epac.utils import save_column_blocks, ColumnBlockArray
+    >>> X = np.arange(20).reshape((4, 5))
+    >>> filepath = os.path.join(tempfile.mkdtemp(), "X")
+    >>> index_filepath = save_column_blocks(filepath, X, [0, 1, 0, 1, 2])
+    >>> X_blocks = ColumnBlockArray(index_filepath)
+    >>> X_blocks.shape
+    (4, 5)
+    >>> X_blocks[:, [1, 3]].tolist()
+    [[1, 3], [6, 8], [11, 13], [16, 18]]
+    >>> X_blocks.loaded_blocks()
+    [1]
+    >>> np.all(np.asarray(X_blocks) == X)
+    True
+    """
+    def __init__(self, index_filepath, mmap_mode="auto"):
+        self.index_filepath = index_filepath
+        self.mmap_mode = mmap_mode
+        index_file = open(index_filepath, "r")
+        index = json.load(index_file)
+        index_file.close()
+        self.shape = tuple(index["shape"])
+        self.dtype = np.dtype(str(index["dtype"]))
+        self.ndim = len(self.shape)
+        self.block_filepaths = [str(b["filepath"]) for b in index["blocks"]]
+        # block and position in the block of each column
+        self._column_block = np.zeros(self.shape[1], dtype=int)
+        self._column_pos = np.zeros(self.shape[1], dtype=int)
+        for i, block in enumerate(index["blocks"]):
+            self._column_block[block["columns"]] = i
+            self._column_pos[block["columns"]] = \
+                np.arange(len(block["columns"]))
+        self._blocks = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_blocks"] = dict()
+        return state
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def loaded_blocks(self):
+        """Indices of the blocks read so far"""
+        return sorted(self._blocks.keys())
+
+    def get_block(self, i):
+        if not i in self._blocks:
+            self._blocks[i] = _load_array(self.block_filepaths[i],
+                                          self.mmap_mode)
+        return self._blocks[i]
+
+    def take_columns(self, columns):
+        """Return the 2D array of the given columns (list of indices or
+        boolean mask)"""
+        columns = np.asarray(columns)
+        if columns.dtype == bool:
+            columns = np.nonzero(columns)[0]
+        columns = columns.astype(int) % self.shape[1]
+        blocks = self._column_block[columns]
+        positions = self._column_pos[columns]
+        if columns.size and np.all(blocks == blocks[0]):
+            block = self.get_block(blocks[0])
+            if np.array_equal(positions, np.arange(block.shape[1])):
+                return block
+        arr = np.empty((self.shape[0], columns.size), dtype=self.dtype)
+        for i in np.unique(blocks):
+            mask = blocks == i
+            arr[:, mask] = self.get_block(i)[:, positions[mask]]
+        return arr
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple) and len(item) == 2:
+            rows, columns = item
+            if isinstance(columns, slice):
+                columns = np.arange(self.shape[1])[columns]
+            if np.isscalar(columns):
+                arr = self.take_columns([columns])[:, 0]
+            else:
+                arr = self.take_columns(columns)
+            if isinstance(rows, slice) and rows == slice(None):
+                return arr
+            return arr[rows]
+        return np.asarray(self)[item]
+
+    def __array__(self, dtype=None):
+        arr = self.take_columns(np.arange(self.shape[1]))
+        return arr if dtype is None else arr.astype(dtype)
+
+    def __repr__(self):
+        return "ColumnBlockArray(%s, shape=%s)" % (self.index_filepath,
+                                                   self.shape)
+
+
 def is_need_mem(filepath):
     filesize = os.path.getsize(filepath)
     if filesize > conf.MEMM_THRESHOLD:
@@ -581,7 +756,63 @@ def is_need_mem(filepath):
     return False
 
 
-def load_dataset(dataset_dir, mmap_mode="auto"):
+def _load_dataset_file(filepath, mmap_mode="auto"):
+    """Load an entry of a dataset saved by save_dataset"""
+    if filepath.endswith(conf.COLUMN_BLOCKS_SUFFIX):
+        return ColumnBlockArray(filepath, mmap_mode)
+    return _load_array(filepath, mmap_mode)
+
+
+class LazyDataset(collections.Mapping):
+    """Read-only mapping of a dataset saved by save_dataset: each entry is
+    loaded on first access.
+
+    Note that f(**dataset) accesses every entry, select the keys first.
+
+    Example
+    -------
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from epac.utils import save_dataset, load_dataset
+    >>> dataset_dir = tempfile.mkdtemp()
+    >>> save_dataset(dataset_dir, X=np.ones((3, 2)), y=np.arange(3))
+    >>> Xy = load_dataset(dataset_dir, lazy=True)
+    >>> sorted(Xy.keys()), Xy.loaded_keys()
+    (['X', 'y'], [])
+    >>> Xy["y"].tolist(), Xy.loaded_keys()
+    ([0, 1, 2], ['y'])
+    """
+    def __init__(self, path_Xy, mmap_mode="auto"):
+        self.path_Xy = {str(k): str(path_Xy[k]) for k in path_Xy}
+        self.mmap_mode = mmap_mode
+        self._loaded = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_loaded"] = dict()
+        return state
+
+    def __getitem__(self, key):
+        if not key in self._loaded:
+            self._loaded[key] = _load_dataset_file(self.path_Xy[key],
+                                                   self.mmap_mode)
+        return self._loaded[key]
+
+    def __iter__(self):
+        return iter(self.path_Xy)
+
+    def __len__(self):
+        return len(self.path_Xy)
+
+    def __contains__(self, key):
+        return key in self.path_Xy
+
+    def loaded_keys(self):
+        """Keys of the entries loaded so far"""
+        return sorted(self._loaded.keys())
+
+
+def load_dataset(dataset_dir, mmap_mode="auto", lazy=False):
     '''Load a dictionary
     Load a dictionary from save_dataset
 
@@ -591,9 +822,13 @@ def load_dataset(dataset_dir, mmap_mode="auto"):
         the directory where you want to load your dataset
 
     mmap_mode: {None, ‘r+’, ‘r’, ‘w+’, ‘c’, 'auto'}, optional :
-        'auto' means that the system determine if we use memory mapping or not.
+        'auto' means that the system determine if we use memory mapping or not
+        (read-only, 'r', if so).
         See numpy.load for the meaning of the other arguments.
 
+    lazy: boolean
+        If True, return a LazyDataset: each entry is loaded on first access.
+
     Example
     -------
     from epac.utils import load_dataset
@@ -609,19 +844,11 @@ def load_dataset(dataset_dir, mmap_mode="auto"):
     file_dict_index = open(index_filepath, "r")
     path_Xy = json.load(file_dict_index)
     file_dict_index.close()
+    if lazy:
+        return LazyDataset(path_Xy, mmap_mode)
     res = {}
     for key in path_Xy:
-        data = None
-        filepath = path_Xy[key]
-        if not mmap_mode:
-            data = np.load(filepath)
-        elif (not "auto" in mmap_mode) and mmap_mode:
-            data = np.load(filepath, mmap_mode)
-        elif ("auto" in mmap_mode) and is_need_mem(filepath):
-            data = np.load(filepath, "r+")
-        else:
-            data = np.load(filepath)
-        res[key] = data
+        res[key] = _load_dataset_file(path_Xy[key], mmap_mode)
     return res
 
 
@@ -7,14 +7,17 @@ Base Workflow node plus keys manipulation utilities.
 
 import re
 import sys
+import copy
 import ast
+import hashlib
 import numpy as np
 import warnings
 from abc import abstractmethod
 
-from epac.stores import StoreMem
+from epac.stores import StoreMem, create_store_mem, deep_nbytes
 from epac.configuration import conf, debug
-from epac.map_reduce.results import ResultSet, Result
+from epac import hooks
+from epac.map_reduce.results import ResultSet, Result, ReduceCache
 
 ## ================================= ##
 ## == Key manipulation utils      == ##
@@ -112,12 +115,116 @@ def signature_eval(signature):
         return [("name", signature)]
 
 
+def _iter_results(results):
+    """Iterate over results: a ResultSet, a single Result, or None"""
+    if results is None:
+        return iter([])
+    if isinstance(results, Result):
+        return iter([results])
+    return iter(results)
+
+
+def get_input_keys(nodes):
+    """Union of the inputs read by the nodes (see BaseNode.get_input_keys),
+    None if one of them does not tell.
+
+    Example
+    -------
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Methods
+    >>> from epac.workflow.base import get_input_keys
+    >>> root = CV(Methods(SVC(), SVC(C=10)))
+    >>> sorted(get_input_keys(root.walk_true_nodes()))
+    ['X', 'y']
+    """
+    input_keys = set()
+    for node in nodes:
+        node_input_keys = node.get_input_keys()
+        if node_input_keys is None:
+            return None
+        input_keys.update(node_input_keys)
+    return input_keys
+
+
+def _node_class(node):
+    """Class name of the (wrapped) node"""
+    return getattr(node, "wrapped_node", node).__class__.__name__
+
+
+# Attributes of the nodes accounted apart by _account_node
+_ACCOUNTED_APART = ("parent", "children", "wrapped_node", "store",
+                    "reduce_cache")
+
+
+def _account_node(node, seen):
+    """Yield the (part, key, resident, mapped) of the memory of a node
+    ("estimator" and "other", its stores and caches aside), see
+    deep_nbytes"""
+    resident, mapped = deep_nbytes(getattr(node, "wrapped_node", None),
+                                   seen)
+    yield "estimator", node.get_key(), resident, mapped
+    resident = sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+    mapped = 0
+    for name in node.__dict__:
+        if not name in _ACCOUNTED_APART:
+            nbytes = deep_nbytes(node.__dict__[name], seen)
+            resident += nbytes[0]
+            mapped += nbytes[1]
+    if isinstance(node.children, list):
+        resident += sys.getsizeof(node.children)
+    elif node.children is not None:
+        resident += sys.getsizeof(node.children) + \
+            sys.getsizeof(node.children.__dict__)
+    yield "other", node.get_key(), resident, mapped
+
+
+def _store_entries(store):
+    """The (key, object) held in memory by a store"""
+    from epac.stores import SpillDict
+    if not isinstance(store, StoreMem):
+        return []
+    if isinstance(store.dict, SpillDict):
+        return [(key, store.dict._mem[key][0]) for key in store.dict._mem]
+    return store.dict.items()
+
+
+def _account_tree(nodes, seen):
+    """Yield the (node, key, part, resident, mapped) of the memory of the
+    nodes: by node ("node" then its parts), then by entry of their stores
+    ("entry", then "store") and reduce caches ("entry", then "cache"). The
+    node of an entry is None, its key is the one of its node."""
+    for node in nodes:
+        yield node, node.get_key(), "node", 0, 0
+        for part, key, resident, mapped in _account_node(node, seen):
+            yield node, key, part, resident, mapped
+    for node in nodes:
+        for part, holder, entries in [
+                ("store", node.store, _store_entries(node.store)),
+                ("cache", node.reduce_cache,
+                 node.reduce_cache.entries.items()
+                 if node.reduce_cache else [])]:
+            if holder is None:
+                continue
+            for key, obj in entries:
+                if part == "store":
+                    key = key_pop(key)[0]  # the key of the node
+                resident, mapped = deep_nbytes(obj, seen)
+                yield None, key, "entry", 0, 0
+                yield None, key, part, resident, mapped
+            # The rest of the store or cache belongs to its node
+            resident, mapped = deep_nbytes(holder, seen)
+            yield node, node.get_key(), part, resident, mapped
+
+
 ## ======================================= ##
 ## == Workflow Node base abstract class == ##
 ## ======================================= ##
 
 class BaseNode(object):
     """WorkFlow Node base abstract class"""
+    # Event fired with the time taken by transform in top_down (see
+    # epac.hooks), None for no event
+    transform_event = None
 
     def __init__(self):
         self.parent = None
@@ -133,6 +240,8 @@ class BaseNode(object):
         self.signature_args = None  # dict of args to build the node signature
         self.reducer = None
         self.stop_top_down = False
+        self.retention_policy = None
+        self.reduce_cache = None
 
     def __repr__(self):
         return self.get_key()
@@ -379,6 +488,12 @@ class BaseNode(object):
     def get_parameters(self):
         """Return the state of the object"""
 
+    def get_input_keys(self):
+        """Return the names of the inputs (keys of Xy) that transform reads,
+        the downstream nodes aside. None (default) means unknown: any input
+        may be read."""
+        return None
+
     def get_store(self, name="default"):
         """Return the first store found on the path to tree root. If no store
         has been defined create one on the tree root and return it."""
@@ -388,15 +503,32 @@ class BaseNode(object):
             if curr.store:
                 if not closest_store:
                     closest_store = curr.store
-                if curr.store.load(key_push(self.get_key(), name)):
+                if curr.store.contains(key_push(self.get_key(), name)):
                     return curr.store
             if not curr.parent:
                 if closest_store:
                     return closest_store
-                curr.store = StoreMem()
+                curr.store = create_store_mem()
                 return curr.store
             curr = curr.parent
 
+    def get_retention_policy(self):
+        """Return the first retention policy found on the path to tree root,
+        None if there is no policy.
+
+        See also
+        --------
+        epac.map_reduce.results.RetentionPolicy
+        """
+        curr = self
+        while curr:
+            # Trees saved before retention policies do not have the attribute
+            policy = getattr(curr, "retention_policy", None)
+            if policy:
+                return policy
+            curr = curr.parent
+        return None
+
     def stats(self, group_by="key", sort_by="count"):
         """Statistics on the workflow
             Parameters
@@ -404,9 +536,12 @@ class BaseNode(object):
             group_by: str
                 Group by "key" or class name: "class" (default "key")
             sort_by: str
-                Sort by "count" or "size" (default "count")
+                Sort by "count" or "size" (default "count"). The size is
+                the resident memory of the nodes, see memory_stats.
         """
         stat_dict = dict()
+        seen = set([id(n) for n in self.walk_true_nodes()])
+        accounted = set()
         for n in self.walk_nodes():
             if group_by == "class":
                 name = n.__class__.__name__
@@ -415,13 +550,98 @@ class BaseNode(object):
             if not (name in stat_dict):
                 stat_dict[name] = [0, 0]
             stat_dict[name][0] += 1
-            stat_dict[name][1] += sys.getsizeof(n)
+            # The children of a VirtualList are the same node
+            if not id(n) in accounted:
+                accounted.add(id(n))
+                stat_dict[name][1] += sum([resident for _, _, resident, _
+                                           in _account_node(n, seen)])
         stat = [(name, stat_dict[name][0], stat_dict[name][1]) for name in
                 stat_dict]
         idx = 2 if sort_by == "size" else 1
         order = np.argsort([s[idx] for s in stat])[::-1]
         return [stat[i] for i in order]
 
+    def memory_stats(self, group_by="key", depth=None, sort_by="resident"):
+        """Deep memory accounting of the tree: the bytes of the (wrapped)
+        estimators, of the other attributes of the nodes, of the contents
+        of the in-memory stores (StoreMem, StoreHybrid) and of the reduce
+        caches. Objects are counted once, by the first node or entry which
+        references them, and memory mapped arrays apart.
+
+        The store and cache entries are accounted to the node of their key,
+        the children of a splitter (VirtualList) once.
+
+        Parameters
+        ----------
+        group_by: str
+            Group by "key" (default), key prefix ("key" with depth), class
+            name of the (wrapped) nodes ("class") or "signature".
+
+        depth: int
+            Number of signatures of the key prefixes (default whole keys).
+
+        sort_by: str
+            Sort by decreasing "resident" (default), "mapped", "estimator",
+            "store", "cache", "other" or "count".
+
+        Return
+        ------
+        A list of (name, count, resident, mapped, estimator, store, cache,
+        other): count is the number of nodes and entries, resident the
+        bytes in memory (estimator + store + cache + other), mapped the
+        bytes of memory mapped arrays.
+
+        Example
+        -------
+        >>> from sklearn import datasets
+        >>> from sklearn.svm import SVC
+        >>> from epac import CV, Methods
+        >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+        ...                                     n_informative=2,
+        ...                                     random_state=1)
+        >>> wf = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+        >>> _ = wf.run(X=X, y=y)
+        >>> [(name, count) for name, count, resident, mapped, estimator,
+        ...  store, cache, other in wf.memory_stats(group_by="class",
+        ...                                         sort_by="count")]
+        [('SVC', 6), ('CRSlicer', 1), ('CV', 1), ('Methods', 1)]
+        >>> sorted([name for name, count, resident, mapped, estimator, store,
+        ...         cache, other in wf.memory_stats(depth=2)])
+        ['CV', 'CV/CV(nb=0)', 'CV/CV(nb=1)']
+        """
+        fields = ("count", "resident", "mapped", "estimator", "store",
+                  "cache", "other")
+        nodes = list(self.walk_true_nodes())
+        # Class of the nodes by signature name, for the entries
+        classes = dict([(signature_eval(n.get_signature())[0][1],
+                         _node_class(n)) for n in nodes])
+
+        def group_name(key, cls):
+            if group_by == "class":
+                return cls
+            if group_by == "signature":
+                return key_split(key)[-1]
+            return conf.SEP.join(key_split(key)[:depth])
+
+        groups = dict()
+        seen = set([id(n) for n in nodes])
+        for node, key, part, resident, mapped in \
+                _account_tree(nodes, seen):
+            name = group_name(key, classes.get(
+                signature_eval(key_split(key)[-1])[0][1], _node_class(node))
+                if node is None else _node_class(node))
+            if not name in groups:
+                groups[name] = dict([(field, 0) for field in fields])
+            group = groups[name]
+            group["count"] += 1 if part in ("node", "entry") else 0
+            group["resident"] += resident
+            group["mapped"] += mapped
+            group[part if part in fields else "other"] += resident
+        names = sorted(sorted(groups),
+                       key=lambda name: groups[name][sort_by], reverse=True)
+        return [tuple([name] + [groups[name][field] for field in fields])
+                for name in names]
+
     # ------------------------------------------ #
     # -- Top-down data-flow operations        -- #
     # ------------------------------------------ #
@@ -471,9 +691,15 @@ class BaseNode(object):
         if debug.DEBUG:
             debug.current = self
             debug.Xy = Xy
+        if "enter" in hooks.listeners:
+            hooks.fire("enter", self)
         if not self.parent:
             self.initialization(**Xy)  # Performe some initialization
-        Xy = self.transform(**Xy)
+        if self.transform_event:
+            Xy = hooks.call(self.transform_event, self, self.transform,
+                            kwargs=Xy)
+        else:
+            Xy = self.transform(**Xy)
 
         if not self.stop_top_down:
             if self.children:
@@ -483,7 +709,12 @@ class BaseNode(object):
                 Xy = ret[0] if len(ret) == 1 else ret
             else:
                 result = Result(key=self.get_signature(), **Xy)
+                policy = self.get_retention_policy()
+                if policy:
+                    result = policy.apply(result)
                 self.save_results(ResultSet(result))
+        if "exit" in hooks.listeners:
+            hooks.fire("exit", self)
         return Xy
 
     def get_children_top_down(self):
@@ -504,19 +735,112 @@ class BaseNode(object):
     # --------------------------------------------- #
     def reduce(self, store_results=True):
         if self.children:
+            if not self.reducer:
+                # Append node signature in the keys
+                return ResultSet(*self.reduce_iter())
             # 1) Build sub-aggregates over children
             children_result_set = [child.reduce(store_results=False) for
                                    child in self.children]
             result_set = ResultSet(*children_result_set)
-            if self.reducer:
-                return self.reducer.reduce(result_set)
-            # Append node signature in the keys
-            for result in result_set:
-                result["key"] = key_push(self.get_signature(), result["key"])
-            return result_set
+            return self.reducer.reduce(result_set)
         else:
             return self.load_results()
 
+    def reduce_iter(self, partials=None):
+        """Streaming reduce: yield the reduced results one by one.
+
+        The results of the children are read as they are yielded, so that
+        the splitters which group them (see BaseNodeSplitter) only keep the
+        state of their reducer for each group (see Reducer.fold), not the
+        results of the whole subtree. A node whose reducer takes the whole
+        ResultSet of its children falls back to reduce().
+
+        Parameters
+        ----------
+        partials: dictionary
+            Results of subtrees already reduced (see parallel_reduce),
+            indexed by the key of their root node, they are used instead of
+            reducing the subtrees again.
+
+        On the tree root, the ReduceCache of the tree (attribute
+        "reduce_cache", see conf.REDUCE_CACHE) is used as partials: only
+        the nodes whose results have changed since the last reduce are
+        reduced again.
+
+        Example
+        -------
+        >>> from sklearn import datasets
+        >>> from sklearn.svm import SVC
+        >>> from epac import CV, Perms, Methods
+        >>> X, y = datasets.make_classification(n_samples=20, n_features=5,
+        ...                                     n_informative=2,
+        ...                                     random_state=1)
+        >>> wf = Perms(CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2),
+        ...            n_perms=3, random_state=0)
+        >>> _ = wf.run(X=X, y=y)
+        >>> [result["key"] for result in wf.reduce_iter()]
+        ['SVC(C=1)', 'SVC(C=3)']
+        """
+        if partials is None and not self.parent:
+            if conf.REDUCE_CACHE and not getattr(self, "reduce_cache", None):
+                self.reduce_cache = ReduceCache()
+            partials = getattr(self, "reduce_cache", None)
+            if partials is not None:
+                partials.set_stamps(self.reduce_stamps())
+        results = None
+        if partials is not None:
+            key = self.get_key()
+            if key in partials:
+                return iter(partials[key])
+            if isinstance(partials, ReduceCache) and self.children:
+                results = partials.record(key, self._reduce_iter(partials))
+        if results is None:
+            results = self._reduce_iter(partials)
+        if "reduce" in hooks.listeners:
+            results = hooks.call_iter("reduce", self, results)
+        return results
+
+    def reduce_stamps(self):
+        """Return the stamps of the results that the reduce of each node of
+        the subtree is built from, indexed by node key (see ReduceCache).
+        A stamp changes when results below the node are saved again, it is
+        None if a store can not tell (see Store.version)."""
+        stamps = dict()
+        self._reduce_stamp(stamps)
+        return stamps
+
+    def _reduce_stamp(self, stamps):
+        key = self.get_key()
+        if not self.children:
+            stamp = self.get_store(name=conf.RESULT_SET).version(
+                key_push(key, conf.RESULT_SET))
+        else:
+            children_stamps = [child._reduce_stamp(stamps)
+                               for child in self.children]
+            if None in children_stamps:
+                stamp = None
+            else:
+                stamp = hashlib.sha1(repr((id(self.reducer),
+                                           children_stamps))).hexdigest()
+        stamps[key] = stamp
+        return stamp
+
+    def _reduce_iter(self, partials):
+        """reduce_iter() of the node itself, to be overloaded"""
+        if not self.children:
+            for result in _iter_results(self.load_results()):
+                yield result
+        elif self.reducer:
+            for result in _iter_results(self.reduce(store_results=False)):
+                yield result
+        else:
+            for child in self.children:
+                for result in child.reduce_iter(partials):
+                    result = copy.copy(result)
+                    result["key"] = key_push(self.get_signature(),
+                                             result["key"])
+                    yield result
+
     # -------------------------------- #
     # -- I/O persistance operations -- #
     # -------------------------------- #
@@ -524,7 +848,9 @@ class BaseNode(object):
         """ Save ResultSet
         """
         store = self.get_store()
-        store.save(key_push(self.get_key(), conf.RESULT_SET), results)
+        hooks.call("save", self, store.save,
+                   (key_push(self.get_key(), conf.RESULT_SET), results),
+                   results=results)
 
     def load_results(self):
         """ Load ResultSet
@@ -545,6 +871,12 @@ class BaseNode(object):
         """I/O (persistance) operation: save the whole tree: ie.: execution
         tree + stores.
 
+        The results of a node are saved in the store of its parent
+        ("<parent key>/store"): the results of sibling nodes, such as the
+        children of a Methods, are in the same file, arrays they share are
+        written once. Trees saved with one store by node (before this
+        grouping) are loaded alike, see epac.stores.assemble_tree.
+
         Parameters
         ----------
         store: Store
@@ -557,10 +889,13 @@ class BaseNode(object):
         stores = dict()
         for node in self.walk_true_nodes():
             if node.store:
-                for key_dict in node.store.dict:
+                for key_dict in node.store.keys():
                     node_key, _ = key_pop(key_dict)
-                    stores[node_key] = StoreMem()
-                    stores[node_key].dict[key_dict] = node.store.dict[key_dict]
+                    if conf.SEP in node_key:
+                        node_key, _ = key_pop(node_key)
+                    if not node_key in stores:
+                        stores[node_key] = StoreMem()
+                    stores[node_key].save(key_dict, node.store.load(key_dict))
                 node.store = None
         store.save(key=conf.STORE_EXECUTION_TREE_PREFIX,
                    obj=self, protocol="bin")
@@ -628,10 +963,13 @@ class BaseNode(object):
 
         '''
         if not self.store:
-            self.store = StoreMem()
+            self.store = create_store_mem()
         for each_node in another_tree_root.walk_true_nodes():
-            if each_node.store:
-                self.store.dict.update(each_node.store.dict)
+            # A shared store (StoreSQLite) already holds the results
+            if each_node.store and \
+                    not getattr(each_node.store, "is_shared", False):
+                for key in each_node.store.keys():
+                    self.store.save(key, each_node.store.load(key))
 
 
 if __name__ == "__main__":
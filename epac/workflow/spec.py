@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative specification of a tree: a JSON-able description of its
+structure (node types, wrapped estimators with their class path and
+get_params(), splitters parameters, reducers, retention policies) from
+which the tree is built again without unpickling it.
+
+Jobs rebuild from it only the subtrees they run (see tree_from_spec and
+bin/epac_mapper): the methods which are not on the path to their keys are
+not built. Trees made of nodes this module does not know, or of objects
+that can not be described (a RandomState, a lambda...), raise ValueError:
+they have to be pickled.
+"""
+
+import json
+import types
+import importlib
+import numpy as np
+
+from epac.workflow.base import key_split
+from epac.workflow.wrappers import TransformNode
+from epac.workflow.splitters import CV, Perms, Methods, WarmStartMethods
+from epac.workflow.splitters import CRSplitter, RowSplitter, ColumnSplitter
+from epac.workflow.splitters import BaseNodeSplitter
+from epac.workflow.splitters import CVBestSearchRefit
+from epac.workflow.splitters import CVBestSearchRefitParallel
+from epac.sklearn_plugins.estimators import Estimator
+from epac.map_reduce.results import RetentionPolicy
+
+SPEC_VERSION = 1
+
+_ESTIMATOR_ARGS = ["in_args_fit", "in_args_transform", "in_args_predict",
+                   "out_args_predict"]
+
+
+def _class_path(obj_class):
+    return obj_class.__module__ + "." + obj_class.__name__
+
+
+def _import_path(path):
+    module_name, _, name = str(path).rpartition(".")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def _new_instance(obj_class, state):
+    """Create an instance of obj_class with state as __dict__, without
+    calling __init__ (as unpickling does)."""
+    if isinstance(obj_class, types.ClassType):
+        obj = types.InstanceType(obj_class)
+    else:
+        obj = obj_class.__new__(obj_class)
+    obj.__dict__.update(state)
+    return obj
+
+
+def encode_value(value):
+    """Return a JSON-able description of value, see decode_value.
+
+    Plain values are kept, tuples, dictionaries, numpy arrays and scalars,
+    importable functions and classes, and estimators (objects with
+    get_params) are described. ValueError is raised for anything else.
+
+    Example
+    -------
+    >>> from sklearn.svm import SVC
+    >>> from epac.workflow.spec import encode_value, decode_value
+    >>> spec = encode_value(SVC(C=3, class_weight={0: 1, 1: 2}))
+    >>> spec["__estimator__"]
+    'sklearn.svm.classes.SVC'
+    >>> svc = decode_value(spec)
+    >>> svc.C, svc.class_weight
+    (3, {0: 1, 1: 2})
+    """
+    if value is None or type(value) in (bool, int, long, float, str,
+                                        unicode):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if type(value) is list:
+        return [encode_value(v) for v in value]
+    if type(value) is tuple:
+        return {"__tuple__": [encode_value(v) for v in value]}
+    if isinstance(value, dict):
+        return {"__dict__": [[encode_value(k), encode_value(value[k])]
+                             for k in value]}
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        return {"__array__": value.tolist(), "dtype": value.dtype.str}
+    if hasattr(value, "get_params") and not isinstance(value, type):
+        return {"__estimator__": _class_path(value.__class__),
+                "params": encode_value(value.get_params(deep=False))}
+    if isinstance(value, (type, types.ClassType, types.FunctionType,
+                          types.BuiltinFunctionType)):
+        path = _class_path(value)
+        try:
+            if _import_path(path) is value:
+                return {"__callable__": path}
+        except (ImportError, AttributeError):
+            pass
+    raise ValueError("%r can not be described in a tree specification" %
+                     (value,))
+
+
+def decode_value(spec):
+    """Return the value described by spec, see encode_value."""
+    if type(spec) is list:
+        return [decode_value(v) for v in spec]
+    if not isinstance(spec, dict):
+        if isinstance(spec, unicode):
+            return str(spec)
+        return spec
+    if "__tuple__" in spec:
+        return tuple(decode_value(v) for v in spec["__tuple__"])
+    if "__dict__" in spec:
+        return dict((decode_value(k), decode_value(v))
+                    for k, v in spec["__dict__"])
+    if "__array__" in spec:
+        return np.array(spec["__array__"],
+                        dtype=np.dtype(str(spec["dtype"])))
+    if "__estimator__" in spec:
+        return _import_path(spec["__estimator__"])(
+            **decode_value(spec["params"]))
+    if "__callable__" in spec:
+        return _import_path(spec["__callable__"])
+    raise ValueError("Unknown value specification: %r" % (spec,))
+
+
+def _encode_reducer(reducer):
+    if reducer is None:
+        return None
+    return {"class": _class_path(reducer.__class__),
+            "state": encode_value(reducer.__dict__)}
+
+
+def _decode_reducer(spec):
+    if spec is None:
+        return None
+    return _new_instance(_import_path(spec["class"]),
+                         decode_value(spec["state"]))
+
+
+def _cv_kwargs(cv):
+    return dict(n_folds=cv.n_folds, random_state=cv.random_state,
+                cv_type=cv.cv_type, cv_key=cv.cv_key)
+
+
+def _node_to_spec(node):
+    node_type = type(node)
+    spec = dict(type=node_type.__name__, signature=node.get_signature())
+    children = list()
+    if node_type in (CV, Perms, CRSplitter, RowSplitter, ColumnSplitter):
+        spec["node"] = _node_to_spec(node.slicer.children[0])
+        if node_type is CV:
+            params = _cv_kwargs(node)
+        elif node_type is Perms:
+            params = dict(n_perms=node.n_perms, permute=node.permute,
+                          random_state=node.random_state,
+                          col_or_row=node.col_or_row)
+        else:
+            params = dict(indices_of_groups=node.indices_of_groups)
+            if node_type is CRSplitter:
+                params["col_or_row"] = node.slicer.col_or_row
+    elif node_type in (Methods, WarmStartMethods):
+        params = dict()
+        spec["nodes"] = [_node_to_spec(child) for child in node.children]
+    elif node_type in (CVBestSearchRefit, CVBestSearchRefitParallel):
+        cv = node.cv if node_type is CVBestSearchRefit else node.children[0]
+        children = node.children[1:] if node_type is \
+            CVBestSearchRefitParallel else node.children
+        spec["node"] = _node_to_spec(cv.slicer.children[0])
+        params = _cv_kwargs(cv)
+        params.update(score=node.score, arg_max=node.arg_max)
+    elif node_type in (Estimator, TransformNode) and \
+            hasattr(node.wrapped_node, "get_params"):
+        spec["class"] = _class_path(node.wrapped_node.__class__)
+        params = node.wrapped_node.get_params(deep=False)
+        for name in _ESTIMATOR_ARGS:
+            if hasattr(node, name):
+                spec[name] = getattr(node, name)
+        children = node.children
+    else:
+        raise ValueError("%s nodes can not be described in a tree "
+                         "specification" % node_type.__name__)
+    spec["params"] = encode_value(params)
+    if children:
+        spec["children"] = [_node_to_spec(child) for child in children]
+    if node.signature_args is not None and \
+            not node_type in (CVBestSearchRefit, CVBestSearchRefitParallel):
+        spec["signature_args"] = encode_value(node.signature_args)
+    if not node_type is CVBestSearchRefitParallel:
+        spec["reducer"] = _encode_reducer(node.reducer)
+    if isinstance(node, BaseNodeSplitter):
+        spec["need_group_key"] = node.need_group_key
+    if node.retention_policy:
+        spec["retention_policy"] = dict(
+            drop=node.retention_policy.drop,
+            downcast=node.retention_policy.downcast,
+            downcast_keys=node.retention_policy.downcast_keys)
+    return spec
+
+
+def _select_paths(paths, signature):
+    """Return the paths below the node of signature, None if the whole
+    subtree is needed, an empty list if none goes through it."""
+    if paths is None:
+        return None
+    below = list()
+    for path in paths:
+        if path[0] == signature:
+            if len(path) == 1:
+                return None
+            below.append(path[1:])
+    return below
+
+
+def _below_slicer(paths):
+    """Paths below the slicer of a splitter, whichever its child."""
+    if paths is None:
+        return None
+    if [path for path in paths if len(path) == 1]:
+        return None
+    return [path[1:] for path in paths]
+
+
+def _children_from_spec(specs, paths):
+    children = list()
+    for spec in specs:
+        child_paths = _select_paths(paths, spec["signature"])
+        if child_paths is None or child_paths:
+            children.append(_node_from_spec(spec, child_paths))
+    return children
+
+
+def _node_from_spec(spec, paths=None):
+    node_type = spec["type"]
+    params = decode_value(spec["params"])
+    if node_type in ("CV", "Perms", "CRSplitter", "RowSplitter",
+                     "ColumnSplitter"):
+        node_class = dict(CV=CV, Perms=Perms, CRSplitter=CRSplitter,
+                          RowSplitter=RowSplitter,
+                          ColumnSplitter=ColumnSplitter)[node_type]
+        subtree_paths = _select_paths(_below_slicer(paths),
+                                      spec["node"]["signature"])
+        subtree = _node_from_spec(spec["node"], subtree_paths)
+        node = node_class(subtree, **params)
+    elif node_type in ("Methods", "WarmStartMethods"):
+        if node_type == "WarmStartMethods":
+            # each method starts from the state of the previous one
+            paths = None
+            node_class = WarmStartMethods
+        else:
+            node_class = Methods
+        node = node_class(*_children_from_spec(spec["nodes"], paths))
+    elif node_type in ("CVBestSearchRefit", "CVBestSearchRefitParallel"):
+        node_class = CVBestSearchRefit if node_type == "CVBestSearchRefit" \
+            else CVBestSearchRefitParallel
+        node = node_class(_node_from_spec(spec["node"]), **params)
+    elif node_type in ("Estimator", "TransformNode"):
+        wrapped_node = _import_path(spec["class"])(**params)
+        args = dict((name, decode_value(spec[name]))
+                    for name in _ESTIMATOR_ARGS
+                    if name in spec)
+        if node_type == "TransformNode":
+            node = TransformNode(wrapped_node, **args)
+        else:
+            node = Estimator(wrapped_node, **args)
+    else:
+        raise ValueError("Unknown node type in tree specification: %s" %
+                         node_type)
+    if "signature_args" in spec:
+        node.signature_args = decode_value(spec["signature_args"])
+    if "reducer" in spec:
+        node.reducer = _decode_reducer(spec["reducer"])
+    if "need_group_key" in spec:
+        node.need_group_key = spec["need_group_key"]
+    if "retention_policy" in spec:
+        policy = spec["retention_policy"]
+        downcast_keys = policy.get("downcast_keys")
+        if downcast_keys is not None:
+            downcast_keys = [str(regexp) for regexp in downcast_keys]
+        node.retention_policy = RetentionPolicy(
+            drop=[str(regexp) for regexp in policy["drop"]],
+            downcast=policy["downcast"],
+            downcast_keys=downcast_keys)
+    if "children" in spec:
+        node.add_children(_children_from_spec(spec["children"], paths))
+    return node
+
+
+def tree_to_spec(tree_root):
+    """Return the specification of the tree, a JSON-able dictionary.
+
+    Raise ValueError if the tree can not be described: it is made of nodes
+    or objects this module does not know.
+
+    Example
+    -------
+    >>> import json
+    >>> from sklearn.svm import SVC
+    >>> from epac import CV, Methods
+    >>> from epac.workflow.spec import tree_to_spec, tree_from_spec
+    >>> tree = CV(Methods(SVC(C=1), SVC(C=3)), n_folds=2)
+    >>> spec = json.loads(json.dumps(tree_to_spec(tree)))
+    >>> [leaf.get_key() for leaf in tree_from_spec(spec).walk_leaves()]
+    ['CV/CV(nb=0)/Methods/SVC(C=1)', 'CV/CV(nb=0)/Methods/SVC(C=3)', 'CV/CV(nb=1)/Methods/SVC(C=1)', 'CV/CV(nb=1)/Methods/SVC(C=3)']
+    >>> tree = tree_from_spec(spec, keys=['CV/CV(nb=1)/Methods/SVC(C=3)'])
+    >>> [leaf.get_key() for leaf in tree.walk_leaves()]
+    ['CV/CV(nb=0)/Methods/SVC(C=3)', 'CV/CV(nb=1)/Methods/SVC(C=3)']
+    """
+    return dict(version=SPEC_VERSION, root=_node_to_spec(tree_root))
+
+
+def tree_from_spec(spec, keys=None):
+    """Build the tree described by spec (see tree_to_spec).
+
+    Parameters
+    ----------
+    spec: dictionary
+        Specification returned by tree_to_spec, or read back from JSON.
+
+    keys: list of str
+        Keys of the nodes to be run. If given, only the subtrees of these
+        nodes, and their paths to the root, are built: the methods out of
+        these paths are left out. Default None: the whole tree.
+    """
+    if spec.get("version") != SPEC_VERSION:
+        raise ValueError("Unknown tree specification version: %r" %
+                         spec.get("version"))
+    root = spec["root"]
+    paths = None
+    if keys is not None:
+        paths = [key_split(key) for key in keys]
+        for key, path in zip(keys, paths):
+            if path[0] != root["signature"]:
+                raise ValueError("%s is not a key of the tree" % key)
+        paths = _select_paths(paths, root["signature"])
+    return _node_from_spec(root, paths)
+
+
+def save_tree_spec(tree_root, filepath):
+    """Write the specification of the tree in filepath, in JSON."""
+    outfile = open(filepath, "w")
+    json.dump(tree_to_spec(tree_root), outfile)
+    outfile.close()
+
+
+def load_tree_spec(filepath, keys=None):
+    """Build the tree from the specification written in filepath, see
+    tree_from_spec."""
+    infile = open(filepath, "r")
+    spec = json.load(infile)
+    infile.close()
+    return tree_from_spec(spec, keys=keys)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -20,10 +20,11 @@ import numpy as np
 import copy
 
 from epac.workflow.base import BaseNode, key_push, key_pop
-from epac.workflow.base import key_split
+from epac.workflow.base import key_split, get_input_keys
+from epac.workflow.base import _iter_results
 from epac.workflow.factory import NodeFactory
 from epac.workflow.wrappers import Wrapper
-from epac.stores import StoreMem
+from epac.stores import StoreMem, create_store_mem
 from epac.utils import train_test_split
 from epac.utils import _list_indices, dict_diff, _sub_dict
 from epac.utils import get_list_from_lists
@@ -56,40 +57,60 @@ class BaseNodeSplitter(BaseNode):
         super(BaseNodeSplitter, self).__init__()
         self.need_group_key = need_group_key
 
+    def get_input_keys(self):
+        return []
+
     def reduce(self, store_results=True):
         # Terminaison (leaf) node return results
         if not self.children:
             return self.load_results()
+        if not self.reducer or self.need_group_key:
+            return ResultSet(*self.reduce_iter())
         # 1) Build sub-aggregates over children
         children_results = [child.reduce(store_results=False) for
                             child in self.children]
         result_set = ResultSet(*children_results)
-        if not self.reducer:
-            return result_set
+        reduced = ResultSet()
+        reduced.add(self.reducer.reduce(result_set))
+        return reduced
 
+    def _reduce_iter(self, partials):
+        """Streaming reduce (see BaseNode.reduce_iter): the results of the
+        children are folded into the reducer state of their group as they
+        come (see Reducer.fold), the groups are reduced once all the
+        children have been read."""
+        if not self.children:
+            for result in super(BaseNodeSplitter, self)._reduce_iter(
+                    partials):
+                yield result
+            return
+        if not self.reducer:
+            for child in self.children:
+                for result in child.reduce_iter(partials):
+                    yield result
+            return
         if not self.need_group_key:
-            reduced = ResultSet()
-            reduced.add(self.reducer.reduce(result_set))
-            return reduced
-
+            for result in self.reduce(store_results=False):
+                yield result
+            return
         # Group by key, without consideration of the fold/permutation number
         # which is the head of the key
         # use OrderedDict to preserve runing order
         from collections import OrderedDict
-        groups = OrderedDict()
-        for result in result_set:
-            # remove the head of the key
-            _, key_tail = key_pop(result["key"], index=0)
-            result["key"] = key_tail
-            if not key_tail in groups:
-                groups[key_tail] = list()
-            groups[key_tail].append(result)
-        # For each key, stack results
-        reduced = ResultSet()
-        for key in groups:
-            result_stacked = Result.stack(*groups[key])
-            reduced.add(self.reducer.reduce(result_stacked))
-        return reduced
+        states = OrderedDict()
+        for child in self.children:
+            for result in child.reduce_iter(partials):
+                # remove the head of the key
+                _, key_tail = key_pop(result["key"], index=0)
+                result = copy.copy(result)
+                result["key"] = key_tail
+                if not key_tail in states:
+                    states[key_tail] = self.reducer.fold_init()
+                states[key_tail] = self.reducer.fold(states[key_tail], result)
+        # For each key, reduce the folded results
+        while states:
+            _, state = states.popitem(last=False)
+            yield self.reducer.fold_finalize(state)
 
 
 class CV(BaseNodeSplitter):
@@ -193,6 +214,9 @@ class CV(BaseNodeSplitter):
     def get_parameters(self):
         return dict(n_folds=self.n_folds)
 
+    def get_input_keys(self):
+        return [self.cv_key]
+
 
 class Perms(BaseNodeSplitter):
     """Permutation parallelization.
@@ -255,6 +279,9 @@ class Perms(BaseNodeSplitter):
     def get_parameters(self):
         return dict(n_perms=self.n_perms, permute=self.permute)
 
+    def get_input_keys(self):
+        return [self.permute]
+
     def transform(self, **Xy):
         # Set the slicing
         if not self.permute in Xy:
@@ -315,13 +342,22 @@ class Methods(BaseNodeSplitter):
         return Xy
 
     def reduce(self, store_results=True):
+        if not self.reducer:
+            return ResultSet(*self.reduce_iter())
         # 1) Build sub-aggregates over children
         children_results = [child.reduce(store_results=False) for
                             child in self.children]
         results = ResultSet(*children_results)
+        return self.reducer.reduce(results)
+
+    def _reduce_iter(self, partials):
         if self.reducer:
-            return self.reducer.reduce(results)
-        return results
+            for result in _iter_results(self.reduce(store_results=False)):
+                yield result
+            return
+        for child in self.children:
+            for result in child.reduce_iter(partials):
+                yield result
 
 
 class WarmStartMethods(Methods):
@@ -380,6 +416,8 @@ class VirtualList(collections.Sequence):
 class Slicer(BaseNode):
     """ Slicers are Splitters' children, they re-sclice the downstream blocs.
     """
+    transform_event = "slice"
+
     def __init__(self, signature_name, nb):
         super(Slicer, self).__init__()
         self.signature_name = signature_name
@@ -391,6 +429,9 @@ class Slicer(BaseNode):
     def get_parameters(self):
         return dict(slices=self.slices)
 
+    def get_input_keys(self):
+        return []
+
     def get_signature(self, nb=1):
         """Overload the base name method: use self.signature_name"""
         return self.signature_name + \
@@ -401,10 +442,13 @@ class Slicer(BaseNode):
         return copy.copy(self.signature_args)
 
     def reduce(self, store_results=True):
-        results = ResultSet(self.children[0].reduce(store_results=False))
-        for result in results:
+        return ResultSet(*self.reduce_iter())
+
+    def _reduce_iter(self, partials):
+        for result in self.children[0].reduce_iter(partials):
+            result = copy.copy(result)
             result["key"] = key_push(self.get_signature(), result["key"])
-        return results
+            yield result
 
 
 class CRSlicer(Slicer):
@@ -787,11 +831,14 @@ class CVBestSearchRefitParallel(Wrapper):
     def get_signature(self):
         return self.__class__.__name__
 
+    def get_input_keys(self):
+        return []
+
     def transform(self, **Xy):
         Xy_train, Xy_test = train_test_split(Xy)
         result = Result(key=self.get_signature(), **Xy)
         if not self.store:
-            self.store = StoreMem()
+            self.store = create_store_mem()
         self.save_results(ResultSet(result))
         if Xy_train is Xy_test:
             return Xy
@@ -889,6 +936,9 @@ class CVBestSearchRefit(Wrapper):
     def get_signature(self):
         return self.__class__.__name__
 
+    def get_input_keys(self):
+        return get_input_keys(self.cv.walk_true_nodes())
+
     def transform(self, **Xy):
         Xy_train, Xy_test = train_test_split(Xy)
         if Xy_train is Xy_test:
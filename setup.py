@@ -2,7 +2,8 @@ import os
 from setuptools import setup
 import os.path as op
 
-commands = [op.join('bin', 'epac_mapper')]
+commands = [op.join('bin', 'epac_mapper'),
+            op.join('bin', 'epac_compact_store')]
 
 # Utility function to read the README file.
 # Used for the long_description.  It's nice, because now 1) we have a top level